@@ -0,0 +1,277 @@
+"""
+Awaitable data-access API for the async FastAPI handlers.
+
+The storage engine (app.storage) makes blocking calls. Running them
+directly inside `async def` handlers stalls the event loop, so one slow
+query or commit holds up every in-flight request on the worker. This
+module runs them on a bounded thread pool instead. At most `max_pending`
+calls may be queued or running at once; further callers wait their turn
+(backpressure) instead of piling work onto the executor.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+import app.metrics as metrics
+from app.db_pool import POOL_SIZE
+from app.profiling import current_profile
+from app.storage import storage
+from app.write_pipeline import write_pipeline
+
+T = TypeVar("T")
+
+# One thread per pooled connection keeps threads from waiting on the pool
+MAX_WORKERS = int(os.environ.get("CRUSH_DB_EXECUTOR_WORKERS", str(POOL_SIZE)))
+
+# Calls allowed to be queued or running before callers have to wait
+MAX_PENDING = int(os.environ.get("CRUSH_DB_MAX_PENDING", "256"))
+
+
+class DatabaseExecutor:
+    """Bounded executor for blocking database calls, with queue metrics"""
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._waiting = 0          # callers blocked on backpressure
+        self._queued = 0           # submitted, not yet picked up by a thread
+        self._running = 0
+        self._max_queue_depth = 0
+        self._completed = 0
+        self._failed = 0
+        self._queue_wait_total = 0.0
+        self._run_time_total = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="crush-db",
+                    )
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to the loop they are first used on
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_pending)
+            self._slots_loop = loop
+        return self._slots
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run a blocking function on the executor and await its result"""
+        slots = self._get_slots()
+
+        self._waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        with self._lock:
+            self._queued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queued)
+        submitted_at = time.perf_counter()
+        # run_in_executor doesn't carry context variables to the thread
+        profile = current_profile.get()
+
+        def call():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._queue_wait_total += started_at - submitted_at
+            ok = False
+            try:
+                result = fn(*args, **kwargs) if profile is None else profile.run_call(fn, *args, **kwargs)
+                ok = True
+                return result
+            finally:
+                finished_at = time.perf_counter()
+                metrics.DB_QUEUE_WAIT.observe(started_at - submitted_at)
+                metrics.STORAGE_CALL_DURATION.observe(finished_at - started_at, getattr(fn, "__name__", "call"))
+                with self._lock:
+                    self._running -= 1
+                    self._run_time_total += finished_at - started_at
+                    if ok:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), call)
+        finally:
+            slots.release()
+
+    def metrics(self) -> dict:
+        """Snapshot of executor queue depth and timings"""
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "waiting": self._waiting,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "max_queue_depth": self._max_queue_depth,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_queue_wait_ms": (self._queue_wait_total / finished * 1000) if finished else 0.0,
+                "avg_run_ms": (self._run_time_total / finished * 1000) if finished else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        """Wait for running calls and stop the worker threads"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+# Global executor instance
+executor = DatabaseExecutor()
+
+
+def _use_pipeline() -> bool:
+    # The pipeline batches into a single SQLite database file
+    return write_pipeline.enabled and storage.name == "sqlite" and not storage.db.shards.sharded
+
+
+async def add_crush(
+    crusher_address: str,
+    crush_address_encrypted: bytes,
+    crush_address_hash: str,
+    crusher_address_hash: Optional[str] = None
+) -> bool:
+    """Awaitable version of storage.add_crush"""
+    if _use_pipeline():
+        if crusher_address_hash is None:
+            from app.matcher_engine import matcher_engine
+            crusher_address_hash = await matcher_engine.address_hash(crusher_address)
+        added = await write_pipeline.add_crush(
+            crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash
+        )
+    else:
+        added = await executor.run(
+            storage.add_crush, crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash
+        )
+    if added:
+        metrics.CRUSHES_SUBMITTED.inc()
+    return added
+
+
+async def add_crushes(crushes: List[Tuple[str, bytes, str, str]]) -> Optional[int]:
+    """Awaitable version of storage.add_crushes"""
+    added = await executor.run(storage.add_crushes, crushes)
+    if added is not None:
+        metrics.CRUSHES_SUBMITTED.inc(len(crushes))
+    return added
+
+
+async def remove_crush(wallet_address: str, crush_address_hash: str) -> bool:
+    """Awaitable version of storage.remove_crush"""
+    return await executor.run(storage.remove_crush, wallet_address, crush_address_hash)
+
+
+async def find_mutual_crushes(edges: List[Tuple[str, str, str]]) -> List[Tuple[str, str]]:
+    """Awaitable version of storage.find_mutual_crushes"""
+    return await executor.run(storage.find_mutual_crushes, edges)
+
+
+async def check_mutual_crush(address1: str, address2: str) -> bool:
+    """Awaitable version of storage.check_mutual_crush"""
+    return await executor.run(storage.check_mutual_crush, address1, address2)
+
+
+async def add_match(address1: str, address2: str) -> Optional[str]:
+    """Awaitable version of storage.add_match"""
+    if _use_pipeline():
+        inserted = await write_pipeline.add_match(address1, address2)
+    else:
+        inserted = await executor.run(storage.add_match, address1, address2)
+    if inserted:
+        metrics.MATCHES_CREATED.inc()
+    return inserted
+
+
+async def add_matches(pairs: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+    """Awaitable version of storage.add_matches"""
+    inserted = await executor.run(storage.add_matches, pairs)
+    metrics.MATCHES_CREATED.inc(len(inserted))
+    return inserted
+
+
+async def get_match_proof(address1: str, address2: str) -> Optional[str]:
+    """Awaitable version of storage.get_match_proof"""
+    return await executor.run(storage.get_match_proof, address1, address2)
+
+
+async def set_match_proof(address1: str, address2: str, proof: str) -> bool:
+    """Awaitable version of storage.set_match_proof"""
+    return await executor.run(storage.set_match_proof, address1, address2, proof)
+
+
+async def get_matches_for_user(wallet_address: str) -> List[str]:
+    """Awaitable version of storage.get_matches_for_user"""
+    return await executor.run(storage.get_matches_for_user, wallet_address)
+
+
+async def get_matches_page(
+    wallet_address: str,
+    limit: int,
+    after: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, int, str]]:
+    """Awaitable version of storage.get_matches_page"""
+    return await executor.run(storage.get_matches_page, wallet_address, limit, after)
+
+
+async def get_user_version(wallet_address: str) -> int:
+    """Awaitable version of storage.get_user_version"""
+    return await executor.run(storage.get_user_version, wallet_address)
+
+
+async def get_user_stats(wallet_address: str, include_matches: bool = False) -> dict:
+    """Awaitable version of storage.get_user_stats"""
+    return await executor.run(storage.get_user_stats, wallet_address, include_matches)
+
+
+async def register_user(wallet_address: str, nickname: Optional[str] = None) -> bool:
+    """Awaitable version of storage.register_user"""
+    if _use_pipeline():
+        return await write_pipeline.register_user(wallet_address, nickname)
+    return await executor.run(storage.register_user, wallet_address, nickname)
+
+
+async def start_reconciliation(chunk_size: int, restart: bool = False) -> bool:
+    """Awaitable version of storage.start_reconciliation"""
+    return await executor.run(storage.start_reconciliation, chunk_size, restart)
+
+
+async def get_reconciliation_status() -> dict:
+    """Awaitable version of storage.get_reconciliation_status"""
+    return await executor.run(storage.get_reconciliation_status)
+
+
+async def repair_counters() -> dict:
+    """Awaitable version of storage.repair_counters"""
+    return await executor.run(storage.repair_counters)
+
+
+def close():
+    """Flush queued writes, stop the executor and close the storage engine on shutdown"""
+    write_pipeline.close()
+    executor.shutdown()
+    storage.close()
@@ -0,0 +1,439 @@
+"""
+Streaming bulk import and export of crushes, matches and stats.
+
+Import loads crush submissions, one (crusher_address, crush_address) per
+NDJSON object or CSV row, much faster than replaying them through
+POST /api/crush/submit:
+
+1. The file is parsed one row at a time. Rows missing an address,
+   self-crushes and unparseable lines are skipped and counted. Rows for
+   a crush that is already stored are counted as duplicates.
+2. Batches of rows are hashed (the crush's ciphertext and hash, and the
+   crusher's hash) on `processes` worker processes, with at most two
+   batches per worker in flight, so memory use depends on the batch size
+   and not on the file size.
+3. Each batch is written with storage.add_crushes in one transaction.
+   With `defer_indexes` (the CLI default), the secondary indexes of
+   crushes are dropped on every shard first and rebuilt once after the
+   last batch. Their definitions are kept in deferred_indexes until then,
+   and the next import (or `restore-indexes`) rebuilds any left over by an
+   interrupted one. Lookups of mutual crushes are slow meanwhile, so the
+   HTTP import endpoint doesn't offer it.
+4. Mutual pairs are matched once at the end by a whole-graph
+   reconciliation (app.reconcile) instead of per row. No notifications
+   are sent for them.
+
+Export streams every match (shard by shard, in id order) or the stats of
+every wallet with crushes or matches (user_counters, in address order) as
+NDJSON or CSV. Rows are read in keyset-paginated pages, so memory use is
+constant whatever the table size. Export reads the SQLite tables; the
+memory engine only supports import.
+
+Usage (from the backend directory):
+    python -m app.bulk import FILE [--format ndjson|csv] [--processes N]
+        [--batch-size N] [--keep-indexes]
+    python -m app.bulk export matches|stats [--format ndjson|csv] [--output FILE]
+    python -m app.bulk restore-indexes
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Rows hashed and written per transaction while importing
+DEFAULT_BATCH_SIZE = 50_000
+
+# Rows read per query (and written per chunk of output) while exporting
+EXPORT_PAGE_SIZE = 5_000
+
+IMPORT_FIELDS = ("crusher_address", "crush_address")
+MATCH_FIELDS = ("user1_address", "user2_address", "matched_at")
+STATS_FIELDS = ("wallet_address", "crushes_sent", "matches_count", "last_match_at")
+
+Pair = Tuple[str, str]
+CrushRow = Tuple[str, bytes, str, str]
+
+_import_lock = threading.Lock()
+
+# Matcher of a hashing worker process
+_worker_matcher = None
+
+
+# Import
+
+def parse_rows(lines: Iterable[str], fmt: str, skipped: Counter) -> Iterator[Pair]:
+    """(crusher_address, crush_address) of every valid row; the others are counted in `skipped` by reason"""
+    if fmt == "csv":
+        records = csv.DictReader(lines)
+    elif fmt == "ndjson":
+        records = _json_records(lines, skipped)
+    else:
+        raise ValueError(f"Unknown format {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+    for record in records:
+        crusher = str(record.get("crusher_address") or "").strip()
+        crush = str(record.get("crush_address") or "").strip()
+        if not crusher or not crush:
+            skipped["missing_address"] += 1
+        elif crusher.lower() == crush.lower():
+            skipped["self_crush"] += 1
+        else:
+            yield crusher, crush
+
+
+def _json_records(lines: Iterable[str], skipped: Counter) -> Iterator[dict]:
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            skipped["invalid"] += 1
+            continue
+        if isinstance(record, dict):
+            yield record
+        else:
+            skipped["invalid"] += 1
+
+
+def hash_rows(rows: List[Pair], matcher) -> List[CrushRow]:
+    """Storage rows of (crusher, crush) pairs, as taken by storage.add_crushes"""
+    hashed = []
+    for crusher, crush in rows:
+        encrypted, crush_hash = matcher.encrypt_address(crush)
+        hashed.append((crusher, encrypted, crush_hash, matcher.address_hash(crusher)))
+    return hashed
+
+
+def _init_worker(backend_name: str, secret_key: bytes) -> None:
+    global _worker_matcher
+    from app.fhe_matcher import create_matcher
+    _worker_matcher = create_matcher(backend_name, secret_key=secret_key)
+
+
+def _hash_in_worker(rows: List[Pair]) -> List[CrushRow]:
+    return hash_rows(rows, _worker_matcher)
+
+
+def _batches(rows: Iterable[Pair], size: int) -> Iterator[List[Pair]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _hashed_batches(batches: Iterable[List[Pair]], processes: int) -> Iterator[List[CrushRow]]:
+    """Hashed batches in input order, hashed on `processes` workers (0 hashes in this process)"""
+    from app.fhe_matcher import fhe_matcher
+
+    if processes <= 0:
+        for batch in batches:
+            yield hash_rows(batch, fhe_matcher)
+        return
+
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(fhe_matcher.name, fhe_matcher.secret_key),
+    )
+    try:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(_hash_in_worker, batch))
+            if len(in_flight) >= 2 * processes:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def defer_indexes() -> List[str]:
+    """Drop the secondary indexes of crushes on every shard, keeping their definitions"""
+    import app.database as db
+
+    dropped = []
+    for shard in db.shards.all():
+        with db.shards.transaction(shard) as conn:
+            indexes = conn.execute("""
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'index' AND tbl_name = 'crushes' AND sql IS NOT NULL
+            """).fetchall()
+            for name, sql in indexes:
+                conn.execute("INSERT OR REPLACE INTO deferred_indexes (name, sql) VALUES (?, ?)", (name, sql))
+                conn.execute(f'DROP INDEX "{name}"')
+                dropped.append(name)
+    return dropped
+
+
+def restore_indexes() -> List[str]:
+    """Rebuild every index dropped by defer_indexes, including those of an interrupted import"""
+    import app.database as db
+
+    restored = []
+    for shard in db.shards.all():
+        with db.shards.transaction(shard) as conn:
+            for name, sql in conn.execute("SELECT name, sql FROM deferred_indexes").fetchall():
+                exists = conn.execute(
+                    "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?)", (name,)
+                ).fetchone()[0]
+                if not exists:
+                    conn.execute(sql)
+                conn.execute("DELETE FROM deferred_indexes WHERE name = ?", (name,))
+                restored.append(name)
+    return restored
+
+
+def _detect_matches(storage, chunk_size: int) -> int:
+    """Record the matches of every mutual pair in the graph, returning how many were new"""
+    if storage.name == "sqlite":
+        from app.reconcile import run_reconciliation
+        return run_reconciliation(chunk_size=chunk_size, restart=True)["matches_inserted"]
+    storage.start_reconciliation(chunk_size, restart=True)
+    return storage.get_reconciliation_status().get("matches_inserted", 0)
+
+
+def import_crushes(
+    lines: Iterable[str],
+    fmt: str = "ndjson",
+    processes: int = 0,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    defer: bool = True,
+    progress: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    Import crush submissions from NDJSON or CSV lines (see the module
+    docstring for the steps). Raises RuntimeError if another import is
+    running in this process.
+    """
+    from app.storage import RECONCILE_CHUNK_SIZE, storage
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (expected one of {', '.join(FORMATS)})")
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    if not _import_lock.acquire(blocking=False):
+        raise RuntimeError("An import is already running")
+
+    started = time.perf_counter()
+    skipped: Counter = Counter()
+    result = {
+        "crushes_inserted": 0, "duplicates": 0, "skipped": skipped, "indexes_rebuilt": 0, "matches_inserted": 0
+    }
+    written = 0
+    defer = defer and storage.name == "sqlite"
+    try:
+        if defer:
+            # Left over by an interrupted import, or they would be lost below
+            restore_indexes()
+            dropped = defer_indexes()
+            if progress:
+                progress(f"dropped {len(dropped)} crush indexes")
+
+        try:
+            rows = parse_rows(lines, fmt, skipped)
+            for batch in _hashed_batches(_batches(rows, batch_size), processes):
+                inserted = storage.add_crushes(batch)
+                if inserted is None:
+                    raise RuntimeError("Writing crushes failed")
+                # Rows already stored (or repeated in the file) overwrite
+                # the existing crush and are counted as duplicates
+                result["crushes_inserted"] += inserted
+                result["duplicates"] += len(batch) - inserted
+                written += len(batch)
+                if progress:
+                    rate = written / (time.perf_counter() - started)
+                    progress(f"wrote {written} crushes ({rate:.0f} crushes/s)")
+        finally:
+            if defer:
+                result["indexes_rebuilt"] = len(restore_indexes())
+                if progress:
+                    progress(f"rebuilt {result['indexes_rebuilt']} crush indexes")
+
+        result["matches_inserted"] = _detect_matches(storage, RECONCILE_CHUNK_SIZE)
+    finally:
+        _import_lock.release()
+
+    result["skipped"] = dict(skipped)
+    result["seconds"] = round(time.perf_counter() - started, 1)
+    return result
+
+
+# Export
+
+def _require_sqlite():
+    import app.database as db
+    from app.storage import storage
+
+    if storage.name != "sqlite":
+        raise ValueError("Export reads the SQLite tables and isn't supported by the memory engine")
+    count, previous = db.shards.layout(force=True)
+    if previous is not None:
+        raise ValueError(f"A rebalance from {previous} to {count} shards is in progress")
+    return db
+
+
+def export_matches(page_size: int = EXPORT_PAGE_SIZE) -> Iterator[dict]:
+    """Every match, shard by shard in id order (checked before the first row is read)"""
+    db = _require_sqlite()
+    return _match_records(db, page_size)
+
+
+def _match_records(db, page_size: int) -> Iterator[dict]:
+    from app.encoding import unpack_address
+
+    for shard in db.shards.all():
+        last_id = 0
+        while True:
+            # One short read per page, so no connection is held between pages
+            with db.shards.connection(shard) as conn:
+                rows = conn.execute("""
+                    SELECT id, user1_address, user2_address, matched_at FROM matches
+                    WHERE id > ?
+                    ORDER BY id
+                    LIMIT ?
+                """, (last_id, page_size)).fetchall()
+            for row in rows:
+                yield {
+                    "user1_address": unpack_address(row[1]),
+                    "user2_address": unpack_address(row[2]),
+                    "matched_at": row[3],
+                }
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1][0]
+
+
+def export_stats(page_size: int = EXPORT_PAGE_SIZE) -> Iterator[dict]:
+    """Counters of every wallet with crushes or matches, in address order (checked before the first row is read)"""
+    db = _require_sqlite()
+    return _stats_records(db, page_size)
+
+
+def _stats_records(db, page_size: int) -> Iterator[dict]:
+    last_wallet = ""
+    while True:
+        with db.get_connection() as conn:
+            rows = conn.execute("""
+                SELECT wallet_address, crushes_sent, matches_count, last_match_at FROM user_counters
+                WHERE wallet_address > ? AND (crushes_sent > 0 OR matches_count > 0)
+                ORDER BY wallet_address
+                LIMIT ?
+            """, (last_wallet, page_size)).fetchall()
+        for row in rows:
+            yield dict(zip(STATS_FIELDS, row))
+        if len(rows) < page_size:
+            return
+        last_wallet = rows[-1][0]
+
+
+EXPORTS: Dict[str, Tuple[Callable[..., Iterator[dict]], Tuple[str, ...]]] = {
+    "matches": (export_matches, MATCH_FIELDS),
+    "stats": (export_stats, STATS_FIELDS),
+}
+
+
+def encode(records: Iterable[dict], fields: Tuple[str, ...], fmt: str, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[str]:
+    """Records as NDJSON lines or CSV rows (after a header), `page_size` rows per string"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+    if fmt == "csv":
+        writer.writeheader()
+    rows = 0
+    for record in records:
+        if fmt == "csv":
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(record, separators=(",", ":")))
+            buffer.write("\n")
+        rows += 1
+        if rows % page_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk import crushes, or export matches and stats")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="load crush submissions from a file")
+    import_parser.add_argument("file", help="NDJSON or CSV file with crusher_address and crush_address ('-' for stdin)")
+    import_parser.add_argument("--format", choices=FORMATS,
+                               help="file format (default: csv for .csv files, ndjson otherwise)")
+    import_parser.add_argument("--processes", type=int, default=0,
+                               help="hashing worker processes (0 hashes in this process)")
+    import_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                               help="rows hashed and written per transaction")
+    import_parser.add_argument("--keep-indexes", action="store_true",
+                               help="keep the crush indexes during the import instead of rebuilding them after")
+
+    export_parser = commands.add_parser("export", help="stream matches or per-wallet stats")
+    export_parser.add_argument("table", choices=sorted(EXPORTS))
+    export_parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    export_parser.add_argument("--output", help="write to this file instead of stdout")
+
+    commands.add_parser("restore-indexes", help="rebuild crush indexes left dropped by an interrupted import")
+    args = parser.parse_args(argv)
+
+    from app.storage import storage
+
+    if args.command == "restore-indexes":
+        print(f"Rebuilt {len(restore_indexes())} crush indexes")
+        return
+
+    if args.command == "export":
+        export, fields = EXPORTS[args.table]
+        try:
+            records = export()
+        except ValueError as e:
+            parser.error(str(e))
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        try:
+            for text in encode(records, fields, args.format):
+                out.write(text)
+        finally:
+            if args.output:
+                out.close()
+        return
+
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "ndjson")
+    source = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    try:
+        result = import_crushes(
+            source, fmt, processes=args.processes, batch_size=args.batch_size,
+            defer=not args.keep_indexes, progress=print
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    storage.close()
+
+    skipped = ", ".join(f"{count} {reason}" for reason, count in sorted(result["skipped"].items())) or "none"
+    print(f"Imported {result['crushes_inserted']} crushes ({result['duplicates']} duplicates, skipped: {skipped}), "
+          f"inserted {result['matches_inserted']} matches ({result['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Online conversion of an existing database to the binary storage format.
+
+Databases created since the storage_format migration store the addresses
+and hashes of crushes and matches as raw bytes (see app.encoding). Older
+ones keep the hex 'text' format until this tool converts them while the
+app keeps serving:
+
+1. Every shard gets shadow tables (crushes_compact, matches_compact) with
+   the same schema and indexes, plus triggers that copy each insert,
+   update and delete on crushes and matches into them in packed form.
+2. Existing rows are packed into the shadow tables in id order, one chunk
+   per transaction.
+3. Each shard swaps its shadow tables in with one short transaction.
+   Shard 0 goes last and switches the format to 'binary' in the same
+   transaction.
+4. After `settle` seconds (default two layout TTLs), when every worker
+   uses packed values, rows that workers slow to see the switch wrote in
+   text form are packed, the counters are repaired and a reconciliation
+   records any match those workers missed.
+
+Re-running after an interruption before the switch starts over from
+step 1 (packing is idempotent); after it, only step 4 is repeated. Don't
+rebalance shards while this runs. The triggers call SQL functions
+registered by app.db_pool, so writes from other SQLite clients fail
+until the swap. Converted tables keep the shadow index names, and the
+space freed by the old tables is reused by SQLite (run VACUUM offline to
+shrink the file).
+
+Usage (from the backend directory):
+    python -m app.compact status
+    python -m app.compact run [--chunk-size N] [--settle SECONDS]
+"""
+
+import argparse
+import re
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+import app.database as db
+from app.shard_layout import HOME_SHARD, LAYOUT_TTL
+
+# Rows packed per transaction while copying
+DEFAULT_CHUNK_SIZE = 20_000
+
+SHADOW_SUFFIX = "_compact"
+
+# SQL function packing each converted column (other columns are copied as is)
+PACKED_COLUMNS = {
+    "crushes": {
+        "crusher_address": "pack_address",
+        "crush_address_encrypted": "upgrade_ciphertext",
+        "crush_address_hash": "pack_hash",
+        "crusher_address_hash": "pack_hash",
+    },
+    "matches": {
+        "user1_address": "pack_address",
+        "user2_address": "pack_address",
+    },
+}
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row["name"] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _packed(table: str, column: str, prefix: str = "") -> str:
+    """SQL expression of a column's packed value"""
+    function = PACKED_COLUMNS[table].get(column)
+    return f"{function}({prefix}{column})" if function else f"{prefix}{column}"
+
+
+def _prepare(conn: sqlite3.Connection, table: str) -> None:
+    """Create the shadow table, its indexes and the sync triggers, inside the caller's transaction"""
+    shadow = table + SHADOW_SUFFIX
+    table_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    conn.execute(re.sub(rf"^CREATE TABLE \"?{table}\"?", f"CREATE TABLE IF NOT EXISTS {shadow}", table_sql))
+
+    for name, index_sql in conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+    """, (table,)).fetchall():
+        conn.execute(re.sub(
+            rf"^CREATE (UNIQUE )?INDEX \"?{name}\"?\s+ON \"?{table}\"?",
+            lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {name}{SHADOW_SUFFIX} ON {shadow}",
+            index_sql
+        ))
+
+    columns = _columns(conn, table)
+    column_list = ", ".join(columns)
+    values = ", ".join(_packed(table, column, "NEW.") for column in columns)
+    for event in ("INSERT", "UPDATE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {shadow}_{event.lower()} AFTER {event} ON {table} BEGIN
+                INSERT OR REPLACE INTO {shadow} ({column_list}) VALUES ({values});
+            END
+        """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {shadow}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM {shadow} WHERE id = OLD.id;
+        END
+    """)
+
+
+def _copy(shard: int, table: str, chunk_size: int) -> int:
+    """Pack the rows that existed before the triggers into the shadow table"""
+    shadow = table + SHADOW_SUFFIX
+    with db.shards.connection(shard) as conn:
+        columns = _columns(conn, table)
+        max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+
+    column_list = ", ".join(columns)
+    values = ", ".join(_packed(table, column) for column in columns)
+    copied = 0
+    for first_id in range(0, max_id, chunk_size):
+        # Rows the triggers already copied are newer: keep them
+        with db.shards.transaction(shard) as conn:
+            copied += conn.execute(f"""
+                INSERT OR IGNORE INTO {shadow} ({column_list})
+                SELECT {values} FROM {table} WHERE id > ? AND id <= ?
+            """, (first_id, first_id + chunk_size)).rowcount
+    return copied
+
+
+def _swap(shard: int) -> Dict[str, int]:
+    """Replace crushes and matches by their shadow tables, returning each table's last id"""
+    with db.shards.transaction(shard) as conn:
+        marks = {}
+        for table in PACKED_COLUMNS:
+            shadow = table + SHADOW_SUFFIX
+            for event in ("insert", "update", "delete"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {shadow}_{event}")
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+            marks[table] = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        if shard == HOME_SHARD:
+            conn.execute("""
+                UPDATE storage_format SET format = 'binary', updated_at = CURRENT_TIMESTAMP WHERE id = 1
+            """)
+    return marks
+
+
+def _pack_stragglers(shard: int, marks: Dict[str, int]) -> int:
+    """Pack rows written in text form after the swap (by workers that still had the text format)"""
+    packed = 0
+    with db.shards.transaction(shard) as conn:
+        for table, functions in PACKED_COLUMNS.items():
+            keys = [column for column, function in functions.items() if function != "upgrade_ciphertext"]
+            where = "id > ? AND ({})".format(" OR ".join(
+                f"(typeof({column}) = 'text' AND typeof({functions[column]}({column})) = 'blob')" for column in keys
+            ))
+            assignments = ", ".join(f"{column} = {function}({column})" for column, function in functions.items())
+            # A straggling crush is the latest write of its key and replaces
+            # the older row; a straggling match duplicates an existing one
+            conflict = "REPLACE" if table == "crushes" else "IGNORE"
+            packed += conn.execute(
+                f"UPDATE OR {conflict} {table} SET {assignments} WHERE {where}", (marks.get(table, 0),)
+            ).rowcount
+            conn.execute(f"DELETE FROM {table} WHERE {where}", (marks.get(table, 0),))
+    return packed
+
+
+def compact(
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    settle: Optional[float] = None,
+    progress: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    Convert crushes and matches to the binary storage format while the app
+    keeps serving (see the module docstring for the steps).
+    """
+    shards = db.shards
+    count, previous = shards.layout(force=True)
+    if previous is not None:
+        raise ValueError(f"A rebalance from {previous} to {count} shards is in progress")
+
+    # Shard 0 last: its swap switches the format
+    order = sorted(shards.all(), key=lambda shard: shard == HOME_SHARD)
+    copied = {table: 0 for table in PACKED_COLUMNS}
+    marks: Dict[int, Dict[str, int]] = {}
+
+    if not shards.binary:
+        for shard in order:
+            with shards.transaction(shard) as conn:
+                for table in PACKED_COLUMNS:
+                    _prepare(conn, table)
+        for shard in order:
+            for table in PACKED_COLUMNS:
+                count_copied = _copy(shard, table, chunk_size)
+                copied[table] += count_copied
+                if progress:
+                    progress(f"packed {count_copied} {table} on shard {shard}")
+        for shard in order:
+            marks[shard] = _swap(shard)
+            if progress:
+                progress(f"swapped in the packed tables on shard {shard}")
+        shards.layout(force=True)
+        time.sleep(2 * LAYOUT_TTL if settle is None else settle)
+
+    # After an interrupted run every row after id 0 is checked
+    stragglers = sum(_pack_stragglers(shard, marks.get(shard, {})) for shard in order)
+
+    from app.counters import repair_counters
+    from app.reconcile import run_reconciliation
+    repaired = repair_counters()
+    reconciled = run_reconciliation(restart=True)
+
+    return {
+        "format": "binary",
+        "packed_crushes": copied["crushes"],
+        "packed_matches": copied["matches"],
+        "stragglers": stragglers,
+        "counters_repaired": repaired["repaired"],
+        "matches_reconciled": reconciled["matches_inserted"],
+    }
+
+
+def status() -> dict:
+    """Storage format, and the size of every shard file"""
+    shards = db.shards
+
+    def sizes(shard: int) -> dict:
+        with shards.connection(shard) as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            return {
+                "shard": shard,
+                "path": shards.path(shard),
+                "bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+                "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+                "converting": conn.execute(
+                    "SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE name = ?)", ("crushes" + SHADOW_SUFFIX,)
+                ).fetchone()[0] == 1,
+            }
+
+    shards.layout(force=True)
+    return {
+        "format": "binary" if shards.binary else "text",
+        "shards": shards.fanout(sizes, shards.all()),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Convert the crush database to the binary storage format")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show the storage format and file sizes")
+    run_parser = commands.add_parser("run", help="convert crushes and matches online")
+    run_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="rows packed per transaction")
+    run_parser.add_argument("--settle", type=float, default=None,
+                            help="seconds to wait for workers to pick up the new format")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        result = status()
+        print(f"Storage format: {result['format']}")
+        for shard in result["shards"]:
+            converting = ", conversion in progress" if shard["converting"] else ""
+            print(f"  shard {shard['shard']}: {shard['bytes'] / 1e6:.1f} MB "
+                  f"({shard['free_bytes'] / 1e6:.1f} MB free{converting}) ({shard['path']})")
+        return
+
+    started = time.perf_counter()
+    before = sum(shard["bytes"] - shard["free_bytes"] for shard in status()["shards"])
+    result = compact(chunk_size=args.chunk_size, settle=args.settle, progress=print)
+    after = sum(shard["bytes"] - shard["free_bytes"] for shard in status()["shards"])
+    print(
+        f"Converted to the binary format: packed {result['packed_crushes']} crushes and "
+        f"{result['packed_matches']} matches, {result['stragglers']} late rows, "
+        f"repaired {result['counters_repaired']} counters, reconciled {result['matches_reconciled']} matches; "
+        f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB used ({time.perf_counter() - started:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
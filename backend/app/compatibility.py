@@ -0,0 +1,344 @@
+"""
+Wallet compatibility scoring.
+
+calculate_compatibility scores one pair of addresses in pure Python. The
+vectorized engine below computes the same four factors with NumPy for a
+whole batch (one address against thousands of candidates, or N x M). It
+decodes each address into a nibble array once and returns the same
+scores as the scalar function, bit for bit.
+
+compatibility_json builds the full /api/compatibility payload. Payloads are
+deterministic, so they are kept pre-serialized in a bounded LRU keyed on
+the unordered address pair.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from app.models import CompatibilityResult
+
+# Hex characters in an address without the 0x prefix
+ADDRESS_NIBBLES = 40
+
+# Largest pairwise block (rows x candidates x nibbles) built at once
+MAX_BLOCK_ELEMENTS = 8_000_000
+
+# Bump when scores or messages change so cached responses (ETags) expire
+COMPATIBILITY_VERSION = "1"
+
+# Pre-serialized compatibility payloads kept in memory
+RESULT_CACHE_SIZE = int(os.environ.get("CRUSH_COMPATIBILITY_CACHE_SIZE", "65536"))
+
+# Key for the digest that picks a level's message
+_MESSAGE_KEY = b"crush-compatibility-message"
+
+
+def calculate_compatibility(address1: str, address2: str) -> int:
+    """
+    Calculate compatibility score between two wallet addresses.
+    Uses multiple factors for a fun, deterministic calculation.
+    """
+    addr1 = address1.lower().replace("0x", "")
+    addr2 = address2.lower().replace("0x", "")
+
+    score = 0
+
+    # Factor 1: Matching characters at same positions (max 40 points)
+    matching_chars = sum(1 for a, b in zip(addr1, addr2) if a == b)
+    score += int((matching_chars / 40) * 40)
+
+    # Factor 2: Character frequency similarity (max 20 points)
+    freq1 = {c: addr1.count(c) for c in set(addr1)}
+    freq2 = {c: addr2.count(c) for c in set(addr2)}
+    all_chars = set(freq1.keys()) | set(freq2.keys())
+    freq_similarity = sum(min(freq1.get(c, 0), freq2.get(c, 0)) for c in all_chars)
+    score += int((freq_similarity / 40) * 20)
+
+    # Factor 3: Numeric harmony - sum of digits (max 20 points)
+    digits1 = sum(int(c, 16) for c in addr1)
+    digits2 = sum(int(c, 16) for c in addr2)
+    digit_diff = abs(digits1 - digits2)
+    max_diff = 40 * 15  # max possible difference
+    harmony = 1 - (digit_diff / max_diff)
+    score += int(harmony * 20)
+
+    # Factor 4: "Destiny number" - XOR pattern creates unique bond (max 20 points)
+    xor_sum = sum(int(a, 16) ^ int(b, 16) for a, b in zip(addr1, addr2))
+    # Lower XOR means more similar, but we want some variation
+    destiny = ((xor_sum % 100) + (digits1 + digits2) % 100) % 100
+    score += int((destiny / 100) * 20)
+
+    return min(100, max(0, score))
+
+
+COMPATIBILITY_LEVELS = [
+    {
+        "level": "Different Worlds",
+        "emoji": "🌍",
+        "color": "#9CA3AF",
+        "messages": [
+            "The stars haven't aligned... yet!",
+            "Opposites attract? Maybe in another universe!",
+            "Your paths are quite different, but who knows?",
+        ]
+    },
+    {
+        "level": "Curious Spark",
+        "emoji": "✨",
+        "color": "#60A5FA",
+        "messages": [
+            "There's a faint spark between you two!",
+            "Curiosity is the first step to love!",
+            "Something mysterious connects you...",
+        ]
+    },
+    {
+        "level": "Growing Connection",
+        "emoji": "🌱",
+        "color": "#34D399",
+        "messages": [
+            "A beautiful connection is blooming!",
+            "Your energies are starting to sync!",
+            "The universe sees potential here!",
+        ]
+    },
+    {
+        "level": "Strong Chemistry",
+        "emoji": "💜",
+        "color": "#A78BFA",
+        "messages": [
+            "Wow! The chemistry is undeniable!",
+            "Your wallets were meant to meet!",
+            "This could be something special!",
+        ]
+    },
+    {
+        "level": "Soulmates",
+        "emoji": "💕",
+        "color": "#F472B6",
+        "messages": [
+            "SOULMATES DETECTED! This is destiny!",
+            "The blockchain has blessed this match!",
+            "Written in the stars AND the blockchain!",
+        ]
+    }
+]
+
+
+def _level_for_score(score: int) -> int:
+    """Determine level (0-4) based on score"""
+    if score <= 20:
+        return 0
+    elif score <= 40:
+        return 1
+    elif score <= 60:
+        return 2
+    elif score <= 80:
+        return 3
+    else:
+        return 4
+
+
+# Score (0-100) -> level index
+LEVEL_BY_SCORE = [_level_for_score(score) for score in range(101)]
+
+
+def pair_key(address1: str, address2: str) -> Tuple[str, str]:
+    """Normalized, order-insensitive key for an address pair"""
+    a, b = address1.lower(), address2.lower()
+    return (a, b) if a <= b else (b, a)
+
+
+def compatibility_etag(address1: str, address2: str) -> str:
+    """Strong ETag for a pair's compatibility payload, computed without scoring"""
+    a, b = pair_key(address1, address2)
+    digest = hashlib.blake2b(f"{a}:{b}".encode(), digest_size=16).hexdigest()
+    return f'"c{COMPATIBILITY_VERSION}-{digest}"'
+
+
+def pick_message(address1: str, address2: str, messages: Sequence[str]) -> str:
+    """Stable choice of a level message for a pair, the same on every worker"""
+    a, b = pair_key(address1, address2)
+    digest = hashlib.blake2b(f"{a}:{b}".encode(), digest_size=8, key=_MESSAGE_KEY).digest()
+    return messages[int.from_bytes(digest, "big") % len(messages)]
+
+
+@lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _compatibility_json(address1: str, address2: str) -> bytes:
+    score = calculate_compatibility(address1, address2)
+    level_index = LEVEL_BY_SCORE[score]
+    level_data = COMPATIBILITY_LEVELS[level_index]
+
+    return CompatibilityResult(
+        score=score,
+        level=level_data["level"],
+        level_index=level_index,
+        emoji=level_data["emoji"],
+        message=pick_message(address1, address2, level_data["messages"]),
+        color=level_data["color"]
+    ).model_dump_json().encode()
+
+
+def compatibility_json(address1: str, address2: str) -> bytes:
+    """
+    Serialized CompatibilityResult for a pair, cached.
+
+    Raises ValueError for addresses the scorer can't parse.
+    """
+    return _compatibility_json(*pair_key(address1, address2))
+
+
+def result_cache_info() -> dict:
+    """Hit/miss counters of the compatibility payload cache"""
+    info = _compatibility_json.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+    }
+
+
+# ASCII byte -> nibble value, 255 for non-hex characters
+_NIBBLE_LUT = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _NIBBLE_LUT[_c] = _i
+
+
+class AddressFeatures(NamedTuple):
+    """Per-address features used by the vectorized scorer"""
+    nibbles: np.ndarray      # (N, 40) uint8 nibble values
+    histograms: np.ndarray   # (N, 16) uint8 count of each hex character
+    digit_sums: np.ndarray   # (N,) sum of nibble values
+    valid: np.ndarray        # (N,) False where the scalar fallback is needed
+
+
+def _strip(address: str) -> str:
+    # Same normalization as calculate_compatibility
+    return address.lower().replace("0x", "")
+
+
+def is_standard_address(address: str) -> bool:
+    """Whether the vectorized scorer handles an address (40 hex digits after stripping "0x")"""
+    stripped = _strip(address)
+    return len(stripped) == ADDRESS_NIBBLES and all(c in "0123456789abcdef" for c in stripped)
+
+
+def encode_addresses(addresses: Sequence[str]) -> AddressFeatures:
+    """
+    Decode addresses into nibble arrays and derived features.
+
+    Addresses that aren't exactly 40 hex characters after stripping "0x"
+    are marked invalid; their rows are zero and must be scored with
+    calculate_compatibility instead.
+    """
+    count = len(addresses)
+    raw = np.zeros((count, ADDRESS_NIBBLES), dtype=np.uint8)
+    valid = np.zeros(count, dtype=bool)
+
+    for i, address in enumerate(addresses):
+        stripped = _strip(address)
+        if len(stripped) != ADDRESS_NIBBLES or not stripped.isascii():
+            continue
+        decoded = _NIBBLE_LUT[np.frombuffer(stripped.encode(), dtype=np.uint8)]
+        if (decoded == 255).any():
+            continue
+        raw[i] = decoded
+        valid[i] = True
+
+    histograms = np.zeros((count, 16), dtype=np.uint8)
+    if count:
+        rows = np.repeat(np.arange(count), ADDRESS_NIBBLES)
+        np.add.at(histograms, (rows, raw.ravel()), 1)
+        histograms[~valid] = 0
+
+    digit_sums = raw.sum(axis=1, dtype=np.int64)
+    return AddressFeatures(raw, histograms, digit_sums, valid)
+
+
+def _score_block(sources: AddressFeatures, candidates: AddressFeatures) -> np.ndarray:
+    """Scores for every (source, candidate) pair of one block"""
+    a = sources.nibbles[:, None, :]
+    b = candidates.nibbles[None, :, :]
+
+    # The float operations mirror calculate_compatibility exactly so that
+    # truncation to int gives identical results
+
+    # Factor 1: Matching characters at same positions (max 40 points)
+    matching_chars = (a == b).sum(axis=2, dtype=np.int64)
+    score = ((matching_chars / 40) * 40).astype(np.int64)
+
+    # Factor 2: Character frequency similarity (max 20 points)
+    freq_similarity = np.minimum(
+        sources.histograms[:, None, :], candidates.histograms[None, :, :]
+    ).sum(axis=2, dtype=np.int64)
+    score += ((freq_similarity / 40) * 20).astype(np.int64)
+
+    # Factor 3: Numeric harmony - sum of digits (max 20 points)
+    digits1 = sources.digit_sums[:, None]
+    digits2 = candidates.digit_sums[None, :]
+    digit_diff = np.abs(digits1 - digits2)
+    harmony = 1 - (digit_diff / (40 * 15))
+    score += (harmony * 20).astype(np.int64)
+
+    # Factor 4: "Destiny number" - XOR pattern (max 20 points)
+    xor_sum = (a ^ b).sum(axis=2, dtype=np.int64)
+    destiny = ((xor_sum % 100) + (digits1 + digits2) % 100) % 100
+    score += ((destiny / 100) * 20).astype(np.int64)
+
+    return np.clip(score, 0, 100)
+
+
+def score_features(sources: AddressFeatures, candidates: AddressFeatures) -> np.ndarray:
+    """
+    Score every source against every candidate from pre-encoded features.
+
+    Returns an (N, M) int array. Pairs involving invalid addresses are left
+    at 0; use score_matrix to have them filled in by the scalar scorer.
+    """
+    n, m = len(sources.valid), len(candidates.valid)
+    scores = np.zeros((n, m), dtype=np.int64)
+    if n == 0 or m == 0:
+        return scores
+
+    # Bound the size of the (rows, M, 40) intermediates
+    rows_per_block = max(1, MAX_BLOCK_ELEMENTS // (m * ADDRESS_NIBBLES))
+    for start in range(0, n, rows_per_block):
+        block = AddressFeatures(*(field[start:start + rows_per_block] for field in sources))
+        scores[start:start + rows_per_block] = _score_block(block, candidates)
+    return scores
+
+
+def score_matrix(sources: Sequence[str], candidates: Sequence[str]) -> np.ndarray:
+    """
+    Compatibility scores for every (source, candidate) pair as an (N, M) array.
+
+    Equal to calculate_compatibility(sources[i], candidates[j]) for every
+    cell. Raises ValueError for addresses the scalar scorer rejects.
+
+    Every row and column of a non-standard address (see
+    is_standard_address) is filled in by the scalar scorer, one Python
+    call per cell, so callers should bound how many such cells they allow.
+    """
+    source_features = encode_addresses(sources)
+    candidate_features = encode_addresses(candidates)
+    scores = score_features(source_features, candidate_features)
+
+    # Non-standard addresses go through the scalar scorer
+    for i in np.flatnonzero(~source_features.valid):
+        for j in range(len(candidates)):
+            scores[i, j] = calculate_compatibility(sources[i], candidates[j])
+    for j in np.flatnonzero(~candidate_features.valid):
+        for i in np.flatnonzero(source_features.valid):
+            scores[i, j] = calculate_compatibility(sources[i], candidates[j])
+
+    return scores
+
+
+def score_batch(address: str, candidates: Sequence[str]) -> List[int]:
+    """Compatibility of one address with each candidate"""
+    return score_matrix([address], candidates)[0].tolist()
@@ -0,0 +1,224 @@
+"""
+Top-K compatible users over all registered wallets.
+
+Scoring one address against every user with calculate_compatibility is far
+too slow at our user counts. The index keeps the per-user features the
+scorer needs (nibble vector, character histogram, digit sum) in growable
+NumPy arrays, refreshed incrementally from the users table. A query
+scores the whole index in vectorized chunks and picks the best k with a
+partial sort. Large indexes are scanned in parallel chunks on a thread
+pool: the NumPy kernels release the GIL, and the chunks are views of the
+index arrays, so nothing is copied or pickled.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.compatibility import ADDRESS_NIBBLES, AddressFeatures, _strip, encode_addresses, score_features
+from app.storage import storage
+
+# Rows read from the users table per refresh query
+LOAD_BATCH_SIZE = 10_000
+
+# Seconds between checks for wallets registered by other workers
+REFRESH_INTERVAL = float(os.environ.get("CRUSH_TOPK_REFRESH_INTERVAL", "5"))
+
+# Index size from which queries fan out over a thread pool (1 thread disables)
+PARALLEL_THRESHOLD = int(os.environ.get("CRUSH_TOPK_PARALLEL_THRESHOLD", "200000"))
+THREADS = int(os.environ.get("CRUSH_TOPK_THREADS", str(min(4, os.cpu_count() or 1))))
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first (ties keep index order)"""
+    if k < len(scores):
+        # Every score above the k-th, then the first rows tied with it
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def _top_k_chunk(
+    query: AddressFeatures,
+    chunk: AddressFeatures,
+    offset: int,
+    exclude: int,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k rows of one chunk as (row indexes, scores); runs on pool threads"""
+    scores = score_features(query, chunk)[0]
+    if offset <= exclude < offset + len(scores):
+        scores[exclude - offset] = -1
+    best = _top_k(scores, k)
+    return best + offset, scores[best]
+
+
+class CompatibilityIndex:
+    """Array-backed features of every registered wallet"""
+
+    def __init__(self, capacity: int = 1024):
+        self._nibbles = np.zeros((capacity, ADDRESS_NIBBLES), dtype=np.uint8)
+        self._histograms = np.zeros((capacity, 16), dtype=np.uint8)
+        self._digit_sums = np.zeros(capacity, dtype=np.int64)
+        self._addresses: List[str] = []
+        self._positions = {}
+        self._size = 0
+
+        self._last_rowid = 0
+        self._last_refresh = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._digit_sums)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+
+        # Allocate new arrays rather than resizing in place so snapshots
+        # taken by running queries stay valid
+        for name in ("_nibbles", "_histograms", "_digit_sums"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, addresses: Sequence[str]) -> int:
+        """
+        Add wallets to the index, returning how many were new.
+
+        Addresses that aren't 40 hex characters are skipped. Positions
+        are keyed like the scorer normalizes addresses (see _strip), so
+        "0xABC..." and "abc..." are the same wallet.
+        """
+        normalized = [address.lower() for address in addresses]
+        keys = [_strip(address) for address in normalized]
+        features = encode_addresses(normalized)
+
+        with self._lock:
+            new_rows = []
+            seen = set()
+            for i, key in enumerate(keys):
+                if features.valid[i] and key not in self._positions and key not in seen:
+                    seen.add(key)
+                    new_rows.append(i)
+            if not new_rows:
+                return 0
+
+            start = self._size
+            end = start + len(new_rows)
+            self._grow(end)
+            self._nibbles[start:end] = features.nibbles[new_rows]
+            self._histograms[start:end] = features.histograms[new_rows]
+            self._digit_sums[start:end] = features.digit_sums[new_rows]
+            for offset, i in enumerate(new_rows):
+                self._positions[keys[i]] = start + offset
+                self._addresses.append(normalized[i])
+            self._size = end
+            return len(new_rows)
+
+    def refresh(self, force: bool = False) -> int:
+        """Load wallets registered since the last refresh, returning how many were added"""
+        if not force and self._loaded and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+            return 0
+
+        added = 0
+        with self._refresh_lock:
+            while True:
+                rows = storage.get_users_after(self._last_rowid, LOAD_BATCH_SIZE)
+                if not rows:
+                    break
+                added += self.add([address for _, address in rows])
+                self._last_rowid = rows[-1][0]
+            self._last_refresh = time.monotonic()
+            self._loaded = True
+        return added
+
+    def _snapshot(self) -> AddressFeatures:
+        with self._lock:
+            n = self._size
+            return AddressFeatures(
+                self._nibbles[:n],
+                self._histograms[:n],
+                self._digit_sums[:n],
+                np.ones(n, dtype=bool)
+            )
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="crush-topk")
+            return self._pool
+
+    def top_k(self, wallet_address: str, k: int = 20) -> List[Tuple[str, int]]:
+        """
+        The k registered wallets most compatible with `wallet_address`.
+
+        Returns (address, score) pairs, best first. The wallet itself is
+        never included. Raises ValueError if the address isn't 40 hex
+        characters.
+        """
+        query = encode_addresses([wallet_address])
+        if not query.valid[0]:
+            raise ValueError("Invalid wallet address")
+
+        self.refresh()
+        index = self._snapshot()
+        n = len(index.valid)
+        exclude = self._positions.get(_strip(wallet_address), -1)
+        if n == 0 or k <= 0:
+            return []
+
+        if THREADS > 1 and n >= PARALLEL_THRESHOLD:
+            chunk_size = -(-n // THREADS)
+            futures = [
+                self._get_pool().submit(
+                    _top_k_chunk,
+                    query,
+                    AddressFeatures(*(field[start:start + chunk_size] for field in index)),
+                    start,
+                    exclude,
+                    k
+                )
+                for start in range(0, n, chunk_size)
+            ]
+            results = [future.result() for future in futures]
+            rows = np.concatenate([r[0] for r in results])
+            scores = np.concatenate([r[1] for r in results])
+            # Ties go to the lower row, as in a single scan
+            best = np.lexsort((rows, -scores))[:k]
+            rows, scores = rows[best], scores[best]
+        else:
+            rows, scores = _top_k_chunk(query, index, 0, exclude, k)
+
+        with self._lock:
+            return [
+                (self._addresses[row], int(score))
+                for row, score in zip(rows.tolist(), scores.tolist())
+                if score >= 0
+            ]
+
+    def close(self) -> None:
+        """Shut down the thread pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Global index instance
+compatibility_index = CompatibilityIndex()
@@ -0,0 +1,137 @@
+"""
+Repair job for the materialized per-wallet counters.
+
+user_counters (crushes_sent, matches_count, last_match_at) is maintained by
+the write paths in database.py, in the same transaction as each write.
+Rows written around those paths (manual SQL, a restore from an older
+backup) can leave it out of step. This job recomputes every counter from
+crushes and matches, rewrites the rows that differ and bumps their
+wallets' versions so cached stats are revalidated.
+
+It runs as one write transaction, which blocks other writers while the
+source tables are aggregated. With several shards (app.shard_layout), each shard
+aggregates its own rows and the partial counters are summed on shard 0;
+writes to the other shards are not blocked meanwhile.
+
+Usage (from the backend directory):
+    python -m app.counters
+"""
+
+import argparse
+import time
+from typing import Optional
+
+import app.database as db
+from app.db_pool import open_connection
+
+# Counters recomputed from the source tables, one row per wallet (addresses
+# converted to text for user_counters; see app.encoding)
+EXPECTED_COUNTERS_SQL = """
+    SELECT address_text(wallet_address) AS wallet_address, SUM(crushes_sent) AS crushes_sent,
+        SUM(matches_count) AS matches_count, MAX(last_match_at) AS last_match_at
+    FROM (
+        SELECT crusher_address AS wallet_address, COUNT(*) AS crushes_sent,
+            0 AS matches_count, NULL AS last_match_at
+        FROM crushes GROUP BY crusher_address
+        UNION ALL
+        SELECT user1_address, 0, COUNT(*), MAX(matched_at) FROM matches GROUP BY user1_address
+        UNION ALL
+        SELECT user2_address, 0, COUNT(*), MAX(matched_at) FROM matches GROUP BY user2_address
+    )
+    GROUP BY wallet_address
+"""
+
+# Partial counter rows streamed from each shard at a time
+PART_BATCH_SIZE = 10_000
+
+
+def _collect_shard_counters(conn) -> None:
+    """Build temp.expected_counters on shard 0 from every shard's partial counters"""
+    conn.execute("""
+        CREATE TEMP TABLE counter_parts (
+            wallet_address TEXT, crushes_sent INTEGER, matches_count INTEGER, last_match_at TIMESTAMP
+        )
+    """)
+    for shard in db.shards.all():
+        with db.shards.connection(shard) as part:
+            cursor = part.execute(EXPECTED_COUNTERS_SQL)
+            while True:
+                rows = cursor.fetchmany(PART_BATCH_SIZE)
+                if not rows:
+                    break
+                conn.executemany("INSERT INTO counter_parts VALUES (?, ?, ?, ?)", [tuple(row) for row in rows])
+
+    conn.execute("""
+        CREATE TEMP TABLE expected_counters AS
+        SELECT wallet_address, SUM(crushes_sent) AS crushes_sent,
+            SUM(matches_count) AS matches_count, MAX(last_match_at) AS last_match_at
+        FROM counter_parts
+        GROUP BY wallet_address
+    """)
+    conn.execute("DROP TABLE temp.counter_parts")
+
+
+def repair_counters(database_path: Optional[str] = None) -> dict:
+    """
+    Recompute user_counters from crushes and matches.
+
+    Returns the number of wallets with activity and how many counter rows
+    were wrong.
+    """
+    conn = open_connection(database_path or db.DATABASE_PATH)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DROP TABLE IF EXISTS temp.expected_counters")
+            conn.execute("DROP TABLE IF EXISTS temp.counter_parts")
+            if database_path is None and db.shards.sharded:
+                _collect_shard_counters(conn)
+            else:
+                conn.execute(f"CREATE TEMP TABLE expected_counters AS {EXPECTED_COUNTERS_SQL}")
+
+            # Wallets whose stored row differs from the recomputed one,
+            # including stale rows for wallets with no activity left
+            wrong = [row[0] for row in conn.execute("""
+                SELECT e.wallet_address FROM expected_counters e
+                LEFT JOIN user_counters c ON c.wallet_address = e.wallet_address
+                WHERE c.wallet_address IS NULL
+                    OR c.crushes_sent != e.crushes_sent
+                    OR c.matches_count != e.matches_count
+                    OR c.last_match_at IS NOT e.last_match_at
+                UNION
+                SELECT c.wallet_address FROM user_counters c
+                WHERE c.wallet_address NOT IN (SELECT wallet_address FROM expected_counters)
+            """)]
+
+            conn.execute("DELETE FROM user_counters")
+            conn.execute("""
+                INSERT INTO user_counters (wallet_address, crushes_sent, matches_count, last_match_at)
+                SELECT wallet_address, crushes_sent, matches_count, last_match_at FROM expected_counters
+            """)
+            wallets = conn.execute("SELECT COUNT(*) FROM expected_counters").fetchone()[0]
+            db.bump_user_versions(conn, wrong)
+            conn.execute("DROP TABLE temp.expected_counters")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+    return {"wallets": wallets, "repaired": len(wrong)}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Recompute per-wallet counters from crushes and matches")
+    parser.parse_args(argv)
+
+    started = time.perf_counter()
+    result = repair_counters()
+    print(
+        f"Checked {result['wallets']} wallets, repaired {result['repaired']} counters "
+        f"({time.perf_counter() - started:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
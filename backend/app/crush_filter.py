@@ -0,0 +1,409 @@
+"""
+Bloom filter over submitted crush edges.
+
+Most submissions are unrequited, so the reverse-edge lookup in
+check_for_matches usually finds nothing. The filter holds every
+(crusher_address_hash, crush_address_hash) pair in crushes. When it
+reports a reverse edge as definitely absent, the database is never asked.
+
+The filter is built by a background thread: it loads the last snapshot
+from disk, or streams the crushes table in id order, and then follows new
+rows by id. Until it is ready every lookup reports "maybe", so answers
+are never wrong, only slower. Crushes stored through this process are
+added before their own match check, so with a single worker a negative is
+exact. Crushes written by *other* processes are only loaded at the next
+sync, so a negative can be up to CRUSH_FILTER_SYNC_INTERVAL seconds stale.
+Negatives are trusted without asking the database: if two workers store
+the two halves of a pair within that window, neither records the match
+and the reconciliation job (app.reconcile) picks it up. The filter is
+opt-in (CRUSH_CRUSH_FILTER=1).
+
+Removed crushes stay in the filter (only costing false positives) until
+the next rebuild. A rebuild happens when the filter outgrows its capacity
+or too many of its entries are stale.
+"""
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from app.db_pool import open_connection
+from app.encoding import unpack_address, unpack_hash
+
+# Use the filter to skip reverse-edge lookups (off by default, see above)
+ENABLED = os.environ.get("CRUSH_CRUSH_FILTER", "0").lower() in ("1", "true", "yes")
+
+# Target false-positive rate and the number of crushes sized for
+FP_RATE = float(os.environ.get("CRUSH_FILTER_FP_RATE", "0.01"))
+CAPACITY = int(os.environ.get("CRUSH_FILTER_CAPACITY", "1000000"))
+
+# Seconds between syncs with rows written by other processes
+SYNC_INTERVAL = float(os.environ.get("CRUSH_FILTER_SYNC_INTERVAL", "1"))
+
+# Where the filter is saved on shutdown (unset: next to the database file;
+# empty disables snapshots)
+SNAPSHOT_PATH = os.environ.get("CRUSH_FILTER_SNAPSHOT")
+
+SNAPSHOT_VERSION = 1
+
+# Rows read per query while building or syncing
+LOAD_BATCH_SIZE = 50_000
+
+# Fraction of removed entries that triggers a rebuild
+MAX_STALE_FRACTION = 0.25
+
+MASK64 = (1 << 64) - 1
+
+
+def _edge_digest(crusher_hash: str, crush_hash: str) -> bytes:
+    return hashlib.blake2b(
+        f"{crusher_hash.lower()}:{crush_hash.lower()}".encode(), digest_size=16
+    ).digest()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter with double hashing"""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        # Imported here so that a disabled filter doesn't load numpy
+        import numpy as np
+
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.num_bits = max(64, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        # Rows loaded from the table; edges added ahead of a sync aren't counted twice
+        self.count = 0
+
+    def _positions(self, digest: bytes) -> List[int]:
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little")
+        return [((h1 + i * h2) & MASK64) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, digest: bytes) -> None:
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, digests: List[bytes]) -> None:
+        """Vectorized add of many digests"""
+        if not digests:
+            return
+        import numpy as np
+
+        hashes = np.frombuffer(b"".join(digests), dtype="<u8").reshape(-1, 2)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        # uint64 arithmetic wraps like the & MASK64 in _positions
+        positions = (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.num_bits)
+        positions = positions.ravel()
+        np.bitwise_or.at(
+            self.bits,
+            (positions >> np.uint64(3)).astype(np.int64),
+            np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        )
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def estimated_fp_rate(self) -> float:
+        """False-positive rate expected at the current fill"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class CrushFilter:
+    """Bloom filter over crush edges, kept in step with the crushes table"""
+
+    def __init__(
+        self,
+        enabled: bool = ENABLED,
+        capacity: int = CAPACITY,
+        fp_rate: float = FP_RATE,
+        sync_interval: float = SYNC_INTERVAL,
+        snapshot_path: Optional[str] = SNAPSHOT_PATH,
+        database_path: Optional[str] = None
+    ):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.sync_interval = sync_interval
+        self.snapshot_path = snapshot_path
+        self.database_path = database_path
+
+        self._bloom: Optional[BloomFilter] = None
+        self._last_id = 0
+        self._removed = 0
+        self._lock = threading.Lock()
+        # Serializes loading rows after _last_id (syncs and rebuilds)
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.checks = 0
+        self.probes_saved = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.rebuilds = 0
+        self.loaded_from_snapshot = False
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def _database_path(self) -> str:
+        # app.database is only imported once the filter is used, so other
+        # storage engines never create the SQLite file
+        import app.database as db
+        return self.database_path or db.DATABASE_PATH
+
+    def _snapshot_file(self) -> Optional[str]:
+        if self.snapshot_path is None:
+            return self._database_path() + ".filter"
+        return self.snapshot_path or None
+
+    def _connect(self) -> sqlite3.Connection:
+        return open_connection(self._database_path())
+
+    # Lookups
+
+    def may_contain(self, crusher_hash: str, crush_hash: str) -> bool:
+        """
+        Whether the crush edge might be stored.
+
+        True means the database has to be asked. False means it wasn't
+        stored by this process or as of the last sync, and the caller skips
+        the lookup (counted in probes_saved).
+        """
+        bloom = self._bloom
+        if not self.enabled or bloom is None:
+            return True
+        self.checks += 1
+        if _edge_digest(crusher_hash, crush_hash) in bloom:
+            return True
+        self.probes_saved += 1
+        return False
+
+    def record_false_positive(self) -> None:
+        """Note that the database didn't have an edge the filter reported"""
+        self.false_positives += 1
+
+    # Updates
+
+    def add(self, crusher_hash: str, crush_hash: str) -> None:
+        """Add an edge stored by this process"""
+        self.add_many([(crusher_hash, crush_hash)])
+
+    def add_many(self, edges: Iterable[Tuple[str, str]]) -> None:
+        if not self.enabled:
+            return
+        digests = [_edge_digest(crusher_hash, crush_hash) for crusher_hash, crush_hash in edges]
+        with self._lock:
+            if self._bloom is not None:
+                for digest in digests:
+                    self._bloom.add(digest)
+
+    def note_removal(self) -> None:
+        """Count a removed crush; its entry stays in the filter until the next rebuild"""
+        with self._lock:
+            self._removed += 1
+
+    # Building and syncing
+
+    def _load_rows(self, conn: sqlite3.Connection, bloom: BloomFilter, after_id: int) -> int:
+        """Stream crushes with id > after_id into a filter, returning the last id seen"""
+        while True:
+            rows = conn.execute("""
+                SELECT id, crusher_address_hash, crush_address_hash FROM crushes
+                WHERE id > ? ORDER BY id LIMIT ?
+            """, (after_id, LOAD_BATCH_SIZE)).fetchall()
+            if not rows:
+                return after_id
+            digests = [_edge_digest(unpack_hash(row[1]), unpack_hash(row[2])) for row in rows]
+            with self._lock:
+                bloom.add_many(digests)
+                bloom.count += len(digests)
+            after_id = rows[-1][0]
+
+    def rebuild(self, conn: sqlite3.Connection) -> None:
+        """Build a fresh filter from the whole crushes table"""
+        rows = conn.execute("SELECT COUNT(*) FROM crushes").fetchone()[0]
+        bloom = BloomFilter(max(self.capacity, rows * 2), self.fp_rate)
+        last_id = self._load_rows(conn, bloom, 0)
+        with self._sync_lock:
+            with self._lock:
+                # Catch up with rows committed while the table was scanned
+                self._last_id = self._load_rows(conn, bloom, last_id)
+                self._bloom = bloom
+                self._removed = 0
+        self.rebuilds += 1
+
+    def sync(self, conn: sqlite3.Connection) -> None:
+        """Add rows written since the last sync, rebuilding if the filter is worn out"""
+        bloom = self._bloom
+        if bloom is None or bloom.count > bloom.capacity or self._removed > bloom.count * MAX_STALE_FRACTION:
+            self.rebuild(conn)
+            return
+        with self._sync_lock:
+            self._last_id = self._load_rows(conn, self._bloom, self._last_id)
+        self.syncs += 1
+
+    # Snapshots
+
+    def save_snapshot(self) -> bool:
+        """Write the filter to disk for a fast restart"""
+        bloom = self._bloom
+        snapshot_path = self._snapshot_file()
+        if not snapshot_path or bloom is None:
+            return False
+
+        try:
+            with self._lock:
+                bits = bloom.bits.tobytes()
+                header = {
+                    "version": SNAPSHOT_VERSION,
+                    "capacity": bloom.capacity,
+                    "fp_rate": bloom.fp_rate,
+                    "count": bloom.count,
+                    "removed": self._removed,
+                    "last_id": self._last_id,
+                }
+            conn = self._connect()
+            try:
+                header["last_row"] = self._row_fingerprint(conn, header["last_id"])
+            finally:
+                conn.close()
+
+            tmp_path = snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(bits)
+            os.replace(tmp_path, snapshot_path)
+            return True
+        except Exception as e:
+            print(f"Error saving crush filter snapshot: {e}")
+            return False
+
+    @staticmethod
+    def _row_fingerprint(conn: sqlite3.Connection, crush_id: int) -> Optional[str]:
+        row = conn.execute("""
+            SELECT crusher_address, crush_address_hash FROM crushes WHERE id = ?
+        """, (crush_id,)).fetchone()
+        return f"{unpack_address(row[0])}:{unpack_hash(row[1])}" if row else None
+
+    def load_snapshot(self, conn: sqlite3.Connection) -> bool:
+        """Restore the filter from disk if the snapshot matches this database"""
+        snapshot_path = self._snapshot_file()
+        if not snapshot_path or not os.path.exists(snapshot_path):
+            return False
+
+        try:
+            with open(snapshot_path, "rb") as f:
+                header = json.loads(f.readline())
+                bits = f.read()
+
+            if header["version"] != SNAPSHOT_VERSION or header["fp_rate"] != self.fp_rate:
+                return False
+            # The row the snapshot ends at must still be there, or the
+            # database was replaced or restored since
+            if header["last_id"] and self._row_fingerprint(conn, header["last_id"]) != header["last_row"]:
+                return False
+
+            bloom = BloomFilter(header["capacity"], header["fp_rate"])
+            if len(bits) != len(bloom.bits):
+                return False
+            bloom.bits[:] = memoryview(bits)
+            bloom.count = header["count"]
+
+            with self._lock:
+                self._bloom = bloom
+                self._removed = header["removed"]
+                self._last_id = header["last_id"]
+            return True
+        except Exception as e:
+            print(f"Error loading crush filter snapshot: {e}")
+            return False
+
+    # Background thread
+
+    def _run(self) -> None:
+        try:
+            conn = self._connect()
+        except Exception as e:
+            print(f"Error starting crush filter: {e}")
+            return
+
+        try:
+            if self.load_snapshot(conn):
+                self.loaded_from_snapshot = True
+            while not self._stop.is_set():
+                try:
+                    self.sync(conn)
+                except Exception as e:
+                    print(f"Error syncing crush filter: {e}")
+                self._stop.wait(self.sync_interval)
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Start building and syncing the filter in the background"""
+        if not self.enabled or self._thread is not None:
+            return
+        from app.storage import storage
+        if storage.name != "sqlite" or storage.db.shards.sharded:
+            # The filter follows a single SQLite crushes table by id
+            print("Crush filter disabled: it needs the single-file SQLite storage backend")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="crush-filter", daemon=True)
+        self._thread.start()
+
+    def wait_ready(self, timeout: float = 30.0) -> bool:
+        """Block until the filter is built (for scripts and tests)"""
+        deadline = time.monotonic() + timeout
+        while not self.ready and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.ready
+
+    def metrics(self) -> dict:
+        """Probes saved, false positives and filter fill"""
+        bloom = self._bloom
+        # Negatives are true negatives up to the sync window, so this is
+        # about FP / (FP + TN)
+        absent = self.false_positives + self.probes_saved
+        return {
+            "enabled": self.enabled,
+            "ready": bloom is not None,
+            "loaded_from_snapshot": self.loaded_from_snapshot,
+            "entries": bloom.count if bloom else 0,
+            "removed": self._removed,
+            "capacity": bloom.capacity if bloom else 0,
+            "bytes": len(bloom.bits) if bloom else 0,
+            "hash_functions": bloom.num_hashes if bloom else 0,
+            "target_fp_rate": self.fp_rate,
+            "estimated_fp_rate": bloom.estimated_fp_rate() if bloom else 0.0,
+            "checks": self.checks,
+            "probes_saved": self.probes_saved,
+            "false_positives": self.false_positives,
+            "observed_fp_rate": (self.false_positives / absent) if absent else 0.0,
+            "last_id": self._last_id,
+            "syncs": self.syncs,
+            "rebuilds": self.rebuilds,
+        }
+
+    def close(self) -> None:
+        """Stop the background thread and snapshot the filter"""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self.save_snapshot()
+
+
+# Global filter instance
+crush_filter = CrushFilter()
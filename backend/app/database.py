@@ -1,210 +1,524 @@
 import sqlite3
 import json
+from collections import Counter
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Dict, Iterable, Optional, List, Tuple
 import os
 
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), "crushes.db")
+import app.encoding as encoding
+import app.sharding as sharding
+from app.encoding import unpack_address, unpack_hash
+from app.shard_layout import HOME_SHARD, ShardSet
+
+DATABASE_PATH = os.environ.get(
+    "CRUSH_DB_PATH",
+    os.path.join(os.path.dirname(__file__), "crushes.db")
+)
+
+# Defer migrations to the first query instead of running them on import
+# (serverless cold starts)
+LAZY_INIT = os.environ.get("CRUSH_LAZY_INIT", "0").lower() in ("1", "true", "yes")
+
+# Per-worker pools of long-lived WAL connections, one per shard. With a
+# single shard (the default) everything lives in DATABASE_PATH; see
+# app.shard_layout for the sharded layout.
+shards = ShardSet(DATABASE_PATH)
+# Shard 0's pool, for its size and stats (queries go through shards, which
+# migrates on first use)
+pool = shards.home
+
+# SQLite's default limit on bound parameters per statement
+SQLITE_MAX_VARIABLES = 999
 
 
 def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection to shard 0 (use as a context manager)"""
+    return shards.connection(HOME_SHARD)
 
 
-def init_db():
-    """Initialize database tables"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Table for encrypted crush submissions
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS crushes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            crusher_address TEXT NOT NULL,
-            crush_address_encrypted TEXT NOT NULL,
-            crush_address_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(crusher_address, crush_address_hash)
-        )
-    """)
-
-    # Table for confirmed matches
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS matches (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user1_address TEXT NOT NULL,
-            user2_address TEXT NOT NULL,
-            matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user1_address, user2_address)
-        )
-    """)
-
-    # Table for user profiles
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            wallet_address TEXT PRIMARY KEY,
-            nickname TEXT,
-            avatar_seed TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+def transaction():
+    """Borrow a pooled shard 0 connection that commits on success (use as a context manager)"""
+    return shards.transaction(HOME_SHARD)
 
-    conn.commit()
-    conn.close()
 
+def close_db():
+    """Close pooled connections on shutdown"""
+    shards.close()
 
-def add_crush(crusher_address: str, crush_address_encrypted: str, crush_address_hash: str) -> bool:
+
+def init_db():
+    """Apply pending schema migrations and create every shard file up front"""
+    # The first use of shard 0 migrates it and records CRUSH_DB_SHARDS
+    # for a new database
+    for shard in shards.all():
+        shards.pool(shard)
+
+
+def pack_address(address: str):
+    """Stored form of an address in crushes and matches (raw bytes in the binary format)"""
+    return encoding.pack_address(address) if shards.binary else address.lower()
+
+
+def pack_hash(value: str):
+    """Stored form of a matching hash in crushes and matches (raw bytes in the binary format)"""
+    return encoding.pack_hash(value) if shards.binary else value.lower()
+
+
+def crush_row(row: sqlite3.Row) -> dict:
+    """A crushes row with its addresses and hashes in text form"""
+    crush = dict(row)
+    crush["crusher_address"] = unpack_address(crush["crusher_address"])
+    crush["crush_address_hash"] = unpack_hash(crush["crush_address_hash"])
+    if crush.get("crusher_address_hash") is not None:
+        crush["crusher_address_hash"] = unpack_hash(crush["crusher_address_hash"])
+    return crush
+
+
+def bump_user_versions(conn: sqlite3.Connection, wallet_addresses) -> None:
+    """Increment the data version of each wallet, inside the caller's transaction"""
+    conn.executemany("""
+        INSERT INTO user_versions (wallet_address, version) VALUES (?, 1)
+        ON CONFLICT(wallet_address) DO UPDATE SET version = version + 1
+    """, [(wallet.lower(),) for wallet in set(wallet_addresses)])
+
+
+def count_crushes(conn: sqlite3.Connection, deltas: Dict[str, int]) -> None:
+    """Adjust crushes_sent per wallet, inside the caller's transaction"""
+    conn.executemany("""
+        INSERT INTO user_counters (wallet_address, crushes_sent) VALUES (?, ?)
+        ON CONFLICT(wallet_address) DO UPDATE SET
+            crushes_sent = crushes_sent + excluded.crushes_sent
+    """, [(wallet.lower(), delta) for wallet, delta in deltas.items() if delta])
+
+
+def record_new_matches(conn: sqlite3.Connection, pairs: Iterable[Tuple[str, str]]) -> None:
+    """Update counters and versions of both sides of newly inserted matches, inside the caller's transaction"""
+    deltas = Counter(wallet.lower() for pair in pairs for wallet in pair)
+    conn.executemany("""
+        INSERT INTO user_counters (wallet_address, matches_count, last_match_at)
+        VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(wallet_address) DO UPDATE SET
+            matches_count = matches_count + excluded.matches_count,
+            last_match_at = excluded.last_match_at
+    """, list(deltas.items()))
+    bump_user_versions(conn, deltas)
+
+
+def get_user_version(wallet_address: str) -> int:
+    """Current data version of a wallet (0 if its data never changed)"""
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT version FROM user_versions WHERE wallet_address = ?
+        """, (wallet_address.lower(),))
+        row = cursor.fetchone()
+        return row['version'] if row else 0
+
+
+def upsert_crush(conn: sqlite3.Connection, row: Tuple[str, bytes, str, str]) -> bool:
+    """Insert or overwrite one crush row, returning True if it is new"""
+    crusher, encrypted, crush_hash, crusher_hash = row = (
+        pack_address(row[0]), row[1], pack_hash(row[2]), pack_hash(row[3])
+    )
+    cursor = conn.execute("""
+        INSERT OR IGNORE INTO crushes
+            (crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash)
+        VALUES (?, ?, ?, ?)
+    """, row)
+    if cursor.rowcount > 0:
+        return True
+
+    conn.execute("""
+        UPDATE crushes SET
+            crush_address_encrypted = ?,
+            crusher_address_hash = ?,
+            created_at = CURRENT_TIMESTAMP
+        WHERE crusher_address = ? AND crush_address_hash = ?
+    """, (encrypted, crusher_hash, crusher, crush_hash))
+    return False
+
+
+def insert_crush(
+    conn: sqlite3.Connection,
+    crusher_address: str,
+    crush_address_encrypted: bytes,
+    crush_address_hash: str,
+    crusher_address_hash: str
+) -> bool:
+    """Store a crush submission inside the caller's transaction"""
+    if upsert_crush(conn, (
+        crusher_address.lower(),
+        crush_address_encrypted,
+        crush_address_hash.lower(),
+        crusher_address_hash.lower()
+    )):
+        count_crushes(conn, {crusher_address: 1})
+    bump_user_versions(conn, [crusher_address])
+    return True
+
+
+def add_crush(
+    crusher_address: str,
+    crush_address_encrypted: bytes,
+    crush_address_hash: str,
+    crusher_address_hash: Optional[str] = None
+) -> bool:
     """Add a new crush submission"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    if crusher_address_hash is None:
+        from app.fhe_matcher import address_hash
+        crusher_address_hash = address_hash(crusher_address)
+
+    if shards.sharded:
+        return sharding.add_crush(
+            crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash
+        )
 
     try:
-        cursor.execute("""
-            INSERT OR REPLACE INTO crushes (crusher_address, crush_address_encrypted, crush_address_hash)
-            VALUES (?, ?, ?)
-        """, (crusher_address.lower(), crush_address_encrypted, crush_address_hash.lower()))
-        conn.commit()
+        with transaction() as conn:
+            insert_crush(
+                conn, crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash
+            )
         return True
     except Exception as e:
         print(f"Error adding crush: {e}")
         return False
-    finally:
-        conn.close()
+
+
+def add_crushes(crushes: List[Tuple[str, bytes, str, str]]) -> Optional[int]:
+    """
+    Add many crush submissions in a single transaction.
+
+    Each item is (crusher_address, crush_address_encrypted, crush_address_hash,
+    crusher_address_hash). Either all rows are written or none are. Returns
+    how many were new (the others overwrote an existing crush), or None on
+    failure.
+    """
+    if shards.sharded:
+        return sharding.add_crushes(crushes)
+
+    try:
+        with transaction() as conn:
+            new_crushes = Counter()
+            for crusher, encrypted, crush_hash, crusher_hash in crushes:
+                row = (crusher.lower(), encrypted, crush_hash.lower(), crusher_hash.lower())
+                if upsert_crush(conn, row):
+                    new_crushes[row[0]] += 1
+            count_crushes(conn, new_crushes)
+            bump_user_versions(conn, [crusher for crusher, _, _, _ in crushes])
+        return sum(new_crushes.values())
+    except Exception as e:
+        print(f"Error adding crushes: {e}")
+        return None
+
+
+def remove_crush(wallet_address: str, crush_address_hash: str) -> bool:
+    """Delete a crush submission; False if there was none"""
+    if shards.sharded:
+        return sharding.remove_crush(wallet_address, crush_address_hash)
+
+    try:
+        with transaction() as conn:
+            cursor = conn.execute("""
+                DELETE FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
+            """, (pack_address(wallet_address), pack_hash(crush_address_hash)))
+            if cursor.rowcount > 0:
+                count_crushes(conn, {wallet_address: -1})
+                bump_user_versions(conn, [wallet_address])
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error removing crush: {e}")
+        return False
 
 
 def get_crushes_by_user(wallet_address: str) -> List[dict]:
     """Get all crushes submitted by a user"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    if shards.sharded:
+        return sharding.get_crushes_by_user(wallet_address)
 
-    cursor.execute("""
-        SELECT * FROM crushes WHERE crusher_address = ?
-    """, (wallet_address.lower(),))
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT * FROM crushes WHERE crusher_address = ?
+        """, (pack_address(wallet_address),))
 
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return results
+        return [crush_row(row) for row in cursor.fetchall()]
 
 
 def check_mutual_crush(address1: str, address2: str) -> bool:
     """Check if two addresses have mutual crushes (both like each other)"""
-    from app.fhe_matcher import encrypt_crush
-
-    conn = get_connection()
-    cursor = conn.cursor()
+    from app.fhe_matcher import address_hash
+
+    # Only address2 needs hashing: address1's hash is stored on its crush row
+    address2_hash = address_hash(address2)
+
+    if shards.sharded:
+        return sharding.check_mutual_crush(address1, address2, address2_hash)
+
+    with get_connection() as conn:
+        # address1 has a crush on address2, and address2 has a crush on
+        # address1 (probed with the crusher hash stored on address1's row)
+        cursor = conn.execute("""
+            SELECT 1 FROM crushes a
+            JOIN crushes b ON b.crusher_address = ?
+                AND b.crush_address_hash = a.crusher_address_hash
+            WHERE a.crusher_address = ? AND a.crush_address_hash = ?
+        """, (pack_address(address2), pack_address(address1), pack_hash(address2_hash)))
+        return cursor.fetchone() is not None
+
+
+def find_mutual_crushes(edges: List[Tuple[str, str, str]]) -> List[Tuple[str, str]]:
+    """
+    Find which submitted crushes are returned, with one set-based query.
+
+    Each edge is (crusher_address, crush_address, crusher_address_hash) for a
+    crush that is already stored. Returns the (crusher_address, crush_address)
+    pairs, lowercased, for which the crush has also submitted the crusher.
+    """
+    if shards.sharded:
+        return sharding.find_mutual_crushes(edges)
+
+    rows = list({
+        (crusher.lower(), crush.lower(), crusher_hash.lower())
+        for crusher, crush, crusher_hash in edges
+    })
+    with get_connection() as conn:
+        return mutual_crushes(conn, rows)
+
+
+def mutual_crushes(conn: sqlite3.Connection, rows: List[Tuple[str, str, str]]) -> List[Tuple[str, str]]:
+    """find_mutual_crushes over lowercased, deduplicated edges, using an already borrowed connection"""
+    chunk_size = SQLITE_MAX_VARIABLES // 3
+
+    mutual = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        values = ", ".join(["(?, ?, ?)"] * len(chunk))
+        params = [
+            value for crusher, crush, crusher_hash in chunk
+            for value in (pack_address(crusher), pack_address(crush), pack_hash(crusher_hash))
+        ]
+        cursor = conn.execute(f"""
+            WITH batch(crusher_address, crush_address, crusher_hash) AS (VALUES {values})
+            SELECT batch.crusher_address, batch.crush_address FROM batch
+            JOIN crushes ON crushes.crusher_address = batch.crush_address
+                AND crushes.crush_address_hash = batch.crusher_hash
+        """, params)
+        mutual.extend((unpack_address(row[0]), unpack_address(row[1])) for row in cursor.fetchall())
+    return mutual
+
+
+def insert_match(conn: sqlite3.Connection, address1: str, address2: str) -> Optional[str]:
+    """Record a match inside the caller's transaction, returning its stored matched_at (None if it already existed)"""
+    # Normalize order to prevent duplicates
+    addr1, addr2 = sorted([address1.lower(), address2.lower()])
 
-    # Get the hash of each address for comparison
-    _, address1_hash = encrypt_crush(address1)
-    _, address2_hash = encrypt_crush(address2)
+    rows = conn.execute("""
+        INSERT OR IGNORE INTO matches (user1_address, user2_address)
+        VALUES (?, ?)
+        RETURNING matched_at
+    """, (pack_address(addr1), pack_address(addr2))).fetchall()
+    if not rows:
+        return None
+    record_new_matches(conn, [(addr1, addr2)])
+    return rows[0][0]
 
-    # Check if address1 has crush on address2
-    cursor.execute("""
-        SELECT 1 FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
-    """, (address1.lower(), address2_hash))
-    a_likes_b = cursor.fetchone() is not None
 
-    # Check if address2 has crush on address1
-    cursor.execute("""
-        SELECT 1 FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
-    """, (address2.lower(), address1_hash))
-    b_likes_a = cursor.fetchone() is not None
+def add_match(address1: str, address2: str) -> Optional[str]:
+    """Record a match between two users, returning its stored matched_at (None if it already existed)"""
+    if shards.sharded:
+        return sharding.add_match(address1, address2)
 
-    conn.close()
-    return a_likes_b and b_likes_a
+    try:
+        with transaction() as conn:
+            return insert_match(conn, address1, address2)
+    except Exception as e:
+        print(f"Error adding match: {e}")
+        return None
 
 
-def add_match(address1: str, address2: str) -> bool:
-    """Record a match between two users"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def add_matches(pairs: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+    """Record many matches in a single transaction, returning the new ones as (address1, address2, matched_at)"""
+    if shards.sharded:
+        return sharding.add_matches(pairs)
 
     # Normalize order to prevent duplicates
+    normalized = sorted({tuple(sorted([a.lower(), b.lower()])) for a, b in pairs})
+
+    try:
+        inserted = []
+        with transaction() as conn:
+            for pair in normalized:
+                for row in conn.execute("""
+                    INSERT OR IGNORE INTO matches (user1_address, user2_address)
+                    VALUES (?, ?)
+                    RETURNING matched_at
+                """, (pack_address(pair[0]), pack_address(pair[1]))).fetchall():
+                    inserted.append((*pair, row[0]))
+            record_new_matches(conn, [(address1, address2) for address1, address2, _ in inserted])
+        return inserted
+    except Exception as e:
+        print(f"Error adding matches: {e}")
+        return []
+
+
+def get_match_proof(address1: str, address2: str) -> Optional[str]:
+    """Proof already issued for a match, if any"""
+    if shards.sharded:
+        return sharding.get_match_proof(address1, address2)
+
+    addr1, addr2 = sorted([address1.lower(), address2.lower()])
+
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT proof FROM matches WHERE user1_address = ? AND user2_address = ?
+        """, (pack_address(addr1), pack_address(addr2)))
+        row = cursor.fetchone()
+        return row['proof'] if row else None
+
+
+def set_match_proof(address1: str, address2: str, proof: str) -> bool:
+    """Remember the proof issued for a match; False if there is no match row"""
+    if shards.sharded:
+        return sharding.set_match_proof(address1, address2, proof)
+
     addr1, addr2 = sorted([address1.lower(), address2.lower()])
 
     try:
-        cursor.execute("""
-            INSERT OR IGNORE INTO matches (user1_address, user2_address)
-            VALUES (?, ?)
-        """, (addr1, addr2))
-        conn.commit()
+        with transaction() as conn:
+            cursor = conn.execute("""
+                UPDATE matches SET proof = ? WHERE user1_address = ? AND user2_address = ?
+            """, (proof, pack_address(addr1), pack_address(addr2)))
         return cursor.rowcount > 0
     except Exception as e:
-        print(f"Error adding match: {e}")
+        print(f"Error saving match proof: {e}")
         return False
-    finally:
-        conn.close()
 
 
-def get_matches_for_user(wallet_address: str) -> List[str]:
-    """Get all matches for a user"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
+def matches_for_user(conn: sqlite3.Connection, wallet_address: str) -> List[str]:
+    """Matched addresses for a user, using an already borrowed connection"""
+    wallet = pack_address(wallet_address)
+    cursor = conn.execute("""
         SELECT user1_address, user2_address FROM matches
         WHERE user1_address = ? OR user2_address = ?
-    """, (wallet_address.lower(), wallet_address.lower()))
+    """, (wallet, wallet))
 
     matches = []
     for row in cursor.fetchall():
-        if row['user1_address'] == wallet_address.lower():
-            matches.append(row['user2_address'])
+        if row['user1_address'] == wallet:
+            matches.append(unpack_address(row['user2_address']))
         else:
-            matches.append(row['user1_address'])
-
-    conn.close()
+            matches.append(unpack_address(row['user1_address']))
     return matches
 
 
-def get_user_stats(wallet_address: str) -> dict:
-    """Get user statistics"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Count crushes sent
-    cursor.execute("""
-        SELECT COUNT(*) as count FROM crushes WHERE crusher_address = ?
-    """, (wallet_address.lower(),))
-    crushes_sent = cursor.fetchone()['count']
-
-    # Get matches
-    matches = get_matches_for_user(wallet_address)
-
-    conn.close()
+def get_matches_for_user(wallet_address: str) -> List[str]:
+    """Get all matches for a user"""
+    if shards.sharded:
+        return sharding.get_matches_for_user(wallet_address)
+
+    with get_connection() as conn:
+        return matches_for_user(conn, wallet_address)
+
+
+def get_matches_page(
+    wallet_address: str,
+    limit: int,
+    after: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, int, str]]:
+    """
+    One page of a wallet's matches in (matched_at, id) order.
+
+    Returns (matched_at, id, matched_address) rows that come after the
+    `after` key, read from the covering (participant, matched_at, id) indexes.
+    With several shards the ids are global ids (see app.sharding).
+    """
+    if shards.sharded:
+        return sharding.get_matches_page(wallet_address, limit, after)
+
+    with get_connection() as conn:
+        return matches_page(conn, wallet_address, limit, after)
+
+
+def matches_page(
+    conn: sqlite3.Connection,
+    wallet_address: str,
+    limit: int,
+    after: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, int, str]]:
+    """get_matches_page using an already borrowed connection"""
+    wallet = pack_address(wallet_address)
+    matched_at, match_id = after or ("", 0)
+
+    cursor = conn.execute("""
+        SELECT matched_at, id, user2_address FROM matches
+        WHERE user1_address = ? AND (matched_at, id) > (?, ?)
+        UNION ALL
+        SELECT matched_at, id, user1_address FROM matches
+        WHERE user2_address = ? AND (matched_at, id) > (?, ?)
+        ORDER BY 1, 2
+        LIMIT ?
+    """, (wallet, matched_at, match_id, wallet, matched_at, match_id, limit))
+    return [(row[0], row[1], unpack_address(row[2])) for row in cursor.fetchall()]
+
+
+def get_user_stats(wallet_address: str, include_matches: bool = False) -> dict:
+    """
+    Get user statistics.
+
+    Counts come from user_counters with one primary-key read. The matched
+    addresses are only loaded when `include_matches` is set (None otherwise).
+    """
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT crushes_sent, matches_count, last_match_at FROM user_counters
+            WHERE wallet_address = ?
+        """, (wallet_address.lower(),))
+        row = cursor.fetchone()
+
+    matches = get_matches_for_user(wallet_address) if include_matches else None
 
     return {
         "wallet_address": wallet_address,
-        "crushes_sent": crushes_sent,
-        "matches_count": len(matches),
+        "crushes_sent": row['crushes_sent'] if row else 0,
+        "matches_count": row['matches_count'] if row else 0,
+        "last_match_at": row['last_match_at'] if row else None,
         "matches": matches
     }
 
 
+def get_users_after(rowid: int, limit: int) -> List[Tuple[int, str]]:
+    """Registered wallets in insertion order, as (rowid, wallet_address) pairs after `rowid`"""
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT rowid, wallet_address FROM users
+            WHERE rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        """, (rowid, limit))
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def upsert_user(conn: sqlite3.Connection, wallet_address: str, nickname: Optional[str] = None) -> bool:
+    """Register or update a user inside the caller's transaction"""
+    conn.execute("""
+        INSERT INTO users (wallet_address, nickname, avatar_seed)
+        VALUES (?, ?, ?)
+        ON CONFLICT(wallet_address) DO UPDATE SET
+            last_active = CURRENT_TIMESTAMP,
+            nickname = COALESCE(?, nickname)
+    """, (wallet_address.lower(), nickname, wallet_address[:8], nickname))
+    return True
+
+
 def register_user(wallet_address: str, nickname: Optional[str] = None) -> bool:
     """Register or update a user"""
-    conn = get_connection()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("""
-            INSERT INTO users (wallet_address, nickname, avatar_seed)
-            VALUES (?, ?, ?)
-            ON CONFLICT(wallet_address) DO UPDATE SET
-                last_active = CURRENT_TIMESTAMP,
-                nickname = COALESCE(?, nickname)
-        """, (wallet_address.lower(), nickname, wallet_address[:8], nickname))
-        conn.commit()
+        with transaction() as conn:
+            upsert_user(conn, wallet_address, nickname)
         return True
     except Exception as e:
         print(f"Error registering user: {e}")
         return False
-    finally:
-        conn.close()
 
 
-# Initialize database on module load
-init_db()
+# Initialize database on module load, unless deferred to the first query
+if not LAZY_INIT:
+    init_db()
@@ -0,0 +1,188 @@
+"""
+SQLite connection pool for the crush database.
+
+Opening a fresh connection for every query means a connect/close and a
+rollback-journal fsync on each call. The pool keeps a bounded set of
+long-lived connections per worker process, switches the database to WAL
+mode, applies tuned pragmas once per connection and lets sqlite3 reuse
+prepared statements through its per-connection statement cache. Every
+connection also gets the SQL functions of app.encoding, and times its
+statements and commits for app.metrics and the slow-query log of
+app.profiling.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import app.metrics as metrics
+from app.encoding import register_sql_functions
+from app.profiling import profiler
+
+# Pool sizing (per worker process)
+POOL_SIZE = int(os.environ.get("CRUSH_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("CRUSH_DB_POOL_TIMEOUT", "10"))
+
+# How long a connection waits on SQLite's write lock before giving up
+BUSY_TIMEOUT = float(os.environ.get("CRUSH_DB_BUSY_TIMEOUT", "5"))
+
+# Prepared statements kept per connection by sqlite3
+STATEMENT_CACHE_SIZE = int(os.environ.get("CRUSH_DB_STATEMENT_CACHE", "256"))
+
+# Applied to every new connection. NORMAL is durable across application
+# crashes in WAL mode and only skips the fsync on each commit.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": os.environ.get("CRUSH_DB_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.environ.get("CRUSH_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.environ.get("CRUSH_DB_CACHE_SIZE", "-16000")),  # negative = KiB
+    "temp_store": "MEMORY",
+}
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection recording the latency of each statement and commit"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self._record(sql, parameters, time.perf_counter() - started, many=True)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self._record("COMMIT", (), time.perf_counter() - started, kind="commit")
+
+    def _record(self, sql, parameters, elapsed: float, kind: str = None, many: bool = False) -> None:
+        kind = kind or metrics.statement_kind(sql)
+        metrics.DB_QUERY_DURATION.observe(elapsed, kind)
+        if elapsed >= profiler.slow_query_seconds:
+            profiler.record_query(self, super().execute, sql, parameters, elapsed, kind, many)
+
+
+def open_connection(path: str, pragmas: dict = PRAGMAS) -> sqlite3.Connection:
+    """Open a tuned connection outside of any pool (e.g. for long-running jobs)"""
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=TimedConnection,
+    )
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    register_sql_functions(conn)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections shared by all threads of a worker.
+
+    Connections are created lazily up to `size`. When all of them are
+    borrowed, callers wait up to `timeout` seconds for one to come back.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        """Borrow a connection, opening a new one if the pool isn't full yet"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return open_connection(self.path)
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No database connection available after {self.timeout}s "
+                f"(pool size {self.size})"
+            )
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a borrowed connection, discarding any unfinished transaction"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of a `with` block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection and commit on success, roll back on error"""
+        with self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def stats(self) -> dict:
+        """Current pool occupancy"""
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "open": self._created,
+            "idle": idle,
+            "in_use": self._created - idle,
+        }
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+
+        Used at shutdown. The pool stays usable afterwards and simply
+        reopens connections on demand.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._created -= 1
+            conn.close()
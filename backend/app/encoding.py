@@ -0,0 +1,133 @@
+"""
+Compact binary encodings of addresses, hashes and ciphertexts.
+
+In the binary storage format (see app.compact), crushes and matches hold
+wallet addresses as raw 20-byte BLOBs and matching hashes as raw 32-byte
+BLOBs instead of 42- and 64-character hex TEXT. Ciphertexts are stored as
+a versioned binary envelope:
+
+    version (1) | algorithm (1) | nonce (8) | ciphertext
+
+Packing is lossless. An address that isn't `0x` plus 40 hex digits (or a
+hash that isn't 64 hex digits) is kept as lowercased TEXT, and unpacking
+accepts both forms. The byte order of packed hex values matches the order
+of their hex strings, so sorted address pairs stay sorted.
+"""
+
+import base64
+import binascii
+import json
+import sqlite3
+from typing import Optional, Union
+
+ADDRESS_SIZE = 20
+HASH_SIZE = 32
+
+# Ciphertext envelope: version (1) | algorithm (1) | nonce (8) | ciphertext
+CIPHERTEXT_VERSION = 2
+NONCE_SIZE = 8
+CIPHERTEXT_ALGORITHMS = {"FHE_SIMULATED": 1}
+
+Stored = Union[bytes, str]
+
+
+def pack_address(address: Stored) -> Stored:
+    """20 raw bytes of a `0x` hex wallet address, or the lowercased text otherwise"""
+    if isinstance(address, bytes):
+        return address
+    normalized = address.lower()
+    if len(normalized) == 2 + 2 * ADDRESS_SIZE and normalized.startswith("0x"):
+        try:
+            return bytes.fromhex(normalized[2:])
+        except ValueError:
+            pass
+    return normalized
+
+
+def unpack_address(value: Stored) -> str:
+    """Text form of a stored address (packed or not)"""
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    return value
+
+
+def pack_hash(value: Stored) -> Stored:
+    """32 raw bytes of a hex matching hash, or the lowercased text otherwise"""
+    if isinstance(value, bytes):
+        return value
+    normalized = value.lower()
+    if len(normalized) == 2 * HASH_SIZE:
+        try:
+            return bytes.fromhex(normalized)
+        except ValueError:
+            pass
+    return normalized
+
+
+def unpack_hash(value: Stored) -> str:
+    """Hex form of a stored matching hash (packed or not)"""
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def pack_ciphertext(algorithm: str, nonce: bytes, ciphertext: bytes) -> bytes:
+    """Binary envelope of a ciphertext"""
+    if len(nonce) != NONCE_SIZE:
+        raise ValueError(f"Nonce must be {NONCE_SIZE} bytes")
+    return bytes([CIPHERTEXT_VERSION, CIPHERTEXT_ALGORITHMS[algorithm]]) + nonce + ciphertext
+
+
+def parse_ciphertext(data: Stored) -> Optional[dict]:
+    """
+    Fields of a stored ciphertext, or None if it can't be parsed.
+
+    Accepts the binary envelope and the legacy format (base64 of a JSON
+    object whose ciphertext is base64 and whose nonce is hex).
+    """
+    if isinstance(data, bytes) and data[:1] == bytes([CIPHERTEXT_VERSION]):
+        algorithms = {number: name for name, number in CIPHERTEXT_ALGORITHMS.items()}
+        if len(data) < 2 + NONCE_SIZE or data[1] not in algorithms:
+            return None
+        return {
+            "version": CIPHERTEXT_VERSION,
+            "algorithm": algorithms[data[1]],
+            "nonce": data[2:2 + NONCE_SIZE],
+            "ciphertext": data[2 + NONCE_SIZE:],
+        }
+
+    try:
+        payload = json.loads(base64.b64decode(data))
+        return {
+            "version": payload["version"],
+            "algorithm": payload["algorithm"],
+            "nonce": bytes.fromhex(payload["nonce"]),
+            "ciphertext": base64.b64decode(payload["ciphertext"]),
+        }
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+def upgrade_ciphertext(data: Stored) -> Stored:
+    """Binary envelope of a legacy ciphertext; anything else is returned unchanged"""
+    if isinstance(data, bytes) and data[:1] == bytes([CIPHERTEXT_VERSION]):
+        return data
+    fields = parse_ciphertext(data)
+    if fields is None or fields["algorithm"] not in CIPHERTEXT_ALGORITHMS or len(fields["nonce"]) != NONCE_SIZE:
+        return data
+    return pack_ciphertext(fields["algorithm"], fields["nonce"], fields["ciphertext"])
+
+
+def register_sql_functions(conn: sqlite3.Connection) -> None:
+    """Make the codecs available to SQL (used by the compaction triggers and counter queries)"""
+    for name, fn in (
+        ("pack_address", pack_address),
+        ("pack_hash", pack_hash),
+        ("upgrade_ciphertext", upgrade_ciphertext),
+        ("address_text", unpack_address),
+    ):
+        conn.create_function(name, 1, _null_safe(fn), deterministic=True)
+
+
+def _null_safe(fn):
+    return lambda value: None if value is None else fn(value)
@@ -7,14 +7,79 @@ Only mutual matches are revealed.
 """
 
 import hashlib
+import hmac
 import base64
-from typing import Tuple, Optional
+import os
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Type
 import json
 
+from app.encoding import NONCE_SIZE, pack_ciphertext
+
+# Number of address hashes memoized for hot addresses
+HASH_CACHE_SIZE = int(os.environ.get("CRUSH_HASH_CACHE_SIZE", "65536"))
+
+# Binary match proof layout: version (1) | address (20) | address (20) | tag (16)
+PROOF_VERSION = 2
+PROOF_TAG_SIZE = 16
+PROOF_SIZE = 1 + 20 + 20 + PROOF_TAG_SIZE
+
+# Which matcher backend to use (see MATCHER_BACKENDS)
+MATCHER_BACKEND = os.environ.get("CRUSH_MATCHER_BACKEND", "simulated")
+
+# Per-operation delay of the "slow" load-testing backend
+SLOW_MATCHER_DELAY = float(os.environ.get("CRUSH_SLOW_MATCHER_DELAY_MS", "50")) / 1000
+
+
+class MatcherBackend(ABC):
+    """
+    Interface of a crush matcher backend.
+
+    Backends are constructed as `Backend(secret_key=...)`, so the
+    execution engine can recreate them inside worker processes with the
+    server's key.
+    """
+
+    name: str = ""
+    secret_key: bytes
+
+    @abstractmethod
+    def encrypt_address(self, wallet_address: str) -> Tuple[bytes, str]:
+        """Encrypt an address, returning (encrypted_data, address_hash)"""
+
+    @abstractmethod
+    def address_hash(self, wallet_address: str) -> str:
+        """Deterministic matching hash of an address"""
+
+    @abstractmethod
+    def check_match_encrypted(
+        self,
+        crusher_address: str,
+        crush_hash: str,
+        potential_crusher_address: str,
+        potential_crush_hash: str
+    ) -> bool:
+        """Whether two users have mutual crushes"""
+
+    @abstractmethod
+    def create_match_proof(self, address1: str, address2: str) -> str:
+        """Proof that two addresses matched"""
+
+    @abstractmethod
+    def verify_match_proof(self, proof: str, address1: str, address2: str) -> bool:
+        """Verify a match proof"""
+
+    def verify_match_proofs(self, items: List[Tuple[str, str, str]]) -> List[bool]:
+        """Verify many (proof, address1, address2) items, one after another"""
+        return [self.verify_match_proof(*item) for item in items]
+
+
 # For demo purposes, we'll use a simplified FHE simulation
 # In production, you would use concrete-ml for actual FHE operations
 
-class FHECrushMatcher:
+class FHECrushMatcher(MatcherBackend):
     """
     FHE-based crush matching system.
 
@@ -25,45 +90,71 @@ class FHECrushMatcher:
     4. Unrequited crushes remain encrypted forever
     """
 
-    def __init__(self):
-        self.secret_key = self._generate_server_key()
+    name = "simulated"
+
+    def __init__(self, secret_key: Optional[bytes] = None, hash_cache_size: int = HASH_CACHE_SIZE):
+        self.secret_key = secret_key or self._generate_server_key()
+
+        # The matching hash is SHA-256(address + hex(key)); encode the key
+        # suffix once instead of on every call
+        self._key_suffix = self.secret_key.hex().encode()
+
+        # Bounded LRU memo of matching hashes, keyed by normalized address
+        self._cached_hash = lru_cache(maxsize=hash_cache_size)(self._compute_hash)
+
+        # Keyed HMAC state for match proofs; copied per proof
+        self._proof_mac = hmac.new(self.secret_key, b"mutual_crush_proof", hashlib.sha256)
 
     def _generate_server_key(self) -> bytes:
         """Generate server's secret key for FHE operations"""
         # In production, this would be a proper FHE key generation
         return hashlib.sha256(b"secret_crush_matcher_key_v1").digest()
 
-    def encrypt_address(self, wallet_address: str) -> Tuple[str, str]:
+    def _compute_hash(self, normalized: str) -> str:
+        return hashlib.sha256(normalized.encode() + self._key_suffix).hexdigest()
+
+    def address_hash(self, wallet_address: str) -> str:
+        """
+        Deterministic matching hash of a wallet address.
+
+        This is the hash half of encrypt_address, without building the
+        ciphertext. Use it whenever only the hash is needed.
+        """
+        return self._cached_hash(wallet_address.lower().strip())
+
+    def hash_cache_info(self) -> dict:
+        """Hit/miss counters of the address hash memo"""
+        info = self._cached_hash.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+        }
+
+    def encrypt_address(self, wallet_address: str) -> Tuple[bytes, str]:
         """
         Encrypt a wallet address for storage.
 
         Returns:
             Tuple of (encrypted_data, address_hash)
-            - encrypted_data: The FHE encrypted address
+            - encrypted_data: The FHE encrypted address, as a binary
+              envelope (see app.encoding.pack_ciphertext)
             - address_hash: A deterministic hash for matching (also encrypted in production)
         """
         normalized = wallet_address.lower().strip()
 
         # Create a deterministic hash for comparison
         # In real FHE, this comparison happens on encrypted data
-        address_hash = hashlib.sha256(
-            (normalized + self.secret_key.hex()).encode()
-        ).hexdigest()
+        address_hash = self._cached_hash(normalized)
 
         # Simulate FHE encryption
         # In production, use concrete-ml's encryption
-        encrypted_payload = {
-            "version": "1.0",
-            "algorithm": "FHE_SIMULATED",
-            "ciphertext": base64.b64encode(
-                hashlib.sha512((normalized + "encrypted").encode()).digest()
-            ).decode(),
-            "nonce": hashlib.md5(normalized.encode()).hexdigest()[:16]
-        }
-
-        encrypted_data = base64.b64encode(
-            json.dumps(encrypted_payload).encode()
-        ).decode()
+        encrypted_data = pack_ciphertext(
+            "FHE_SIMULATED",
+            nonce=hashlib.md5(normalized.encode()).digest()[:NONCE_SIZE],
+            ciphertext=hashlib.sha512((normalized + "encrypted").encode()).digest(),
+        )
 
         return encrypted_data, address_hash
 
@@ -97,8 +188,8 @@ class FHECrushMatcher:
         # 3. Only decrypt if result is True (match found)
 
         # Generate hashes for comparison
-        _, crusher_as_crush_hash = self.encrypt_address(crusher_address)
-        _, potential_as_crush_hash = self.encrypt_address(potential_crusher_address)
+        crusher_as_crush_hash = self.address_hash(crusher_address)
+        potential_as_crush_hash = self.address_hash(potential_crusher_address)
 
         # FHE comparison (simulated)
         # In production: concrete_ml.fhe_circuit.run(encrypted_comparison)
@@ -114,46 +205,167 @@ class FHECrushMatcher:
 
         This proof can be verified by both parties without revealing
         the original crush submissions to anyone else.
+
+        Proofs use the compact binary format: a version byte, both raw
+        20-byte addresses in sorted order and a truncated HMAC-SHA256 tag,
+        base64url-encoded. Addresses that aren't 20-byte hex fall back to
+        the legacy JSON format.
         """
+        raw1, raw2 = _address_bytes(address1), _address_bytes(address2)
+        if raw1 is None or raw2 is None:
+            return self._create_legacy_proof(address1, address2)
+
+        low, high = sorted([raw1, raw2])
+        body = bytes([PROOF_VERSION]) + low + high
+        return base64.urlsafe_b64encode(body + self._proof_tag(low, high)).decode()
+
+    def verify_match_proof(self, proof: str, address1: str, address2: str) -> bool:
+        """Verify a match proof is valid (binary or legacy JSON)"""
+        try:
+            raw = base64.urlsafe_b64decode(proof)
+        except Exception:
+            return False
+
+        if raw[:1] == bytes([PROOF_VERSION]):
+            return self._verify_binary_proof(raw, address1, address2)
+        return self._verify_legacy_proof(raw, address1, address2)
+
+    def _proof_tag(self, low: bytes, high: bytes) -> bytes:
+        mac = self._proof_mac.copy()
+        mac.update(low + high)
+        return mac.digest()[:PROOF_TAG_SIZE]
+
+    def _verify_binary_proof(self, raw: bytes, address1: str, address2: str) -> bool:
+        if len(raw) != PROOF_SIZE:
+            return False
+
+        raw1, raw2 = _address_bytes(address1), _address_bytes(address2)
+        if raw1 is None or raw2 is None:
+            return False
+
+        low, high = sorted([raw1, raw2])
+        expected = bytes([PROOF_VERSION]) + low + high + self._proof_tag(low, high)
+        return hmac.compare_digest(raw, expected)
+
+    def _create_legacy_proof(self, address1: str, address2: str) -> str:
         sorted_addresses = sorted([address1.lower(), address2.lower()])
         proof_data = {
             "type": "mutual_crush_proof",
             "participants": sorted_addresses,
             "proof_hash": hashlib.sha256(
-                (sorted_addresses[0] + sorted_addresses[1] + self.secret_key.hex()).encode()
+                (sorted_addresses[0] + sorted_addresses[1]).encode() + self._key_suffix
             ).hexdigest(),
             "version": "1.0"
         }
         return base64.b64encode(json.dumps(proof_data).encode()).decode()
 
-    def verify_match_proof(self, proof: str, address1: str, address2: str) -> bool:
-        """Verify a match proof is valid"""
+    def _verify_legacy_proof(self, raw: bytes, address1: str, address2: str) -> bool:
         try:
-            proof_data = json.loads(base64.b64decode(proof).decode())
+            proof_data = json.loads(raw.decode())
             sorted_addresses = sorted([address1.lower(), address2.lower()])
 
             expected_hash = hashlib.sha256(
-                (sorted_addresses[0] + sorted_addresses[1] + self.secret_key.hex()).encode()
+                (sorted_addresses[0] + sorted_addresses[1]).encode() + self._key_suffix
             ).hexdigest()
 
             return (
                 proof_data["type"] == "mutual_crush_proof" and
                 proof_data["participants"] == sorted_addresses and
-                proof_data["proof_hash"] == expected_hash
+                hmac.compare_digest(str(proof_data["proof_hash"]), expected_hash)
             )
         except Exception:
             return False
 
 
+def _address_bytes(address: str) -> Optional[bytes]:
+    """Raw 20 bytes of a hex wallet address, or None if it isn't one"""
+    normalized = address.lower().strip()
+    if normalized.startswith("0x"):
+        normalized = normalized[2:]
+    if len(normalized) != 40:
+        return None
+    try:
+        return bytes.fromhex(normalized)
+    except ValueError:
+        return None
+
+
+class SlowFHECrushMatcher(FHECrushMatcher):
+    """
+    Simulated matcher that sleeps on every operation.
+
+    A local stand-in for real FHE, where each operation takes milliseconds
+    to seconds. Use it to load-test the execution engine.
+    """
+
+    name = "slow"
+
+    def __init__(self, secret_key: Optional[bytes] = None, delay: float = SLOW_MATCHER_DELAY):
+        super().__init__(secret_key)
+        self.delay = delay
+
+    def _compute_hash(self, normalized: str) -> str:
+        time.sleep(self.delay)
+        return super()._compute_hash(normalized)
+
+    def encrypt_address(self, wallet_address: str) -> Tuple[bytes, str]:
+        time.sleep(self.delay)
+        return super().encrypt_address(wallet_address)
+
+    def check_match_encrypted(
+        self,
+        crusher_address: str,
+        crush_hash: str,
+        potential_crusher_address: str,
+        potential_crush_hash: str
+    ) -> bool:
+        time.sleep(self.delay)
+        return super().check_match_encrypted(
+            crusher_address, crush_hash,
+            potential_crusher_address, potential_crush_hash
+        )
+
+    def create_match_proof(self, address1: str, address2: str) -> str:
+        time.sleep(self.delay)
+        return super().create_match_proof(address1, address2)
+
+    def verify_match_proof(self, proof: str, address1: str, address2: str) -> bool:
+        time.sleep(self.delay)
+        return super().verify_match_proof(proof, address1, address2)
+
+
+# Available backends by name
+MATCHER_BACKENDS: Dict[str, Type[MatcherBackend]] = {
+    FHECrushMatcher.name: FHECrushMatcher,
+    SlowFHECrushMatcher.name: SlowFHECrushMatcher,
+}
+
+
+def create_matcher(name: str = MATCHER_BACKEND, secret_key: Optional[bytes] = None) -> MatcherBackend:
+    """Instantiate a matcher backend by name"""
+    try:
+        backend = MATCHER_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown matcher backend {name!r} (available: {', '.join(MATCHER_BACKENDS)})"
+        )
+    return backend(secret_key=secret_key)
+
+
 # Global FHE matcher instance
-fhe_matcher = FHECrushMatcher()
+fhe_matcher = create_matcher()
 
 
-def encrypt_crush(wallet_address: str) -> Tuple[str, str]:
+def encrypt_crush(wallet_address: str) -> Tuple[bytes, str]:
     """Convenience function to encrypt a crush address"""
     return fhe_matcher.encrypt_address(wallet_address)
 
 
+def address_hash(wallet_address: str) -> str:
+    """Convenience function to get the matching hash of an address"""
+    return fhe_matcher.address_hash(wallet_address)
+
+
 def check_for_match(
     user_address: str,
     user_crush_hash: str,
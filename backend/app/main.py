@@ -5,29 +5,76 @@ A fun dating/social app where users can secretly submit their crush's wallet add
 If two people BOTH submit each other, they match! All powered by FHE.
 """
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, status, Header, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
-from datetime import datetime
-import uvicorn
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import hmac
+import io
+import json
+import os
+import sys
+import tempfile
+from typing import List, Optional, Tuple
 
 from app.models import (
     CrushSubmission,
     CrushResponse,
-    MatchResult,
     UserStats,
     MatchNotification,
-    CompatibilityResult
+    CompatibilityResult,
+    CompatibilityBatchRequest,
+    CompatibilityBatchResult,
+    CompatibleUser,
+    CompatibilityTopResult,
+    ProofBatchVerifyRequest,
+    ProofBatchVerifyResult
 )
-from app.fhe_matcher import encrypt_crush, check_for_match, generate_match_proof, fhe_matcher
-import app.database as db
+from app.fhe_matcher import fhe_matcher
+import app.async_database as adb
+import app.bulk as bulk
+import app.metrics as metrics
+from app.profiling import ProfilingMiddleware, profiler
+from app.matcher_engine import matcher_engine
+from app.crush_filter import crush_filter
+from app.notifications import match_hub, format_sse, next_event, RESYNC
+from app.storage import RECONCILE_CHUNK_SIZE
+
+# The compatibility modules (and numpy) are imported by the routes that
+# use them, which keeps cold starts short for serverless deployments.
+
+# Token required by /api/admin endpoints (disabled when unset)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup/shutdown hooks"""
+    # Spawn matcher workers and load keys before serving requests
+    await matcher_engine.start()
+    # Build (or load) the crush filter in the background
+    crush_filter.start()
+    yield
+    crush_filter.close()
+    matcher_engine.close()
+    # Stop the DB executor and close pooled SQLite connections so the WAL
+    # is checkpointed cleanly
+    adb.close()
+    index = sys.modules.get("app.compatibility_index")
+    if index is not None:
+        index.compatibility_index.close()
+
 
 app = FastAPI(
     title="Secret Crush Matcher API",
     description="Find your secret crush... privately! Powered by FHE (Fully Homomorphic Encryption)",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS middleware for frontend
@@ -37,18 +84,56 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# Sampled request profiles (see /api/admin/profiles)
+app.add_middleware(ProfilingMiddleware, admin_token=ADMIN_TOKEN)
+
+# Per-route latency histograms (see /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+# Stats and matches may be cached but must be revalidated on every use
+USER_DATA_CACHE_CONTROL = "private, no-cache"
+
+
+def user_data_headers(kind: str, version: int) -> dict:
+    """ETag (derived from the wallet's version counter) for per-wallet data"""
+    return {"ETag": f'"{kind}-{version}"', "Cache-Control": USER_DATA_CACHE_CONTROL}
+
+
+def static_json(content: dict) -> bytes:
+    """Body of a constant JSON response, serialized once at import"""
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+ROOT_BODY = static_json({
+    "message": "Welcome to Secret Crush Matcher!",
+    "tagline": "Find your secret crush... privately",
+    "powered_by": "Zama FHE (Fully Homomorphic Encryption)",
+    "docs": "/docs"
+})
+
+HEALTH_BODY = static_json({
+    "status": "healthy",
+    "service": "Secret Crush Matcher",
+    "fhe_enabled": True
+})
+
 
 @app.get("/")
 async def root():
     """Welcome endpoint"""
-    return {
-        "message": "Welcome to Secret Crush Matcher!",
-        "tagline": "Find your secret crush... privately",
-        "powered_by": "Zama FHE (Fully Homomorphic Encryption)",
-        "docs": "/docs"
-    }
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 
 @app.post("/api/connect", status_code=status.HTTP_200_OK)
@@ -60,7 +145,12 @@ async def connect_wallet(wallet_address: str):
             detail="Invalid wallet address"
         )
 
-    db.register_user(wallet_address)
+    if await adb.register_user(wallet_address):
+        # Make the wallet visible to top-K queries on this worker right away
+        # (an index loaded later reads it from storage)
+        index = sys.modules.get("app.compatibility_index")
+        if index is not None:
+            index.compatibility_index.add([wallet_address])
 
     return {
         "success": True,
@@ -91,14 +181,18 @@ async def submit_crush(submission: CrushSubmission):
             detail="You can't have a crush on yourself! (But self-love is important too)"
         )
 
-    # Encrypt the crush address using FHE
-    encrypted_crush, crush_hash = encrypt_crush(submission.crush_address)
+    # Encrypt the crush address using FHE (off the event loop, with the crusher's hash)
+    (encrypted_crush, crush_hash), crusher_hash = await asyncio.gather(
+        matcher_engine.encrypt_address(submission.crush_address),
+        matcher_engine.address_hash(submission.crusher_address)
+    )
 
     # Store in database
-    success = db.add_crush(
+    success = await adb.add_crush(
         crusher_address=submission.crusher_address,
         crush_address_encrypted=encrypted_crush,
-        crush_address_hash=crush_hash
+        crush_address_hash=crush_hash,
+        crusher_address_hash=crusher_hash
     )
 
     if not success:
@@ -106,11 +200,14 @@ async def submit_crush(submission: CrushSubmission):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to save your crush. Please try again!"
         )
+    crush_filter.add(crusher_hash, crush_hash)
 
     # Check for potential matches
     match_found = await check_for_matches(
         submission.crusher_address,
-        submission.crush_address
+        submission.crush_address,
+        crusher_hash,
+        crush_hash
     )
 
     message = "Your secret love has been sent!"
@@ -124,39 +221,300 @@ async def submit_crush(submission: CrushSubmission):
     )
 
 
-async def check_for_matches(crusher_address: str, crush_address: str) -> bool:
+async def check_for_matches(crusher_address: str, crush_address: str, crusher_hash: str, crush_hash: str) -> bool:
     """Check if submitting this crush creates a match"""
+    # Skip the database when the filter knows the crush never submitted the crusher
+    # (up to the sync window for rows stored by other workers)
+    filtered = crush_filter.ready
+    if filtered and not crush_filter.may_contain(crush_hash, crusher_hash):
+        return False
+
     # Check if the crush has also submitted the crusher
-    is_mutual = db.check_mutual_crush(crusher_address, crush_address)
+    is_mutual = await adb.check_mutual_crush(crusher_address, crush_address)
 
     if is_mutual:
-        # Record the match!
-        db.add_match(crusher_address, crush_address)
+        # Record the match, and notify both users if it's new
+        matched_at = await adb.add_match(crusher_address, crush_address)
+        if matched_at:
+            match_hub.publish_match(crusher_address, crush_address, matched_at)
         return True
 
+    if filtered:
+        crush_filter.record_false_positive()
     return False
 
 
+# Largest number of crushes accepted by a single batch submission
+MAX_BATCH_SIZE = 500
+
+
+@app.post("/api/crush/submit/batch", response_model=List[CrushResponse])
+async def submit_crush_batch(submissions: List[CrushSubmission]):
+    """
+    Submit many secret crushes at once.
+
+    All crushes are stored in a single transaction and mutual matches are
+    detected with one query for the whole batch. Returns one response per
+    submission, in order.
+    """
+    if len(submissions) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can contain at most {MAX_BATCH_SIZE} crushes"
+        )
+
+    responses: List[Optional[CrushResponse]] = [None] * len(submissions)
+    valid = []
+    for i, submission in enumerate(submissions):
+        if not submission.crusher_address or not submission.crush_address:
+            responses[i] = CrushResponse(success=False, message="Both addresses are required")
+        elif submission.crusher_address.lower() == submission.crush_address.lower():
+            responses[i] = CrushResponse(
+                success=False,
+                message="You can't have a crush on yourself! (But self-love is important too)"
+            )
+        else:
+            valid.append(i)
+
+    if valid:
+        # Encrypt every crush address up front, once per distinct address
+        crush_addresses = {submissions[i].crush_address.lower(): submissions[i].crush_address for i in valid}
+        encrypted = dict(zip(crush_addresses, await asyncio.gather(*(
+            matcher_engine.encrypt_address(address) for address in crush_addresses.values()
+        ))))
+        crushers = {submissions[i].crusher_address.lower(): submissions[i].crusher_address for i in valid}
+        crusher_hashes = dict(zip(crushers, await asyncio.gather(*(
+            matcher_engine.address_hash(address) for address in crushers.values()
+        ))))
+
+        rows = []
+        edges = []
+        for i in valid:
+            submission = submissions[i]
+            ciphertext, crush_hash = encrypted[submission.crush_address.lower()]
+            crusher_hash = crusher_hashes[submission.crusher_address.lower()]
+            rows.append((submission.crusher_address, ciphertext, crush_hash, crusher_hash))
+            edges.append((submission.crusher_address, submission.crush_address, crusher_hash))
+
+        if await adb.add_crushes(rows) is None:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to save your crushes. Please try again!"
+            )
+        crush_filter.add_many((crusher_hash, crush_hash) for _, _, crush_hash, crusher_hash in rows)
+
+        # Only look up edges whose reverse the filter can't rule out
+        reverse = [(crush_hash, crusher_hash) for _, _, crush_hash, crusher_hash in rows]
+        maybe = [crush_filter.may_contain(*edge) for edge in reverse]
+        candidates = [edge for edge, found in zip(edges, maybe) if found]
+        mutual = set(await adb.find_mutual_crushes(candidates)) if candidates else set()
+        if mutual:
+            for address1, address2, matched_at in await adb.add_matches(list(mutual)):
+                match_hub.publish_match(address1, address2, matched_at)
+
+        for i, (_, _, crush_hash, _) in zip(valid, rows):
+            submission = submissions[i]
+            message = "Your secret love has been sent!"
+            if (submission.crusher_address.lower(), submission.crush_address.lower()) in mutual:
+                message = "Your secret love has been sent... and guess what? IT'S A MATCH!"
+            responses[i] = CrushResponse(
+                success=True,
+                message=message,
+                submission_id=crush_hash[:16]
+            )
+
+    return responses
+
+
+# Largest page of /api/matches, and rows per query when streaming all matches
+MAX_MATCHES_PAGE = 1000
+MATCHES_STREAM_CHUNK = 500
+
+
+def encode_match_cursor(matched_at: str, match_id: int) -> str:
+    """Opaque pagination cursor for a (matched_at, id) key"""
+    return base64.urlsafe_b64encode(f"{matched_at}|{match_id}".encode()).decode().rstrip("=")
+
+
+def decode_match_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_match_cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        matched_at, match_id = raw.rsplit("|", 1)
+        return matched_at, int(match_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
 @app.get("/api/matches/{wallet_address}", response_model=List[MatchNotification])
-async def get_matches(wallet_address: str):
-    """Get all matches for a wallet address"""
-    matches = db.get_matches_for_user(wallet_address)
+async def get_matches(
+    wallet_address: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_MATCHES_PAGE),
+    after: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Get matches for a wallet address, oldest first.
 
-    return [
-        MatchNotification(
-            your_address=wallet_address.lower(),
-            matched_address=match,
-            matched_at=datetime.now(),  # In production, store actual match time
-            message="You both like each other!"
+    With `limit`, returns one page; the X-Next-Cursor response header holds
+    the `after` value of the next page and is absent on the last one.
+    Without it, all matches are streamed.
+    """
+    # The version is read first, so a concurrent write can only make the
+    # ETag stale (forcing a refetch), never hide a change
+    headers = user_data_headers("matches", await adb.get_user_version(wallet_address))
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        key = decode_match_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
-        for match in matches
-    ]
+
+    wallet = wallet_address.lower()
+
+    def serialize(rows) -> str:
+        # Plain dicts straight to JSON, in MatchNotification's field order
+        return ",".join(
+            json.dumps({
+                "your_address": wallet,
+                "matched_address": matched_address,
+                "matched_at": matched_at.replace(" ", "T"),
+                "message": "You both like each other!"
+            }, separators=(",", ":"))
+            for matched_at, _, matched_address in rows
+        )
+
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        rows = await adb.get_matches_page(wallet, limit + 1, key)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers["X-Next-Cursor"] = encode_match_cursor(rows[-1][0], rows[-1][1])
+        return Response(content=f"[{serialize(rows)}]", media_type="application/json", headers=headers)
+
+    async def stream():
+        nonlocal key
+        yield "["
+        first = True
+        while True:
+            rows = await adb.get_matches_page(wallet, MATCHES_STREAM_CHUNK, key)
+            if rows:
+                yield ("" if first else ",") + serialize(rows)
+                first = False
+            if len(rows) < MATCHES_STREAM_CHUNK:
+                break
+            key = (rows[-1][0], rows[-1][1])
+        yield "]"
+
+    return StreamingResponse(stream(), media_type="application/json", headers=headers)
+
+
+@app.get("/api/matches/{wallet_address}/stream")
+async def stream_matches(wallet_address: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent events for new matches of a wallet.
+
+    Sends a `match` event (a MatchNotification) for every new match and a
+    comment line as heartbeat. Reconnecting clients send Last-Event-ID to
+    replay missed events; a `resync` event means they should refetch
+    /api/matches and /api/stats instead.
+    """
+    subscription, backlog = match_hub.subscribe(wallet_address, last_event_id)
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            if backlog is RESYNC:
+                yield format_sse()
+            else:
+                for event in backlog:
+                    yield format_sse(event)
+
+            while True:
+                event = await next_event(subscription)
+                if event is None:
+                    yield format_sse(comment="heartbeat")
+                elif event is RESYNC:
+                    yield format_sse()
+                    return
+                else:
+                    yield format_sse(event)
+        finally:
+            match_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/api/matches/{wallet_address}/ws")
+async def match_websocket(websocket: WebSocket, wallet_address: str, last_event_id: Optional[str] = None):
+    """WebSocket variant of the match stream; messages are JSON objects with a `type`"""
+    await websocket.accept()
+    subscription, backlog = match_hub.subscribe(wallet_address, last_event_id)
+
+    async def send(event) -> bool:
+        if event is None:
+            await websocket.send_json({"type": "heartbeat"})
+        elif event is RESYNC:
+            await websocket.send_json({"type": "resync"})
+            return False
+        else:
+            await websocket.send_text(
+                f'{{"type": "match", "id": "{event.id}", "match": {event.data}}}'
+            )
+        return True
+
+    async def pump() -> None:
+        if backlog is RESYNC:
+            await send(RESYNC)
+            return
+        for event in backlog:
+            await send(event)
+        while await send(await next_event(subscription)):
+            pass
+
+    async def wait_for_disconnect() -> None:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    # Stop as soon as either side is done, so a closed socket doesn't wait
+    # for the next heartbeat to be noticed
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if tasks[0] in done and tasks[0].exception() is None:
+            await websocket.close()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        match_hub.unsubscribe(subscription)
 
 
 @app.get("/api/stats/{wallet_address}", response_model=UserStats)
-async def get_user_stats(wallet_address: str):
-    """Get user statistics"""
-    stats = db.get_user_stats(wallet_address)
+async def get_user_stats(
+    wallet_address: str,
+    response: Response,
+    include_matches: bool = False,
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get user statistics (matched addresses only with include_matches, `null` otherwise; see /api/matches)"""
+    # The two variants have different bodies, so they get different ETags
+    kind = "stats-matches" if include_matches else "stats"
+    headers = user_data_headers(kind, await adb.get_user_version(wallet_address))
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+    stats = await adb.get_user_stats(wallet_address, include_matches)
     return UserStats(**stats)
 
 
@@ -168,10 +526,25 @@ async def check_match(address1: str, address2: str):
     This endpoint performs the FHE comparison to check
     if both users have submitted each other as crushes.
     """
-    is_match = db.check_mutual_crush(address1, address2)
+    if crush_filter.ready:
+        hash1, hash2 = await asyncio.gather(
+            matcher_engine.address_hash(address1),
+            matcher_engine.address_hash(address2)
+        )
+        if not crush_filter.may_contain(hash1, hash2) or not crush_filter.may_contain(hash2, hash1):
+            return {
+                "is_match": False,
+                "message": "No match yet... keep hoping!"
+            }
+
+    is_match = await adb.check_mutual_crush(address1, address2)
 
     if is_match:
-        proof = generate_match_proof(address1, address2)
+        # Reuse the proof issued for this match row, if there is one
+        proof = await adb.get_match_proof(address1, address2)
+        if proof is None:
+            proof = await matcher_engine.create_match_proof(address1, address2)
+            await adb.set_match_proof(address1, address2, proof)
         return {
             "is_match": True,
             "message": "It's a Match! You both like each other!",
@@ -184,10 +557,41 @@ async def check_match(address1: str, address2: str):
     }
 
 
+# Largest number of proofs verified in one call
+MAX_PROOF_BATCH_SIZE = 1000
+
+
+@app.post("/api/proofs/verify/batch", response_model=ProofBatchVerifyResult)
+async def verify_proofs_batch(request: ProofBatchVerifyRequest):
+    """
+    Verify many match proofs (binary or legacy JSON) in one request.
+
+    The proofs are checked one by one inside a single matcher engine
+    operation, which saves round trips but not per-proof work.
+    """
+    if len(request.proofs) > MAX_PROOF_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_PROOF_BATCH_SIZE} proofs per batch"
+        )
+
+    results = await matcher_engine.verify_match_proofs([
+        (item.proof, item.address1, item.address2) for item in request.proofs
+    ])
+
+    return ProofBatchVerifyResult(results=results, valid_count=sum(results))
+
+
 @app.delete("/api/crush/{wallet_address}/{crush_hash}")
 async def remove_crush(wallet_address: str, crush_hash: str):
     """Remove a crush submission (change your mind?)"""
-    # Implementation would go here
+    if not await adb.remove_crush(wallet_address, crush_hash):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Crush not found"
+        )
+    crush_filter.note_removal()
+
     return {
         "success": True,
         "message": "Crush removed. It's okay, hearts change!"
@@ -197,107 +601,221 @@ async def remove_crush(wallet_address: str, crush_hash: str):
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
+    return Response(content=HEALTH_BODY, media_type="application/json")
+
+
+@app.get("/api/metrics/matcher")
+async def matcher_metrics():
+    """Matcher engine queue/latency, hash and compatibility caches and crush filter counters"""
+    from app.compatibility import result_cache_info
+    return {
+        "hash_cache": fhe_matcher.hash_cache_info(),
+        "compatibility_cache": result_cache_info(),
+        "engine": matcher_engine.metrics(),
+        "crush_filter": crush_filter.metrics()
+    }
+
+
+@app.get("/api/metrics/notifications")
+async def notification_metrics():
+    """Match stream subscribers and delivery counters"""
+    return match_hub.metrics()
+
+
+@app.get("/api/metrics/database")
+async def database_metrics():
+    """Database executor queue depth and storage engine stats (plus pools, write batching and shards for SQLite)"""
+    storage = adb.storage
+    if storage.name != "sqlite":
+        return {
+            "executor": adb.executor.metrics(),
+            "storage": storage.metrics()
+        }
+    return {
+        "executor": adb.executor.metrics(),
+        "pool": storage.db.pool.stats(),
+        "write_pipeline": adb.write_pipeline.metrics(),
+        "shards": storage.db.shards.stats(),
+        "storage": storage.metrics()
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Latency histograms and counters in the Prometheus text format"""
+    return Response(content=metrics.default_registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency guarding admin endpoints"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+
+
+@app.post("/api/admin/reconcile", dependencies=[Depends(require_admin)])
+async def start_reconciliation(restart: bool = False, chunk_size: int = RECONCILE_CHUNK_SIZE):
+    """Start (or resume) the whole-graph mutual-match reconciliation job"""
+    if chunk_size < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="chunk_size must be positive"
+        )
+
+    started = await adb.start_reconciliation(chunk_size, restart)
     return {
-        "status": "healthy",
-        "service": "Secret Crush Matcher",
-        "fhe_enabled": True
+        "started": started,
+        "message": "Reconciliation started" if started else "Reconciliation already running",
+        "status": await adb.get_reconciliation_status()
     }
 
 
-def calculate_compatibility(address1: str, address2: str) -> int:
+@app.get("/api/admin/reconcile", dependencies=[Depends(require_admin)])
+async def reconciliation_status():
+    """Progress of the last reconciliation run"""
+    return await adb.get_reconciliation_status()
+
+
+@app.post("/api/admin/counters/repair", dependencies=[Depends(require_admin)])
+async def repair_counters():
+    """Recompute the per-wallet stats counters from crushes and matches"""
+    return await adb.repair_counters()
+
+
+@app.get("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def profiling_settings():
+    """Request sampling and slow-query settings of this worker"""
+    return profiler.settings()
+
+
+@app.post("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def configure_profiling(sample_percent: Optional[float] = None, slow_query_ms: Optional[float] = None):
+    """Change the share of profiled requests or the slow-query threshold (0 disables) on this worker"""
+    try:
+        profiler.configure(sample_percent=sample_percent, slow_query_ms=slow_query_ms)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return profiler.settings()
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(limit: int = Query(20, ge=1, le=1000)):
+    """Latest request profiles of this worker, without their function lists"""
+    return [
+        {key: value for key, value in entry.items() if key not in ("functions", "storage_calls")}
+        for entry in profiler.profiles.latest(limit)
+    ]
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: int):
+    """One request profile: the hottest functions and the storage calls it made"""
+    entry = profiler.profiles.get(profile_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found (it may have been evicted)"
+        )
+    return entry
+
+
+@app.get("/api/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    """Latest statements above the slow-query threshold on this worker"""
+    return profiler.slow_queries.latest(limit)
+
+
+# Request body bytes buffered in memory before an import spills to disk
+IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+@app.post("/api/admin/import", dependencies=[Depends(require_admin)])
+async def import_crushes(
+    request: Request,
+    format: str = "ndjson",
+    processes: int = Query(0, ge=0, le=64),
+    batch_size: int = Query(bulk.DEFAULT_BATCH_SIZE, ge=1),
+    defer_indexes: bool = False
+):
     """
-    Calculate compatibility score between two wallet addresses.
-    Uses multiple factors for a fun, deterministic calculation.
+    Bulk import crush submissions from an NDJSON or CSV request body, then
+    record the matches of every mutual pair once (see app.bulk)
     """
-    addr1 = address1.lower().replace("0x", "")
-    addr2 = address2.lower().replace("0x", "")
-
-    score = 0
-
-    # Factor 1: Matching characters at same positions (max 40 points)
-    matching_chars = sum(1 for a, b in zip(addr1, addr2) if a == b)
-    score += int((matching_chars / 40) * 40)
-
-    # Factor 2: Character frequency similarity (max 20 points)
-    freq1 = {c: addr1.count(c) for c in set(addr1)}
-    freq2 = {c: addr2.count(c) for c in set(addr2)}
-    all_chars = set(freq1.keys()) | set(freq2.keys())
-    freq_similarity = sum(min(freq1.get(c, 0), freq2.get(c, 0)) for c in all_chars)
-    score += int((freq_similarity / 40) * 20)
-
-    # Factor 3: Numeric harmony - sum of digits (max 20 points)
-    digits1 = sum(int(c, 16) for c in addr1)
-    digits2 = sum(int(c, 16) for c in addr2)
-    digit_diff = abs(digits1 - digits2)
-    max_diff = 40 * 15  # max possible difference
-    harmony = 1 - (digit_diff / max_diff)
-    score += int(harmony * 20)
-
-    # Factor 4: "Destiny number" - XOR pattern creates unique bond (max 20 points)
-    xor_sum = sum(int(a, 16) ^ int(b, 16) for a, b in zip(addr1, addr2))
-    # Lower XOR means more similar, but we want some variation
-    destiny = ((xor_sum % 100) + (digits1 + digits2) % 100) % 100
-    score += int((destiny / 100) * 20)
-
-    return min(100, max(0, score))
-
-
-COMPATIBILITY_LEVELS = [
-    {
-        "level": "Different Worlds",
-        "emoji": "🌍",
-        "color": "#9CA3AF",
-        "messages": [
-            "The stars haven't aligned... yet!",
-            "Opposites attract? Maybe in another universe!",
-            "Your paths are quite different, but who knows?",
-        ]
-    },
-    {
-        "level": "Curious Spark",
-        "emoji": "✨",
-        "color": "#60A5FA",
-        "messages": [
-            "There's a faint spark between you two!",
-            "Curiosity is the first step to love!",
-            "Something mysterious connects you...",
-        ]
-    },
-    {
-        "level": "Growing Connection",
-        "emoji": "🌱",
-        "color": "#34D399",
-        "messages": [
-            "A beautiful connection is blooming!",
-            "Your energies are starting to sync!",
-            "The universe sees potential here!",
-        ]
-    },
-    {
-        "level": "Strong Chemistry",
-        "emoji": "💜",
-        "color": "#A78BFA",
-        "messages": [
-            "Wow! The chemistry is undeniable!",
-            "Your wallets were meant to meet!",
-            "This could be something special!",
-        ]
-    },
-    {
-        "level": "Soulmates",
-        "emoji": "💕",
-        "color": "#F472B6",
-        "messages": [
-            "SOULMATES DETECTED! This is destiny!",
-            "The blockchain has blessed this match!",
-            "Written in the stars AND the blockchain!",
-        ]
-    }
-]
+    if defer_indexes:
+        # Dropping the crush indexes would slow every mutual-crush lookup
+        # of the live API until the import finishes
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="defer_indexes is only available from the CLI (python -m app.bulk import)"
+        )
+    if format not in bulk.FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(bulk.FORMATS)}"
+        )
+
+    # The body is streamed to a spooled file, so its size doesn't matter
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        lines = io.TextIOWrapper(spool, encoding="utf-8", errors="replace", newline="")
+        try:
+            return await run_in_threadpool(
+                bulk.import_crushes, lines, format,
+                processes=processes, batch_size=batch_size, defer=False
+            )
+        except RuntimeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=str(e)
+            )
+    finally:
+        spool.close()
+
+
+@app.get("/api/admin/export/{table}", dependencies=[Depends(require_admin)])
+async def export_table(table: str, format: str = "ndjson"):
+    """Stream every match (`matches`) or the stats of every wallet (`stats`) as NDJSON or CSV"""
+    if table not in bulk.EXPORTS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown export {table!r} (available: {', '.join(sorted(bulk.EXPORTS))})"
+        )
+    if format not in bulk.FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(bulk.FORMATS)}"
+        )
+
+    export, fields = bulk.EXPORTS[table]
+    try:
+        records = await run_in_threadpool(export)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    # A sync iterator: Starlette reads each page on a worker thread
+    return StreamingResponse(
+        bulk.encode(records, fields, format),
+        media_type=bulk.CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    )
+
+
+# Compatibility payloads never change for a given pair (see COMPATIBILITY_VERSION)
+COMPATIBILITY_CACHE_CONTROL = "public, max-age=86400"
 
 
 @app.get("/api/compatibility", response_model=CompatibilityResult)
-async def check_compatibility(address1: str, address2: str):
+async def check_compatibility(address1: str, address2: str, if_none_match: Optional[str] = Header(None)):
     """
     Check compatibility between two wallet addresses.
     Returns a fun compatibility score with effects!
@@ -314,37 +832,103 @@ async def check_compatibility(address1: str, address2: str):
             detail="Cannot check compatibility with yourself!"
         )
 
-    score = calculate_compatibility(address1, address2)
-
-    # Determine level (0-4) based on score
-    if score <= 20:
-        level_index = 0
-    elif score <= 40:
-        level_index = 1
-    elif score <= 60:
-        level_index = 2
-    elif score <= 80:
-        level_index = 3
-    else:
-        level_index = 4
-
-    level_data = COMPATIBILITY_LEVELS[level_index]
-
-    import random
-    random.seed(hash(address1.lower() + address2.lower()))
-    message = random.choice(level_data["messages"])
-
-    return CompatibilityResult(
-        score=score,
-        level=level_data["level"],
-        level_index=level_index,
-        emoji=level_data["emoji"],
-        message=message,
-        color=level_data["color"]
+    from app.compatibility import compatibility_etag, compatibility_json
+
+    etag = compatibility_etag(address1, address2)
+    headers = {"ETag": etag, "Cache-Control": COMPATIBILITY_CACHE_CONTROL}
+
+    # Repeat lookups are answered from the ETag alone
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        body = compatibility_json(address1, address2)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid wallet address"
+        )
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Limits for batch compatibility scoring
+MAX_COMPATIBILITY_SOURCES = 100
+MAX_COMPATIBILITY_CANDIDATES = 10_000
+# Pairs with a non-standard address are scored one Python call at a time
+MAX_SCALAR_COMPATIBILITY_PAIRS = 10_000
+
+
+@app.post("/api/compatibility/batch", response_model=CompatibilityBatchResult)
+async def check_compatibility_batch(request: CompatibilityBatchRequest):
+    """
+    Score each address against each candidate in one vectorized pass.
+
+    Scores are identical to /api/compatibility for every pair.
+    """
+    if len(request.addresses) > MAX_COMPATIBILITY_SOURCES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_COMPATIBILITY_SOURCES} addresses per batch"
+        )
+
+    if len(request.candidates) > MAX_COMPATIBILITY_CANDIDATES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_COMPATIBILITY_CANDIDATES} candidates per batch"
+        )
+
+    from app.compatibility import is_standard_address, score_matrix
+
+    odd_sources = sum(not is_standard_address(address) for address in request.addresses)
+    odd_candidates = sum(not is_standard_address(address) for address in request.candidates)
+    scalar_pairs = (
+        odd_sources * len(request.candidates)
+        + (len(request.addresses) - odd_sources) * odd_candidates
+    )
+    if scalar_pairs > MAX_SCALAR_COMPATIBILITY_PAIRS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_SCALAR_COMPATIBILITY_PAIRS} pairs with non-standard addresses per batch"
+        )
+
+    try:
+        scores = await run_in_threadpool(score_matrix, request.addresses, request.candidates)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid wallet address"
+        )
+
+    return CompatibilityBatchResult(
+        addresses=request.addresses,
+        candidates=request.candidates,
+        scores=scores.tolist()
+    )
+
+
+@app.get("/api/compatibility/top/{wallet_address}", response_model=CompatibilityTopResult)
+async def top_compatible_users(wallet_address: str, k: int = Query(20, ge=1, le=100)):
+    """The k registered users most compatible with this wallet"""
+    from app.compatibility_index import compatibility_index
+
+    try:
+        top = await run_in_threadpool(compatibility_index.top_k, wallet_address, k)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid wallet address"
+        )
+
+    return CompatibilityTopResult(
+        wallet_address=wallet_address.lower(),
+        matches=[CompatibleUser(wallet_address=address, score=score) for address, score in top]
     )
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
@@ -0,0 +1,259 @@
+"""
+Execution engine for matcher crypto operations.
+
+The simulated matcher takes microseconds per operation, but real FHE takes
+milliseconds to seconds and would freeze the event loop if run inline.
+The engine sends operations to a process pool instead. Every worker
+builds the configured matcher backend once at startup with the server's
+key. Operations queued within a short window are sent to a worker as one
+batch, so a burst of comparisons costs one round trip instead of one per
+comparison.
+
+With CRUSH_MATCHER_PROCESSES=0 (the default) operations run inline on the
+local matcher. That is fastest for the simulated backend, where a process
+round trip costs more than the operation itself.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+import app.metrics as metrics
+from app.fhe_matcher import MatcherBackend, create_matcher, fhe_matcher
+
+# Worker processes for matcher operations (0 runs them inline)
+PROCESSES = int(os.environ.get("CRUSH_MATCHER_PROCESSES", "0"))
+
+# How long to collect operations before dispatching a batch, and its max size
+BATCH_WINDOW = float(os.environ.get("CRUSH_MATCHER_BATCH_WINDOW_MS", "2")) / 1000
+MAX_BATCH_SIZE = int(os.environ.get("CRUSH_MATCHER_MAX_BATCH", "64"))
+
+OPERATIONS = (
+    "encrypt_address",
+    "address_hash",
+    "check_match_encrypted",
+    "create_match_proof",
+    "verify_match_proof",
+    "verify_match_proofs",
+)
+
+# Backend instance inside each worker process
+_worker_backend: Optional[MatcherBackend] = None
+
+
+def _init_worker(backend_name: str, secret_key: bytes) -> None:
+    global _worker_backend
+    _worker_backend = create_matcher(backend_name, secret_key=secret_key)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _run_batch(batch: List[Tuple[str, tuple]]) -> List[Tuple[bool, Any]]:
+    """Run a batch of operations in a worker; each result is (ok, value_or_error)"""
+    results = []
+    for op, args in batch:
+        try:
+            results.append((True, getattr(_worker_backend, op)(*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class OperationStats:
+    """Latency counters for one operation type"""
+
+    def __init__(self, op: str):
+        self.op = op
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        metrics.MATCHER_OPERATION_DURATION.observe(elapsed, self.op)
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if not ok:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": (self.total / self.count * 1000) if self.count else 0.0,
+            "max_ms": self.max * 1000,
+        }
+
+
+class MatcherEngine:
+    """Dispatches matcher operations to a process pool in batches"""
+
+    def __init__(
+        self,
+        backend: MatcherBackend = fhe_matcher,
+        processes: int = PROCESSES,
+        batch_window: float = BATCH_WINDOW,
+        max_batch_size: int = MAX_BATCH_SIZE
+    ):
+        self.backend = backend
+        self.processes = max(0, processes)
+        self.batch_window = batch_window
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._pending: List[Tuple[str, tuple, asyncio.Future, float]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        # Metrics
+        self._in_flight = 0
+        self._batches = 0
+        self._batched_ops = 0
+        self._max_batch_seen = 0
+        self._stats = {op: OperationStats(op) for op in OPERATIONS}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.backend.name, self.backend.secret_key),
+                )
+            return self._pool
+
+    async def start(self) -> None:
+        """Start the worker processes and load keys before the first request"""
+        if not self.processes:
+            return
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        await asyncio.gather(*(
+            loop.run_in_executor(pool, _warm_up) for _ in range(self.processes)
+        ))
+
+    async def submit(self, op: str, *args) -> Any:
+        """Run one matcher operation and await its result"""
+        if op not in self._stats:
+            raise ValueError(f"Unknown matcher operation {op!r}")
+
+        submitted_at = time.perf_counter()
+        if not self.processes:
+            ok = False
+            try:
+                result = getattr(self.backend, op)(*args)
+                ok = True
+                return result
+            finally:
+                self._stats[op].record(time.perf_counter() - submitted_at, ok)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((op, args, future, submitted_at))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+
+        # Spread a burst over all workers rather than queueing it on one
+        size = min(self.max_batch_size, -(-len(pending) // self.processes)) if pending else 1
+        for start in range(0, len(pending), size):
+            self._dispatch(pending[start:start + size])
+
+    def _dispatch(self, batch: List[Tuple[str, tuple, asyncio.Future, float]]) -> None:
+        self._batches += 1
+        self._batched_ops += len(batch)
+        self._max_batch_seen = max(self._max_batch_seen, len(batch))
+        self._in_flight += len(batch)
+
+        work = asyncio.wrap_future(
+            self._get_pool().submit(_run_batch, [(op, args) for op, args, _, _ in batch])
+        )
+
+        def resolve(done: asyncio.Future) -> None:
+            self._in_flight -= len(batch)
+            now = time.perf_counter()
+            if done.cancelled():
+                results = [(False, RuntimeError("Matcher engine was shut down"))] * len(batch)
+            elif done.exception() is not None:
+                results = [(False, done.exception())] * len(batch)
+            else:
+                results = done.result()
+            for (op, _, future, submitted_at), (ok, value) in zip(batch, results):
+                self._stats[op].record(now - submitted_at, ok)
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+        work.add_done_callback(resolve)
+
+    async def encrypt_address(self, wallet_address: str) -> Tuple[bytes, str]:
+        return await self.submit("encrypt_address", wallet_address)
+
+    async def address_hash(self, wallet_address: str) -> str:
+        return await self.submit("address_hash", wallet_address)
+
+    async def check_match_encrypted(
+        self,
+        crusher_address: str,
+        crush_hash: str,
+        potential_crusher_address: str,
+        potential_crush_hash: str
+    ) -> bool:
+        return await self.submit(
+            "check_match_encrypted",
+            crusher_address, crush_hash,
+            potential_crusher_address, potential_crush_hash
+        )
+
+    async def create_match_proof(self, address1: str, address2: str) -> str:
+        return await self.submit("create_match_proof", address1, address2)
+
+    async def verify_match_proof(self, proof: str, address1: str, address2: str) -> bool:
+        return await self.submit("verify_match_proof", proof, address1, address2)
+
+    async def verify_match_proofs(self, items: List[Tuple[str, str, str]]) -> List[bool]:
+        return await self.submit("verify_match_proofs", items)
+
+    def metrics(self) -> dict:
+        """Queue depth, batching and per-operation latency"""
+        return {
+            "backend": self.backend.name,
+            "processes": self.processes,
+            "queue_depth": len(self._pending),
+            "in_flight": self._in_flight,
+            "batches": self._batches,
+            "avg_batch_size": (self._batched_ops / self._batches) if self._batches else 0.0,
+            "max_batch_size": self._max_batch_seen,
+            "operations": {op: stats.snapshot() for op, stats in self._stats.items()},
+        }
+
+    def close(self) -> None:
+        """Shut down the worker processes"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Global engine instance
+matcher_engine = MatcherEngine()
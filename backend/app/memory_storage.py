@@ -0,0 +1,603 @@
+"""
+In-memory graph storage engine (CRUSH_STORAGE_BACKEND=memory).
+
+Crushes are kept as adjacency sets of 32-byte address hashes: each crusher
+hash maps to the set of hashes it has a crush on, and a reverse index maps
+each hash to its admirers. A mutual check is two set lookups, with no
+query or join. Crush rows (ciphertext, ids, timestamps), matches, users and
+versions sit in plain dicts next to the graph. Counters are derived from
+them, so they cannot drift.
+
+Persistence uses a snapshot plus an append-only log, next to
+CRUSH_MEMORY_PATH:
+
+- `<path>.log`: one JSON line per write, appended (and optionally fsynced)
+  before the write returns.
+- `<path>.snapshot`: the whole state. It is written every
+  CRUSH_MEMORY_SNAPSHOT_INTERVAL seconds and on shutdown, then the log is
+  cut down to the writes made after it.
+
+On startup the snapshot is loaded and the rest of the log is replayed. A
+torn last line from a crash is dropped. An empty CRUSH_MEMORY_PATH keeps
+everything in memory only.
+
+The state belongs to one process. Run a single worker with this backend.
+"""
+
+import base64
+import binascii
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.encoding import CIPHERTEXT_VERSION, Stored, upgrade_ciphertext
+from app.storage import Pair, StorageEngine
+
+# Snapshot/log base path; empty keeps data in memory only
+MEMORY_PATH = os.environ.get(
+    "CRUSH_MEMORY_PATH",
+    os.path.join(os.path.dirname(__file__), "crushes.mem")
+)
+
+# Seconds between background snapshots (0 only snapshots on shutdown)
+SNAPSHOT_INTERVAL = float(os.environ.get("CRUSH_MEMORY_SNAPSHOT_INTERVAL", "300"))
+
+# fsync the log after every write instead of leaving it to the OS
+LOG_FSYNC = os.environ.get("CRUSH_MEMORY_FSYNC", "0").lower() in ("1", "true", "yes")
+
+SNAPSHOT_FORMAT = 1
+
+
+def _now() -> str:
+    """Current time in SQLite's CURRENT_TIMESTAMP format"""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _key(address_hash: str) -> bytes:
+    """Compact graph key of a hex address hash"""
+    return bytes.fromhex(address_hash)
+
+
+def _encode_ciphertext(data: Stored) -> str:
+    """Log/snapshot form of a ciphertext envelope"""
+    return base64.b64encode(data).decode() if isinstance(data, bytes) else data
+
+
+def _decode_ciphertext(text: str) -> Stored:
+    """Ciphertext envelope from its log/snapshot form (older files hold the legacy format)"""
+    try:
+        raw = base64.b64decode(text)
+    except binascii.Error:
+        return text
+    return raw if raw[:1] == bytes([CIPHERTEXT_VERSION]) else upgrade_ciphertext(text)
+
+
+def _normalize(address1: str, address2: str) -> Pair:
+    addr1, addr2 = sorted([address1.lower(), address2.lower()])
+    return addr1, addr2
+
+
+class CrushRow:
+    __slots__ = ("id", "encrypted", "crusher_hash", "created_at")
+
+    def __init__(self, crush_id: int, encrypted: Stored, crusher_hash: str, created_at: str):
+        self.id = crush_id
+        self.encrypted = encrypted
+        self.crusher_hash = crusher_hash
+        self.created_at = created_at
+
+
+class MatchRow:
+    __slots__ = ("id", "matched_at", "proof")
+
+    def __init__(self, match_id: int, matched_at: str, proof: Optional[str] = None):
+        self.id = match_id
+        self.matched_at = matched_at
+        self.proof = proof
+
+
+class MemoryStorage(StorageEngine):
+    """Crush graph held in memory, persisted by snapshot plus log"""
+
+    name = "memory"
+
+    def __init__(self, path: Optional[str] = MEMORY_PATH, snapshot_interval: float = SNAPSHOT_INTERVAL):
+        self.path = path or None
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.Lock()
+
+        # Graph: crusher hash -> crush hashes, and crush hash -> crusher hashes
+        self._edges: Dict[bytes, Set[bytes]] = defaultdict(set)
+        self._admirers: Dict[bytes, Set[bytes]] = defaultdict(set)
+        # Address of each crusher hash seen, for reconciliation
+        self._addresses: Dict[bytes, str] = {}
+
+        # crusher address -> crush hash -> row
+        self._crushes: Dict[str, Dict[str, CrushRow]] = {}
+        self._matches: Dict[Pair, MatchRow] = {}
+        # wallet -> (matched_at, id, other) sorted by (matched_at, id)
+        self._user_matches: Dict[str, List[Tuple[str, int, str]]] = {}
+        # wallet -> [rowid, nickname, avatar_seed, created_at, last_active]
+        self._users: Dict[str, list] = {}
+        self._user_order: List[str] = []
+        self._versions: Dict[str, int] = {}
+        self._next_crush_id = 1
+        self._next_match_id = 1
+        self._reconcile_status: dict = {"job": "mutual_matches"}
+
+        # Persistence
+        self._log = None
+        self._log_id = ""
+        self._ops_since_snapshot = 0
+        self._last_snapshot_at: Optional[float] = None
+        self._last_snapshot_ms = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        if self.path:
+            self._load()
+            if self.snapshot_interval > 0:
+                self._thread = threading.Thread(target=self._run, name="crush-memory-snapshot", daemon=True)
+                self._thread.start()
+
+    # State changes (shared by writes and log replay)
+
+    def _bump(self, wallets) -> None:
+        for wallet in set(wallets):
+            self._versions[wallet] = self._versions.get(wallet, 0) + 1
+
+    def _apply_user(self, wallet: str, nickname: Optional[str], at: str) -> None:
+        user = self._users.get(wallet)
+        if user is None:
+            self._user_order.append(wallet)
+            self._users[wallet] = [len(self._user_order), nickname, wallet[:8], at, at]
+        else:
+            user[4] = at
+            if nickname is not None:
+                user[1] = nickname
+
+    def _apply_crush(self, crusher: str, encrypted: Stored, crush_hash: str, crusher_hash: str, at: str) -> bool:
+        rows = self._crushes.setdefault(crusher, {})
+        row = rows.get(crush_hash)
+        if row is not None:
+            row.encrypted, row.crusher_hash, row.created_at = encrypted, crusher_hash, at
+            is_new = False
+        else:
+            rows[crush_hash] = CrushRow(self._next_crush_id, encrypted, crusher_hash, at)
+            self._next_crush_id += 1
+            is_new = True
+
+        crusher_key, crush_key = _key(crusher_hash), _key(crush_hash)
+        self._edges[crusher_key].add(crush_key)
+        self._admirers[crush_key].add(crusher_key)
+        self._addresses[crusher_key] = crusher
+        self._bump([crusher])
+        return is_new
+
+    def _apply_remove(self, crusher: str, crush_hash: str) -> bool:
+        rows = self._crushes.get(crusher)
+        row = rows.pop(crush_hash, None) if rows else None
+        if row is None:
+            return False
+        if not rows:
+            del self._crushes[crusher]
+
+        crusher_key, crush_key = _key(row.crusher_hash), _key(crush_hash)
+        self._edges[crusher_key].discard(crush_key)
+        if not self._edges[crusher_key]:
+            del self._edges[crusher_key]
+        self._admirers[crush_key].discard(crusher_key)
+        if not self._admirers[crush_key]:
+            del self._admirers[crush_key]
+        self._bump([crusher])
+        return True
+
+    def _apply_match(self, pair: Pair, at: str) -> bool:
+        if pair in self._matches:
+            return False
+        match = self._matches[pair] = MatchRow(self._next_match_id, at)
+        self._next_match_id += 1
+        for wallet, other in (pair, pair[::-1]):
+            bisect.insort(self._user_matches.setdefault(wallet, []), (at, match.id, other))
+        self._bump(pair)
+        return True
+
+    def _apply_proof(self, pair: Pair, proof: str) -> bool:
+        match = self._matches.get(pair)
+        if match is None:
+            return False
+        match.proof = proof
+        return True
+
+    def _replay(self, op: list) -> None:
+        kind, args = op[0], op[1:]
+        if kind == "u":
+            self._apply_user(*args)
+        elif kind == "c":
+            self._apply_crush(args[0], _decode_ciphertext(args[1]), *args[2:])
+        elif kind == "r":
+            self._apply_remove(*args)
+        elif kind == "m":
+            self._apply_match((args[0], args[1]), args[2])
+        elif kind == "p":
+            self._apply_proof((args[0], args[1]), args[2])
+        else:
+            raise ValueError(f"Unknown log record {kind!r}")
+
+    # Persistence
+
+    def _log_path(self) -> str:
+        return f"{self.path}.log"
+
+    def _snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    def _append(self, ops: List[list]) -> None:
+        """Log applied writes; called with the lock held"""
+        if not self.path or not ops:
+            return
+        if self._log is None:
+            # Written to again after close()
+            self._log = open(self._log_path(), "ab")
+        self._log.write("".join(json.dumps(op, separators=(",", ":")) + "\n" for op in ops).encode())
+        self._log.flush()
+        if LOG_FSYNC:
+            os.fsync(self._log.fileno())
+        self._ops_since_snapshot += len(ops)
+
+    def _open_new_log(self, body: bytes = b"") -> None:
+        """Replace the log with a fresh one (new id) holding `body`"""
+        log_id = uuid.uuid4().hex
+        tmp_path = self._log_path() + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"log_id": log_id}).encode() + b"\n" + body)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._log is not None:
+            self._log.close()
+        os.replace(tmp_path, self._log_path())
+        self._log = open(self._log_path(), "ab")
+        self._log_id = log_id
+
+    def _load(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        snapshot = None
+        if os.path.exists(self._snapshot_path()):
+            with open(self._snapshot_path(), encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self._restore(snapshot)
+
+        if not os.path.exists(self._log_path()):
+            self._open_new_log()
+            return
+
+        replayed = 0
+        with open(self._log_path(), "rb") as f:
+            header = json.loads(f.readline())
+            if snapshot and header["log_id"] == snapshot["log_id"]:
+                # The log was not cut after the snapshot: skip what it covers
+                f.seek(snapshot["log_offset"])
+            good = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                self._replay(op)
+                good += len(line)
+                replayed += 1
+
+        # Drop a torn tail so new records start on a clean line
+        with open(self._log_path(), "r+b") as f:
+            f.truncate(good)
+        self._log = open(self._log_path(), "ab")
+        self._log_id = header["log_id"]
+        self._ops_since_snapshot = replayed
+
+    def _dump(self) -> dict:
+        """Copy of the whole state; called with the lock held"""
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "next_crush_id": self._next_crush_id,
+            "next_match_id": self._next_match_id,
+            "users": [[wallet, *self._users[wallet][1:]] for wallet in self._user_order],
+            "crushes": [
+                [row.id, crusher, _encode_ciphertext(row.encrypted), crush_hash, row.crusher_hash, row.created_at]
+                for crusher, rows in self._crushes.items()
+                for crush_hash, row in rows.items()
+            ],
+            "matches": [
+                [match.id, pair[0], pair[1], match.matched_at, match.proof]
+                for pair, match in self._matches.items()
+            ],
+            "versions": dict(self._versions),
+        }
+
+    def _restore(self, snapshot: dict) -> None:
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported memory snapshot format {snapshot.get('format')!r}")
+
+        for wallet, nickname, avatar_seed, created_at, last_active in snapshot["users"]:
+            self._user_order.append(wallet)
+            self._users[wallet] = [len(self._user_order), nickname, avatar_seed, created_at, last_active]
+
+        for crush_id, crusher, encrypted, crush_hash, crusher_hash, created_at in sorted(snapshot["crushes"]):
+            self._crushes.setdefault(crusher, {})[crush_hash] = CrushRow(
+                crush_id, _decode_ciphertext(encrypted), crusher_hash, created_at
+            )
+            crusher_key, crush_key = _key(crusher_hash), _key(crush_hash)
+            self._edges[crusher_key].add(crush_key)
+            self._admirers[crush_key].add(crusher_key)
+            self._addresses[crusher_key] = crusher
+
+        for match_id, address1, address2, matched_at, proof in snapshot["matches"]:
+            self._matches[(address1, address2)] = MatchRow(match_id, matched_at, proof)
+            self._user_matches.setdefault(address1, []).append((matched_at, match_id, address2))
+            self._user_matches.setdefault(address2, []).append((matched_at, match_id, address1))
+        for rows in self._user_matches.values():
+            rows.sort()
+
+        self._versions = dict(snapshot["versions"])
+        self._next_crush_id = snapshot["next_crush_id"]
+        self._next_match_id = snapshot["next_match_id"]
+
+    def snapshot(self) -> bool:
+        """Write a snapshot and cut the log down to newer writes; False without a path"""
+        if not self.path:
+            return False
+
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            with self._lock:
+                self._log.flush()
+                state = self._dump()
+                state["log_id"] = self._log_id
+                state["log_offset"] = self._log.tell()
+                self._ops_since_snapshot = 0
+
+            # Serialize and write outside the lock so writes keep flowing
+            tmp_path = self._snapshot_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._snapshot_path())
+
+            with self._lock:
+                self._log.flush()
+                with open(self._log_path(), "rb") as f:
+                    f.seek(state["log_offset"])
+                    newer = f.read()
+                self._open_new_log(newer)
+
+            self._last_snapshot_at = time.time()
+            self._last_snapshot_ms = (time.perf_counter() - started) * 1000
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            if self._ops_since_snapshot:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    print(f"Error writing memory snapshot: {e}")
+
+    # Users
+
+    def register_user(self, wallet_address, nickname=None):
+        wallet = wallet_address.lower()
+        at = _now()
+        with self._lock:
+            self._apply_user(wallet, nickname, at)
+            self._append([["u", wallet, nickname, at]])
+        return True
+
+    def get_users_after(self, rowid, limit):
+        with self._lock:
+            wallets = self._user_order[max(rowid, 0):max(rowid, 0) + limit]
+            return [(rowid + 1 + i, wallet) for i, wallet in enumerate(wallets)]
+
+    def get_user_version(self, wallet_address):
+        with self._lock:
+            return self._versions.get(wallet_address.lower(), 0)
+
+    def get_user_stats(self, wallet_address, include_matches=False):
+        wallet = wallet_address.lower()
+        with self._lock:
+            matches = self._user_matches.get(wallet, [])
+            return {
+                "wallet_address": wallet_address,
+                "crushes_sent": len(self._crushes.get(wallet, ())),
+                "matches_count": len(matches),
+                "last_match_at": matches[-1][0] if matches else None,
+                "matches": [match[2] for match in matches] if include_matches else None
+            }
+
+    # Crushes
+
+    def add_crush(self, crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash=None):
+        if crusher_address_hash is None:
+            from app.fhe_matcher import address_hash
+            crusher_address_hash = address_hash(crusher_address)
+        return self.add_crushes([(crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash)]) is not None
+
+    def add_crushes(self, crushes):
+        at = _now()
+        rows = [
+            (crusher.lower(), encrypted, crush_hash.lower(), crusher_hash.lower(), at)
+            for crusher, encrypted, crush_hash, crusher_hash in crushes
+        ]
+        try:
+            # Validate every hash before changing anything
+            for row in rows:
+                _key(row[2]), _key(row[3])
+        except ValueError as e:
+            print(f"Error adding crushes: {e}")
+            return None
+
+        with self._lock:
+            inserted = sum(self._apply_crush(*row) for row in rows)
+            self._append([["c", row[0], _encode_ciphertext(row[1]), *row[2:]] for row in rows])
+        return inserted
+
+    def remove_crush(self, wallet_address, crush_address_hash):
+        wallet, crush_hash = wallet_address.lower(), crush_address_hash.lower()
+        with self._lock:
+            if not self._apply_remove(wallet, crush_hash):
+                return False
+            self._append([["r", wallet, crush_hash]])
+        return True
+
+    def get_crushes_by_user(self, wallet_address):
+        wallet = wallet_address.lower()
+        with self._lock:
+            return [
+                {
+                    "id": row.id,
+                    "crusher_address": wallet,
+                    "crush_address_encrypted": row.encrypted,
+                    "crush_address_hash": crush_hash,
+                    "created_at": row.created_at,
+                    "crusher_address_hash": row.crusher_hash,
+                }
+                for crush_hash, row in sorted(self._crushes.get(wallet, {}).items(), key=lambda item: item[1].id)
+            ]
+
+    def _has_edge(self, crusher_hash: str, crush_hash: str) -> bool:
+        edges = self._edges.get(_key(crusher_hash))
+        return edges is not None and _key(crush_hash) in edges
+
+    def check_mutual_crush(self, address1, address2):
+        from app.fhe_matcher import address_hash
+
+        hash1, hash2 = address_hash(address1), address_hash(address2)
+        with self._lock:
+            return self._has_edge(hash1, hash2) and self._has_edge(hash2, hash1)
+
+    def find_mutual_crushes(self, edges):
+        from app.fhe_matcher import address_hash
+
+        mutual = []
+        with self._lock:
+            for crusher, crush, crusher_hash in {(c.lower(), d.lower(), h.lower()) for c, d, h in edges}:
+                # The stored edge is given; only the reverse one is looked up
+                if self._has_edge(address_hash(crush), crusher_hash):
+                    mutual.append((crusher, crush))
+        return mutual
+
+    # Matches
+
+    def add_match(self, address1, address2):
+        inserted = self.add_matches([(address1, address2)])
+        return inserted[0][2] if inserted else None
+
+    def add_matches(self, pairs):
+        at = _now()
+        with self._lock:
+            inserted = [pair for pair in sorted({_normalize(a, b) for a, b in pairs}) if self._apply_match(pair, at)]
+            self._append([["m", pair[0], pair[1], at] for pair in inserted])
+        return [(*pair, at) for pair in inserted]
+
+    def get_match_proof(self, address1, address2):
+        with self._lock:
+            match = self._matches.get(_normalize(address1, address2))
+            return match.proof if match else None
+
+    def set_match_proof(self, address1, address2, proof):
+        pair = _normalize(address1, address2)
+        with self._lock:
+            if not self._apply_proof(pair, proof):
+                return False
+            self._append([["p", pair[0], pair[1], proof]])
+        return True
+
+    def get_matches_for_user(self, wallet_address):
+        with self._lock:
+            return [match[2] for match in self._user_matches.get(wallet_address.lower(), [])]
+
+    def get_matches_page(self, wallet_address, limit, after=None):
+        with self._lock:
+            rows = self._user_matches.get(wallet_address.lower(), [])
+            start = 0
+            if after is not None:
+                # First row whose (matched_at, id) is past the cursor
+                start = bisect.bisect_left(rows, (after[0], after[1] + 1))
+            return rows[start:start + limit]
+
+    # Maintenance
+
+    def start_reconciliation(self, chunk_size, restart=False):
+        """Record every mutual pair in the graph that has no match (runs to completion)"""
+        started = time.perf_counter()
+        with self._lock:
+            found = []
+            scanned = 0
+            for crush_key, admirers in self._admirers.items():
+                scanned += len(admirers)
+                returned = self._edges.get(crush_key, ())
+                crush = self._addresses.get(crush_key)
+                for admirer_key in admirers:
+                    if admirer_key in returned and crush is not None:
+                        admirer = self._addresses[admirer_key]
+                        if admirer < crush:
+                            found.append((admirer, crush))
+        inserted = self.add_matches(found)
+
+        self._reconcile_status = {
+            "job": "mutual_matches",
+            "scanned": scanned,
+            "matches_found": len(found),
+            "matches_inserted": len(inserted),
+            "finished_at": _now(),
+            "duration_ms": (time.perf_counter() - started) * 1000,
+        }
+        return True
+
+    def get_reconciliation_status(self):
+        return dict(self._reconcile_status, running=False)
+
+    def repair_counters(self):
+        # Counters are derived from the rows on every read
+        with self._lock:
+            wallets = set(self._crushes) | set(self._user_matches)
+        return {"wallets": len(wallets), "repaired": 0}
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "path": self.path,
+                "users": len(self._users),
+                "crushes": sum(len(rows) for rows in self._crushes.values()),
+                "crushers": len(self._edges),
+                "matches": len(self._matches),
+                "ops_since_snapshot": self._ops_since_snapshot,
+                "last_snapshot_at": self._last_snapshot_at,
+                "last_snapshot_ms": self._last_snapshot_ms,
+            }
+
+    def close(self):
+        """Stop the snapshot thread, write a final snapshot and close the log"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        if self.path and self._log is not None:
+            try:
+                if self._ops_since_snapshot:
+                    self.snapshot()
+            except Exception as e:
+                print(f"Error writing memory snapshot: {e}")
+            with self._lock:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,300 @@
+"""
+Prometheus metrics.
+
+Counters and histograms are aggregated per thread: each thread updates
+its own slots without taking a lock, and rendering /metrics sums the
+slots of every thread (folding those of finished threads into a shared
+total). Recording a value costs a dict lookup and a bisect, so metrics
+stay on in production; CRUSH_METRICS=0 turns recording off.
+
+Recorded metrics:
+
+- crush_http_request_duration_seconds{method, route, status}: every HTTP
+  request (MetricsMiddleware), labeled with the route's path template
+- crush_db_query_duration_seconds{statement}: every statement executed and
+  every commit on an app.db_pool connection. Rows fetched after the first
+  one aren't included; crush_storage_call_duration_seconds is.
+- crush_storage_call_duration_seconds{function}: storage calls run by the
+  database executor, and crush_db_queue_wait_seconds before them
+- crush_matcher_operation_duration_seconds{operation}: matcher operations
+  (hashing, encryption, proofs), including the wait for a worker
+- crush_crushes_submitted_total, crush_matches_created_total
+- crush_hash_cache_hits_total, crush_hash_cache_misses_total (read from
+  the matcher's hash memo when rendering)
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Record metrics (rendering /metrics always works)
+ENABLED = os.environ.get("CRUSH_METRICS", "1").lower() in ("1", "true", "yes")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds in seconds: requests, and faster operations
+# (single statements, hashing)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25, 1.0)
+
+Labels = Tuple[str, ...]
+
+
+class Registry:
+    """Per-thread slots of every metric, merged when rendering"""
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+        self._local = threading.local()
+        self._threads: List[Tuple[threading.Thread, dict]] = []
+        self._retired: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def slots(self) -> dict:
+        """This thread's slots, keyed by (metric, labels)"""
+        try:
+            return self._local.slots
+        except AttributeError:
+            slots = self._local.slots = {}
+            with self._lock:
+                self._threads.append((threading.current_thread(), slots))
+            return slots
+
+    def collect(self) -> Dict[tuple, list]:
+        """Sum of every thread's slots"""
+        with self._lock:
+            live = []
+            for thread, slots in self._threads:
+                if thread.is_alive():
+                    live.append((thread, slots))
+                else:
+                    _merge(self._retired, slots)
+            self._threads = live
+            totals = {key: list(values) for key, values in self._retired.items()}
+            for _, slots in live:
+                _merge(totals, slots)
+        return totals
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        totals = self.collect()
+        by_metric: Dict["Metric", Dict[Labels, list]] = {}
+        for (metric, labels), values in totals.items():
+            by_metric.setdefault(metric, {})[labels] = values
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples(by_metric.get(metric, {})))
+        return "\n".join(lines) + "\n"
+
+
+def _merge(totals: Dict[tuple, list], slots: dict) -> None:
+    # list() copies the items in one step, while other threads keep adding
+    for key, values in list(slots.items()):
+        total = totals.get(key)
+        if total is None:
+            totals[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or default_registry
+        self.registry.metrics.append(self)
+
+    def samples(self, values: Dict[Labels, list]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic count (the name should end in _total)"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        if not ENABLED:
+            return
+        slots = self.registry.slots()
+        slot = slots.get((self, labels))
+        if slot is None:
+            slot = slots[(self, labels)] = [0]
+        slot[0] += amount
+
+    def samples(self, values):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {slot[0]}"
+            for labels, slot in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    """Distribution of durations in seconds over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not ENABLED:
+            return
+        slots = self.registry.slots()
+        slot = slots.get((self, labels))
+        if slot is None:
+            # Count per bucket (the last one is +Inf), then the sum
+            slot = slots[(self, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+        slot[bisect_left(self.buckets, value)] += 1
+        slot[-1] += value
+
+    def samples(self, values):
+        lines = []
+        for labels, slot in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip([*map(repr, self.buckets), "+Inf"], slot):
+                cumulative += count
+                label_text = _format_labels((*self.labelnames, "le"), (*labels, bound))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {slot[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class CallbackCounter(Metric):
+    """Counter whose value is read from elsewhere when rendering"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, read: Callable[[], float], registry=None):
+        super().__init__(name, help, (), registry)
+        self.read = read
+
+    def samples(self, values):
+        return [f"{self.name} {self.read()}"]
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[int, Dict[Callable, str]] = {}
+
+    def _route(self, scope) -> str:
+        # The router leaves the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        app = scope.get("app")
+        if endpoint is None or app is None:
+            return "unmatched"
+        routes = self._routes.get(id(app))
+        if routes is None:
+            routes = self._routes[id(app)] = {
+                route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")
+            }
+        return routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started, scope["method"], self._route(scope), str(status)
+            )
+
+
+STATEMENT_KINDS = {
+    "select", "insert", "update", "delete", "replace", "with", "begin", "pragma", "create", "drop", "alter",
+}
+
+
+# Labels of recently seen SQL strings (the app runs a fixed set of them)
+_statement_kinds: Dict[str, str] = {}
+MAX_CACHED_STATEMENTS = 4096
+
+
+def statement_kind(sql: str) -> str:
+    """Label of a SQL statement: its first keyword, lowercased"""
+    kind = _statement_kinds.get(sql)
+    if kind is None:
+        keyword = sql.lstrip()[:8].split(None, 1)
+        kind = keyword[0].lower() if keyword else ""
+        if kind not in STATEMENT_KINDS:
+            kind = "other"
+        if len(_statement_kinds) < MAX_CACHED_STATEMENTS:
+            _statement_kinds[sql] = kind
+    return kind
+
+
+def _hash_cache(field: str) -> Callable[[], float]:
+    def read() -> float:
+        from app.fhe_matcher import fhe_matcher
+        return fhe_matcher.hash_cache_info()[field]
+    return read
+
+
+default_registry = Registry()
+
+HTTP_REQUEST_DURATION = Histogram(
+    "crush_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+DB_QUERY_DURATION = Histogram(
+    "crush_db_query_duration_seconds", "SQLite statement and commit latency", ("statement",),
+    buckets=FAST_BUCKETS
+)
+STORAGE_CALL_DURATION = Histogram(
+    "crush_storage_call_duration_seconds", "Storage call latency on the database executor", ("function",),
+    buckets=FAST_BUCKETS
+)
+DB_QUEUE_WAIT = Histogram(
+    "crush_db_queue_wait_seconds", "Time storage calls waited for an executor thread", buckets=FAST_BUCKETS
+)
+MATCHER_OPERATION_DURATION = Histogram(
+    "crush_matcher_operation_duration_seconds", "Matcher operation latency", ("operation",),
+    buckets=FAST_BUCKETS
+)
+CRUSHES_SUBMITTED = Counter("crush_crushes_submitted_total", "Crushes stored")
+MATCHES_CREATED = Counter("crush_matches_created_total", "Matches recorded")
+COUNTER_REPAIRS = Counter(
+    "crush_counter_repairs_total", "Counter repairs run after a sharded write failed to update shard 0"
+)
+HASH_CACHE_HITS = CallbackCounter(
+    "crush_hash_cache_hits_total", "Address hashes served from the matcher's memo", _hash_cache("hits")
+)
+HASH_CACHE_MISSES = CallbackCounter(
+    "crush_hash_cache_misses_total", "Address hashes computed by the matcher", _hash_cache("misses")
+)
@@ -0,0 +1,300 @@
+"""
+Versioned schema migrations.
+
+Each migration has a version number and is applied once, in order, inside
+its own transaction. Applied versions are recorded in the schema_version
+table. init_db() applies pending migrations at startup (or the first
+query does, with CRUSH_LAZY_INIT); they can also be applied by hand from
+the backend directory:
+
+    python -m app.migrations
+
+To change the schema, append a new migration. Never edit one that has
+already shipped.
+"""
+
+import argparse
+import sqlite3
+from typing import Callable, List, NamedTuple
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register a migration function"""
+    def register(fn: Callable[[sqlite3.Connection], None]):
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+@migration(1, "initial schema")
+def _initial_schema(conn: sqlite3.Connection) -> None:
+    # Table for encrypted crush submissions
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS crushes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            crusher_address TEXT NOT NULL,
+            crush_address_encrypted TEXT NOT NULL,
+            crush_address_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(crusher_address, crush_address_hash)
+        )
+    """)
+
+    # Table for confirmed matches
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_address TEXT NOT NULL,
+            user2_address TEXT NOT NULL,
+            matched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user1_address, user2_address)
+        )
+    """)
+
+    # Table for user profiles
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            wallet_address TEXT PRIMARY KEY,
+            nickname TEXT,
+            avatar_seed TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(2, "reconciliation checkpoint table")
+def _reconcile_state(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reconcile_state (
+            job TEXT PRIMARY KEY,
+            last_crush_id INTEGER NOT NULL DEFAULT 0,
+            max_crush_id INTEGER NOT NULL DEFAULT 0,
+            scanned INTEGER NOT NULL DEFAULT 0,
+            matches_found INTEGER NOT NULL DEFAULT 0,
+            matches_inserted INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+@migration(3, "covering index for matches by second participant")
+def _matches_user2_index(conn: sqlite3.Connection) -> None:
+    # UNIQUE(user1_address, user2_address) already serves lookups by user1;
+    # this one serves the `user2_address = ?` side of get_matches_for_user
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_user2
+        ON matches(user2_address, user1_address)
+    """)
+
+
+@migration(4, "store crusher address hash on crushes")
+def _crusher_address_hash(conn: sqlite3.Connection) -> None:
+    from app.fhe_matcher import address_hash
+
+    conn.execute("ALTER TABLE crushes ADD COLUMN crusher_address_hash TEXT")
+
+    # Backfill one batch of distinct crushers at a time
+    while True:
+        addresses = [row[0] for row in conn.execute("""
+            SELECT DISTINCT crusher_address FROM crushes
+            WHERE crusher_address_hash IS NULL
+            LIMIT 10000
+        """)]
+        if not addresses:
+            break
+        conn.executemany(
+            "UPDATE crushes SET crusher_address_hash = ? WHERE crusher_address = ?",
+            [(address_hash(address), address) for address in addresses]
+        )
+
+    # Serves reverse-edge lookups by hash pair (reconciliation)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_crushes_hash_pair
+        ON crushes(crusher_address_hash, crush_address_hash)
+    """)
+
+
+@migration(5, "cache issued match proofs on matches")
+def _match_proof(conn: sqlite3.Connection) -> None:
+    conn.execute("ALTER TABLE matches ADD COLUMN proof TEXT")
+
+
+@migration(6, "per-wallet data version counters")
+def _user_versions(conn: sqlite3.Connection) -> None:
+    # Bumped whenever a wallet's crushes or matches change; drives the
+    # ETags of /api/stats and /api/matches
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_versions (
+            wallet_address TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+
+@migration(7, "materialized per-wallet counters")
+def _user_counters(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_counters (
+            wallet_address TEXT PRIMARY KEY,
+            crushes_sent INTEGER NOT NULL DEFAULT 0,
+            matches_count INTEGER NOT NULL DEFAULT 0,
+            last_match_at TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+
+    # Backfill from the source tables
+    conn.execute("""
+        INSERT INTO user_counters (wallet_address, crushes_sent, matches_count, last_match_at)
+        SELECT wallet_address, SUM(crushes_sent), SUM(matches_count), MAX(last_match_at)
+        FROM (
+            SELECT crusher_address AS wallet_address, COUNT(*) AS crushes_sent,
+                0 AS matches_count, NULL AS last_match_at
+            FROM crushes GROUP BY crusher_address
+            UNION ALL
+            SELECT user1_address, 0, COUNT(*), MAX(matched_at) FROM matches GROUP BY user1_address
+            UNION ALL
+            SELECT user2_address, 0, COUNT(*), MAX(matched_at) FROM matches GROUP BY user2_address
+        )
+        GROUP BY wallet_address
+    """)
+
+
+@migration(8, "covering indexes for matches by participant and time")
+def _matches_time_indexes(conn: sqlite3.Connection) -> None:
+    # Serve keyset pages of a wallet's matches ordered by (matched_at, id)
+    # from the index alone; the user2 one supersedes idx_matches_user2
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_user1_time
+        ON matches(user1_address, matched_at, id, user2_address)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_user2_time
+        ON matches(user2_address, matched_at, id, user1_address)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_matches_user2")
+
+
+@migration(9, "shard layout")
+def _shard_layout(conn: sqlite3.Connection) -> None:
+    # Single row describing how crushes and matches are partitioned (see
+    # app.shard_layout); absent means one shard. previous_count is set while a
+    # rebalance is moving rows.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_layout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_count INTEGER NOT NULL,
+            previous_count INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(10, "storage format")
+def _storage_format(conn: sqlite3.Connection) -> None:
+    # 'binary' stores the addresses and hashes of crushes and matches as raw
+    # bytes (see app.encoding). A database that already has rows keeps the
+    # hex 'text' format until `python -m app.compact` converts it online.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS storage_format (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            format TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO storage_format (id, format)
+        SELECT 1, CASE
+            WHEN EXISTS (SELECT 1 FROM crushes) OR EXISTS (SELECT 1 FROM matches) THEN 'text'
+            ELSE 'binary'
+        END
+    """)
+
+
+@migration(11, "deferred index definitions")
+def _deferred_indexes(conn: sqlite3.Connection) -> None:
+    # Indexes dropped for a bulk import (app.bulk), kept until they are
+    # rebuilt so an interrupted import can't lose them
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS deferred_indexes (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL,
+            dropped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _ensure_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Highest applied migration version (0 for a fresh database)"""
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[Migration]:
+    """Apply all pending migrations in order, returning the ones applied"""
+    _ensure_version_table(conn)
+
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= current_version(conn):
+            continue
+
+        # Take the write lock before re-checking the version so concurrent
+        # workers starting up don't apply the same migration twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if m.version <= current_version(conn):
+                conn.rollback()
+                continue
+            m.apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (m.version, m.description)
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(m)
+    return applied
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Apply pending database schema migrations")
+    parser.parse_args(argv)
+
+    import app.database as db
+
+    with db.get_connection() as conn:
+        applied = migrate(conn)
+        version = current_version(conn)
+
+    for m in applied:
+        print(f"Applied migration {m.version}: {m.description}")
+    print(f"Schema is at version {version} ({db.DATABASE_PATH})")
+
+
+if __name__ == "__main__":
+    main()
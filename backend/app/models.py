@@ -28,7 +28,9 @@ class UserStats(BaseModel):
     wallet_address: str
     crushes_sent: int = 0
     matches_count: int = 0
-    matches: List[str] = []
+    last_match_at: Optional[datetime] = None
+    # Only loaded with include_matches (None otherwise, never a misleading [])
+    matches: Optional[List[str]] = None
 
 
 class MatchNotification(BaseModel):
@@ -53,3 +55,46 @@ class CompatibilityResult(BaseModel):
     emoji: str = Field(..., description="Emoji representing the level")
     message: str = Field(..., description="Fun message about compatibility")
     color: str = Field(..., description="Theme color for this level")
+
+
+class CompatibilityBatchRequest(BaseModel):
+    """Score each address against each candidate"""
+    addresses: List[str] = Field(..., min_length=1, description="Wallet addresses to score")
+    candidates: List[str] = Field(..., min_length=1, description="Wallet addresses to score against")
+
+
+class CompatibilityBatchResult(BaseModel):
+    """Compatibility scores for a batch; scores[i][j] pairs addresses[i] with candidates[j]"""
+    addresses: List[str]
+    candidates: List[str]
+    scores: List[List[int]]
+
+
+class CompatibleUser(BaseModel):
+    """A registered wallet and its compatibility score"""
+    wallet_address: str
+    score: int = Field(..., ge=0, le=100)
+
+
+class CompatibilityTopResult(BaseModel):
+    """Most compatible registered wallets, best first"""
+    wallet_address: str
+    matches: List[CompatibleUser]
+
+
+class ProofVerification(BaseModel):
+    """A match proof and the two addresses it should prove"""
+    proof: str
+    address1: str
+    address2: str
+
+
+class ProofBatchVerifyRequest(BaseModel):
+    """Match proofs to verify in one call"""
+    proofs: List[ProofVerification] = Field(..., min_length=1)
+
+
+class ProofBatchVerifyResult(BaseModel):
+    """Verification result for each proof, in request order"""
+    results: List[bool]
+    valid_count: int
@@ -0,0 +1,188 @@
+"""
+In-process pub/sub hub for match notifications.
+
+Instead of polling /api/matches and /api/stats after every submit, clients
+subscribe to /api/matches/{wallet}/stream (SSE) or /ws (WebSocket).
+check_for_matches publishes to this hub when it records a new match, and
+the hub fans the event out to both participants.
+
+Memory is bounded everywhere. Every subscriber has a small queue; one that
+falls behind is told to resync and dropped. Recent events are kept in one
+fixed-size ring buffer for resume-from-Last-Event-ID. Event ids carry a
+per-process epoch, so ids issued by a previous process (or another worker)
+lead to a resync instead of silently missed events.
+
+The hub only sees matches recorded by its own worker process.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Optional, Set, Union
+
+from app.models import MatchNotification
+
+# Events buffered per subscriber before it is considered too slow
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("CRUSH_STREAM_QUEUE_SIZE", "32"))
+
+# Recent events kept for clients resuming with Last-Event-ID
+HISTORY_SIZE = int(os.environ.get("CRUSH_STREAM_HISTORY_SIZE", "10000"))
+
+# Seconds between keep-alive messages on idle streams
+HEARTBEAT_INTERVAL = float(os.environ.get("CRUSH_STREAM_HEARTBEAT", "15"))
+
+
+class MatchEvent:
+    """A match notification addressed to one wallet"""
+
+    __slots__ = ("id", "seq", "wallet", "data")
+
+    def __init__(self, event_id: str, seq: int, wallet: str, data: str):
+        self.id = event_id
+        self.seq = seq
+        self.wallet = wallet
+        self.data = data
+
+
+# Delivered to a subscriber that must refetch its state and reconnect
+RESYNC = object()
+
+
+class Subscription:
+    """One connected client"""
+
+    __slots__ = ("wallet", "queue", "loop")
+
+    def __init__(self, wallet: str, loop: asyncio.AbstractEventLoop):
+        self.wallet = wallet
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.loop = loop
+
+
+class MatchHub:
+    """Fans match events out to subscribed wallets"""
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.epoch = format(int(time.time() * 1000), "x")
+        self._seq = itertools.count(1)
+        self._history: Deque[MatchEvent] = deque(maxlen=history_size)
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+        # Metrics
+        self.published = 0
+        self.delivered = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self, wallet_address: str, last_event_id: Optional[str] = None):
+        """
+        Register a subscriber.
+
+        Returns (subscription, backlog), where backlog holds the buffered
+        events after `last_event_id`, or is RESYNC if they can't be
+        replayed.
+        """
+        wallet = wallet_address.lower()
+        subscription = Subscription(wallet, asyncio.get_running_loop())
+        self._subscribers.setdefault(wallet, set()).add(subscription)
+
+        backlog: object = []
+        if last_event_id:
+            backlog = self._replay(wallet, last_event_id)
+        return subscription, backlog
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.wallet)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.wallet]
+
+    def _replay(self, wallet: str, last_event_id: str):
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return RESYNC
+
+        last_seq = int(seq)
+        if self._history and last_seq < self._history[0].seq - 1:
+            # Some events after last_seq have already been evicted
+            return RESYNC
+
+        return [event for event in self._history if event.seq > last_seq and event.wallet == wallet]
+
+    def publish_match(self, address1: str, address2: str, matched_at: Union[datetime, str, None] = None) -> None:
+        """Notify both participants of a new match (stamped with its stored matched_at when given)"""
+        matched_at = matched_at or datetime.utcnow()
+        for wallet, other in ((address1.lower(), address2.lower()), (address2.lower(), address1.lower())):
+            data = MatchNotification(
+                your_address=wallet,
+                matched_address=other,
+                matched_at=matched_at,
+                message="You both like each other!"
+            ).model_dump_json()
+            self._publish(wallet, data)
+
+    def _publish(self, wallet: str, data: str) -> None:
+        seq = next(self._seq)
+        event = MatchEvent(f"{self.epoch}-{seq}", seq, wallet, data)
+        self._history.append(event)
+        self.published += 1
+
+        for subscription in list(self._subscribers.get(wallet, ())):
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is subscription.loop:
+                self._deliver(subscription, event)
+            else:
+                subscription.loop.call_soon_threadsafe(self._deliver, subscription, event)
+
+    def _deliver(self, subscription: Subscription, event: MatchEvent) -> None:
+        try:
+            subscription.queue.put_nowait(event)
+            self.delivered += 1
+        except asyncio.QueueFull:
+            # Too slow: drop its buffer and tell it to resync
+            self.unsubscribe(subscription)
+            self.dropped_subscribers += 1
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(RESYNC)
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def metrics(self) -> dict:
+        return {
+            "subscribers": self.subscriber_count(),
+            "wallets": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped_subscribers,
+            "history": len(self._history),
+        }
+
+
+def format_sse(event: Optional[MatchEvent] = None, comment: Optional[str] = None) -> str:
+    """Encode one server-sent event"""
+    if comment is not None:
+        return f": {comment}\n\n"
+    if event is None:
+        return "event: resync\ndata: {}\n\n"
+    return f"id: {event.id}\nevent: match\ndata: {event.data}\n\n"
+
+
+async def next_event(subscription: Subscription, timeout: float = HEARTBEAT_INTERVAL):
+    """Wait for the next event; None on heartbeat timeout"""
+    try:
+        return await asyncio.wait_for(subscription.queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return None
+
+
+# Global hub instance
+match_hub = MatchHub()
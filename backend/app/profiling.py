@@ -0,0 +1,335 @@
+"""
+On-demand request profiling and slow-query tracing.
+
+Both write to bounded in-memory ring buffers of the worker, read through
+the /api/admin/profiles and /api/admin/slow-queries endpoints, and can be
+switched on at runtime with POST /api/admin/profiling (per worker)
+instead of a redeploy.
+
+- Profiles: CRUSH_PROFILE_SAMPLE_PERCENT of requests, plus any request
+  carrying `X-Profile: 1` and a valid admin token, run under cProfile.
+  The profiler covers the event loop thread while the request is in
+  flight (so it also sees work done for concurrent requests) and every
+  storage call made for the request on the database executor. One
+  request per worker is profiled at a time; the response of a profiled
+  request has an X-Profile-Id header.
+- Slow queries: every statement on an app.db_pool connection that takes
+  at least CRUSH_SLOW_QUERY_MS is recorded with its SQL, the shape of its
+  parameters (types and sizes, never values), its EXPLAIN QUERY PLAN and
+  its duration.
+"""
+
+import contextvars
+import cProfile
+import hmac
+import itertools
+import os
+import pstats
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Share of requests profiled (0 disables sampling)
+SAMPLE_PERCENT = float(os.environ.get("CRUSH_PROFILE_SAMPLE_PERCENT", "0"))
+
+# Statements at least this slow are traced (0 disables the slow-query log)
+SLOW_QUERY_MS = float(os.environ.get("CRUSH_SLOW_QUERY_MS", "0"))
+
+# Profiles and slow queries kept per worker
+BUFFER_SIZE = int(os.environ.get("CRUSH_TRACE_BUFFER_SIZE", "100"))
+
+# Functions listed per profile, by cumulative time
+PROFILE_TOP_FUNCTIONS = 40
+
+# Statements whose query plan is captured
+EXPLAINED_STATEMENTS = {"select", "insert", "update", "delete", "replace", "with"}
+
+
+class RingBuffer:
+    """The last `size` entries, each with an increasing id"""
+
+    def __init__(self, size: int = BUFFER_SIZE):
+        self._entries: deque = deque(maxlen=max(1, size))
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def append(self, entry: dict) -> dict:
+        entry.setdefault("id", self.next_id())
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def get(self, entry_id: int) -> Optional[dict]:
+        with self._lock:
+            return next((entry for entry in self._entries if entry["id"] == entry_id), None)
+
+    def latest(self, limit: int) -> List[dict]:
+        """Up to `limit` entries, newest first"""
+        with self._lock:
+            return list(itertools.islice(reversed(self._entries), limit))
+
+    @property
+    def size(self) -> int:
+        return self._entries.maxlen
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Profiler:
+    """Samples requests through cProfile and traces slow queries"""
+
+    def __init__(
+        self,
+        sample_percent: float = SAMPLE_PERCENT,
+        slow_query_ms: float = SLOW_QUERY_MS,
+        buffer_size: int = BUFFER_SIZE
+    ):
+        self.sample_percent = sample_percent
+        # Read on every statement, so kept in seconds (inf when disabled)
+        self.slow_query_seconds = float("inf")
+        self.configure(slow_query_ms=slow_query_ms)
+
+        self.profiles = RingBuffer(buffer_size)
+        self.slow_queries = RingBuffer(buffer_size)
+        self._busy = threading.Lock()
+        self._sampled = 0
+        self._requests = 0
+
+    # Settings
+
+    def configure(self, sample_percent: Optional[float] = None, slow_query_ms: Optional[float] = None) -> None:
+        if sample_percent is not None:
+            if not 0 <= sample_percent <= 100:
+                raise ValueError("sample_percent must be between 0 and 100")
+            self.sample_percent = sample_percent
+        if slow_query_ms is not None:
+            if slow_query_ms < 0:
+                raise ValueError("slow_query_ms must not be negative")
+            self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else float("inf")
+
+    def settings(self) -> dict:
+        slow = self.slow_query_seconds
+        return {
+            "sample_percent": self.sample_percent,
+            "slow_query_ms": 0 if slow == float("inf") else slow * 1000,
+            "buffer_size": self.profiles.size,
+            "profiles": len(self.profiles),
+            "slow_queries": len(self.slow_queries),
+        }
+
+    # Profiles
+
+    def should_sample(self) -> bool:
+        """Whether the next request is in the sampled share"""
+        self._requests += 1
+        if self.sample_percent <= 0:
+            return False
+        # Deterministic spacing: every (100 / percent)-th request
+        target = int(self._requests * self.sample_percent / 100)
+        if target > self._sampled:
+            self._sampled = target
+            return True
+        return False
+
+    def start(self) -> Optional["RequestProfile"]:
+        """Begin profiling a request, or None if another one is being profiled"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = RequestProfile(self)
+        if not profile.enable():
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile: "RequestProfile", entry: dict) -> dict:
+        profile.disable()
+        self._busy.release()
+        entry["functions"] = profile.top_functions(PROFILE_TOP_FUNCTIONS)
+        entry["storage_calls"] = profile.storage_calls
+        return self.profiles.append(entry)
+
+    # Slow queries
+
+    def record_query(
+        self,
+        conn: sqlite3.Connection,
+        execute: Callable[[str, Any], sqlite3.Cursor],
+        sql: str,
+        parameters: Any,
+        elapsed: float,
+        kind: str,
+        many: bool = False
+    ) -> None:
+        """Trace a statement that took at least the slow-query threshold"""
+        plan = None
+        if kind in EXPLAINED_STATEMENTS:
+            try:
+                plan_parameters = next(iter(parameters), ()) if many else parameters
+                plan = [row[3] for row in execute("EXPLAIN QUERY PLAN " + sql, plan_parameters).fetchall()]
+            except (sqlite3.Error, TypeError, StopIteration):
+                plan = None
+        self.slow_queries.append({
+            "at": datetime.utcnow().isoformat(),
+            "duration_ms": round(elapsed * 1000, 3),
+            "sql": " ".join(sql.split()),
+            "parameters": parameters_shape(parameters, many),
+            "plan": plan,
+            "in_transaction": conn.in_transaction,
+            "thread": threading.current_thread().name,
+        })
+
+
+class RequestProfile:
+    """cProfile state of one request, across the threads that work on it"""
+
+    def __init__(self, profiler: Profiler):
+        self.id = profiler.profiles.next_id()
+        self._main = cProfile.Profile()
+        self._calls: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self.storage_calls: List[dict] = []
+
+    def enable(self) -> bool:
+        try:
+            self._main.enable()
+            return True
+        except ValueError:
+            # Another profiler (e.g. a debugger) is active
+            return False
+
+    def disable(self) -> None:
+        self._main.disable()
+
+    def run_call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        call_profile = cProfile.Profile()
+        try:
+            call_profile.enable()
+        except ValueError:
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            call_profile.disable()
+            with self._lock:
+                self._calls.append(call_profile)
+                self.storage_calls.append({
+                    "function": getattr(fn, "__name__", "call"),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                    "thread": threading.current_thread().name,
+                })
+
+    def top_functions(self, limit: int) -> List[dict]:
+        """Functions with the most cumulative time, across all threads"""
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            for call_profile in self._calls:
+                stats.add(call_profile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [
+            {
+                "function": function,
+                "location": f"{filename}:{line}",
+                "calls": calls,
+                "self_ms": round(self_time * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            }
+            for (filename, line, function), (_, calls, self_time, cumulative, _) in rows
+        ]
+
+
+def parameters_shape(parameters: Any, many: bool = False) -> str:
+    """Types and sizes of bound parameters, without their values"""
+    if many:
+        rows = parameters if isinstance(parameters, (list, tuple)) else None
+        first = rows[0] if rows else ()
+        count = len(rows) if rows is not None else "?"
+        return f"{count} rows of {parameters_shape(first)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {_value_shape(value)}" for name, value in parameters.items()) + "}"
+    return "(" + ", ".join(_value_shape(value) for value in parameters) + ")"
+
+
+def _value_shape(value: Any) -> str:
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def admin_requested(headers: List[tuple], admin_token: Optional[str]) -> bool:
+    """Whether raw ASGI headers ask for a profile with a valid admin token"""
+    values = {name: value for name, value in headers if name in (b"x-profile", b"x-admin-token")}
+    token = values.get(b"x-admin-token", b"").decode("latin-1")
+    return (
+        values.get(b"x-profile") in (b"1", b"true")
+        and bool(admin_token)
+        and hmac.compare_digest(token, admin_token)
+    )
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running sampled (or admin-requested) requests under the profiler"""
+
+    def __init__(self, app, admin_token: Optional[str] = None):
+        self.app = app
+        self.admin_token = admin_token
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = admin_requested(scope.get("headers", []), self.admin_token)
+        if not (requested or profiler.should_sample()):
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.start()
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = dict(message, headers=[
+                    *message.get("headers", []), (b"x-profile-id", str(profile.id).encode())
+                ])
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_profile.reset(token)
+            profiler.finish(profile, {
+                "id": profile.id,
+                "at": datetime.utcnow().isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "requested": requested,
+            })
+
+
+# Profile of the request being handled (app.async_database runs the
+# request's storage calls under it)
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+# Global profiler instance
+profiler = Profiler()
@@ -0,0 +1,298 @@
+"""
+Whole-graph mutual-match reconciliation.
+
+Matches are normally recorded by check_for_matches at submit time. Pairs
+missed there (a crash between add_crush and add_match, a restore, a bulk
+load) are never matched. This job finds every mutual pair in the crushes
+table and inserts the missing rows into matches.
+
+It walks crushes in id order, one chunk at a time, joining each chunk
+against the reverse edges through the (crusher_address_hash,
+crush_address_hash) index. Every chunk commits its new matches together
+with a checkpoint, so an interrupted run resumes where it stopped. Memory
+use is bounded by the chunk size.
+
+With several shards (app.shard_layout) every shard's crushes are walked as a
+separate job, `mutual_matches:shard<i>`, checkpointed on shard 0. The
+reverse edges of a chunk are probed on the shards that own them, and the
+missing matches are recorded through app.sharding.
+
+Usage (from the backend directory):
+    python -m app.reconcile [--chunk-size N] [--restart]
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional
+
+import app.database as db
+from app.db_pool import open_connection
+from app.encoding import unpack_address, unpack_hash
+from app.storage import RECONCILE_CHUNK_SIZE as DEFAULT_CHUNK_SIZE
+
+JOB_NAME = "mutual_matches"
+
+ProgressCallback = Callable[[dict], None]
+
+_running_lock = threading.Lock()
+_running_thread: Optional[threading.Thread] = None
+
+
+def _load_state(conn: sqlite3.Connection, job: str = JOB_NAME) -> Optional[dict]:
+    row = conn.execute(
+        "SELECT * FROM reconcile_state WHERE job = ?", (job,)
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def _shard_job(shard: int) -> str:
+    return f"{JOB_NAME}:shard{shard}"
+
+
+def _start_run(conn: sqlite3.Connection, max_crush_id: int, job: str = JOB_NAME) -> dict:
+    conn.execute("""
+        INSERT OR REPLACE INTO reconcile_state
+            (job, last_crush_id, max_crush_id, scanned, matches_found, matches_inserted,
+             started_at, updated_at, finished_at)
+        VALUES (?, 0, ?, 0, 0, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, NULL)
+    """, (job, max_crush_id))
+    conn.commit()
+    return _load_state(conn, job)
+
+
+def _reconcile_chunk(conn: sqlite3.Connection, first_id: int, last_id: int) -> dict:
+    """Find and record the mutual pairs whose smaller-address side is in (first_id, last_id]"""
+    scanned = conn.execute(
+        "SELECT COUNT(*) FROM crushes WHERE id > ? AND id <= ?", (first_id, last_id)
+    ).fetchone()[0]
+
+    pairs = conn.execute("""
+        SELECT a.crusher_address, b.crusher_address
+        FROM crushes a
+        JOIN crushes b ON b.crusher_address_hash = a.crush_address_hash
+            AND b.crush_address_hash = a.crusher_address_hash
+        WHERE a.id > ? AND a.id <= ?
+            AND a.crusher_address < b.crusher_address
+    """, (first_id, last_id)).fetchall()
+
+    inserted = []
+    for row in pairs:
+        # SQLite sorts TEXT before BLOB, so a pair with a non-hex address
+        # is ordered by text form, like insert_match does
+        pair = tuple(sorted([unpack_address(row[0]), unpack_address(row[1])]))
+        cursor = conn.execute("""
+            INSERT OR IGNORE INTO matches (user1_address, user2_address)
+            VALUES (?, ?)
+        """, (db.pack_address(pair[0]), db.pack_address(pair[1])))
+        if cursor.rowcount > 0:
+            inserted.append(pair)
+    db.record_new_matches(conn, inserted)
+
+    return {"scanned": scanned, "found": len(pairs), "inserted": len(inserted)}
+
+
+def _reconcile_shard_chunk(shard: int, first_id: int, last_id: int) -> dict:
+    """_reconcile_chunk for one shard of a sharded database"""
+    import app.sharding as sharding
+
+    with db.shards.connection(shard) as conn:
+        edges = [tuple(row) for row in conn.execute("""
+            SELECT crusher_address, crusher_address_hash, crush_address_hash FROM crushes
+            WHERE id > ? AND id <= ?
+        """, (first_id, last_id))]
+
+    # The reverse edge belongs to the crush, so its owner is routed by the
+    # crush's address hash, which is stored on this row
+    groups = {}
+    for edge in edges:
+        for owner in db.shards.owners(unpack_hash(edge[2])):
+            groups.setdefault(owner, []).append(edge)
+
+    def probe(item) -> list:
+        owner, batch = item
+        pairs = []
+        with db.shards.connection(owner) as conn:
+            for start in range(0, len(batch), db.SQLITE_MAX_VARIABLES // 3):
+                chunk = batch[start:start + db.SQLITE_MAX_VARIABLES // 3]
+                values = ", ".join(["(?, ?, ?)"] * len(chunk))
+                pairs.extend((unpack_address(row[0]), unpack_address(row[1])) for row in conn.execute(f"""
+                    WITH batch(crusher_address, crusher_hash, crush_hash) AS (VALUES {values})
+                    SELECT batch.crusher_address, b.crusher_address FROM batch
+                    JOIN crushes b ON b.crusher_address_hash = batch.crush_hash
+                        AND b.crush_address_hash = batch.crusher_hash
+                    WHERE batch.crusher_address < b.crusher_address
+                """, [value for edge in chunk for value in edge]))
+        return pairs
+
+    pairs = list(dict.fromkeys(pair for found in db.shards.fanout(probe, groups.items()) for pair in found))
+    inserted = sharding.insert_matches(pairs) if pairs else []
+
+    return {"scanned": len(edges), "found": len(pairs), "inserted": len(inserted)}
+
+
+def _run_job(
+    conn: sqlite3.Connection,
+    job: str,
+    max_crush_id: Callable[[], int],
+    reconcile_chunk: Callable[[int, int], dict],
+    chunk_size: int,
+    restart: bool,
+    progress: Optional[ProgressCallback],
+) -> dict:
+    """Drive one job from its checkpoint to the end, committing state after every chunk"""
+    state = _load_state(conn, job)
+    if restart or state is None or state["finished_at"] is not None:
+        state = _start_run(conn, max_crush_id(), job)
+
+    last_id = state["last_crush_id"]
+    max_id = state["max_crush_id"]
+    while last_id < max_id:
+        chunk_end = min(last_id + chunk_size, max_id)
+        result = reconcile_chunk(last_id, chunk_end)
+        conn.execute("""
+            UPDATE reconcile_state SET
+                last_crush_id = ?,
+                scanned = scanned + ?,
+                matches_found = matches_found + ?,
+                matches_inserted = matches_inserted + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE job = ?
+        """, (chunk_end, result["scanned"], result["found"], result["inserted"], job))
+        conn.commit()
+        last_id = chunk_end
+
+        if progress:
+            progress(_load_state(conn, job))
+
+    conn.execute("""
+        UPDATE reconcile_state SET finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE job = ?
+    """, (job,))
+    conn.commit()
+    return _load_state(conn, job)
+
+
+def _combine_states(states: List[dict]) -> dict:
+    """Overall state of the per-shard jobs"""
+    finished = [state.get("finished_at") for state in states]
+    return {
+        "job": JOB_NAME,
+        "scanned": sum(state.get("scanned", 0) for state in states),
+        "matches_found": sum(state.get("matches_found", 0) for state in states),
+        "matches_inserted": sum(state.get("matches_inserted", 0) for state in states),
+        "finished_at": max(finished) if all(finished) else None,
+        "shards": states,
+    }
+
+
+def run_reconciliation(
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    restart: bool = False,
+    progress: Optional[ProgressCallback] = None,
+    database_path: Optional[str] = None,
+) -> dict:
+    """
+    Reconcile the matches table against every mutual pair in crushes.
+
+    Resumes an unfinished run unless `restart` is set. `progress` is called
+    with the job state after every committed chunk. Returns the final state.
+    """
+    conn = open_connection(database_path or db.DATABASE_PATH)
+    try:
+        if database_path is None and db.shards.sharded:
+            states = []
+            for shard in db.shards.all():
+                def max_crush_id(shard=shard) -> int:
+                    with db.shards.connection(shard) as shard_conn:
+                        return shard_conn.execute("SELECT COALESCE(MAX(id), 0) FROM crushes").fetchone()[0]
+
+                states.append(_run_job(
+                    conn, _shard_job(shard), max_crush_id,
+                    lambda first_id, last_id, shard=shard: _reconcile_shard_chunk(shard, first_id, last_id),
+                    chunk_size, restart, progress
+                ))
+            return _combine_states(states)
+
+        return _run_job(
+            conn, JOB_NAME,
+            lambda: conn.execute("SELECT COALESCE(MAX(id), 0) FROM crushes").fetchone()[0],
+            lambda first_id, last_id: _reconcile_chunk(conn, first_id, last_id),
+            chunk_size, restart, progress
+        )
+    finally:
+        conn.close()
+
+
+def get_status(database_path: Optional[str] = None) -> dict:
+    """State of the last (or current) reconciliation run"""
+    conn = open_connection(database_path or db.DATABASE_PATH)
+    try:
+        if database_path is None and db.shards.sharded:
+            state = _combine_states([
+                _load_state(conn, _shard_job(shard)) or {"job": _shard_job(shard)}
+                for shard in db.shards.all()
+            ])
+        else:
+            state = _load_state(conn) or {"job": JOB_NAME}
+    finally:
+        conn.close()
+    state["running"] = is_running()
+    return state
+
+
+def is_running() -> bool:
+    """Whether a background reconciliation is in progress in this process"""
+    return _running_thread is not None and _running_thread.is_alive()
+
+
+def start_background(chunk_size: int = DEFAULT_CHUNK_SIZE, restart: bool = False) -> bool:
+    """Start a reconciliation in a background thread; False if one is already running"""
+    global _running_thread
+
+    with _running_lock:
+        if is_running():
+            return False
+
+        def target():
+            try:
+                run_reconciliation(chunk_size=chunk_size, restart=restart)
+            except Exception as e:
+                print(f"Error reconciling matches: {e}")
+
+        _running_thread = threading.Thread(target=target, name="crush-reconcile", daemon=True)
+        _running_thread.start()
+        return True
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Record every mutual crush pair missing from matches")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="crush rows scanned per committed chunk")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the saved checkpoint and start from the first crush")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+
+    def report(state: dict) -> None:
+        max_id = state["max_crush_id"] or 1
+        percent = 100 * state["last_crush_id"] / max_id
+        shard = f" {state['job'].partition(':')[2]}" if ":" in state["job"] else ""
+        print(
+            f"[{percent:5.1f}%{shard}] scanned {state['scanned']} crushes, "
+            f"found {state['matches_found']} mutual pairs, "
+            f"inserted {state['matches_inserted']} missing matches "
+            f"({time.perf_counter() - started:.1f}s)"
+        )
+
+    state = run_reconciliation(chunk_size=args.chunk_size, restart=args.restart, progress=report)
+    print(
+        f"Done: {state['matches_found']} mutual pairs, "
+        f"{state['matches_inserted']} missing matches inserted"
+    )
+
+
+if __name__ == "__main__":
+    main()
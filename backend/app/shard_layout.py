@@ -0,0 +1,242 @@
+"""
+Shard layout and routing for the crush database.
+
+With more than one shard, `crushes` is partitioned by crusher address hash
+and `matches` by normalized pair across several SQLite files. Everything
+else (users, counters, versions, job state, the layout itself) stays in
+shard 0, the original database file. Shard i > 0 lives next to it as
+`crushes.shard<i>.db`.
+
+A row's owner is `key % shard_count`, where the key comes from the
+crusher address hash or a hash of the pair. Doubling the shard count
+therefore only moves rows from shard i to shard i + N (see
+app.sharding's rebalance tool). While a rebalance runs, the layout also
+records the previous count. Writes then go to the new owner and reads
+check both the new and the old owner.
+
+The layout is stored in the shard_layout table of shard 0 and re-read
+every CRUSH_SHARD_LAYOUT_TTL seconds, so every worker follows a
+rebalance without a restart. The storage format of shard 0's
+storage_format table (see app.compact) is cached the same way.
+
+No file is opened until first use: the first connection to a shard
+applies its pending migrations, and the first one to shard 0 also records
+CRUSH_DB_SHARDS for a new database. This keeps imports cheap for
+serverless cold starts (see CRUSH_LAZY_INIT in app.database).
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from app.db_pool import ConnectionPool
+
+I = TypeVar("I")
+T = TypeVar("T")
+
+# Shard count for a new, empty database (existing ones keep their layout)
+INITIAL_SHARDS = int(os.environ.get("CRUSH_DB_SHARDS", "1"))
+
+# Seconds a worker caches the shard layout
+LAYOUT_TTL = float(os.environ.get("CRUSH_SHARD_LAYOUT_TTL", "5"))
+
+# Threads used to probe shards in parallel
+FANOUT_THREADS = int(os.environ.get("CRUSH_SHARD_FANOUT_THREADS", "8"))
+
+# Upper bound on shards; also the stride of cross-shard row ids
+MAX_SHARDS = 1024
+
+HOME_SHARD = 0
+
+
+def route(key: str, shard_count: int) -> int:
+    """Owning shard of a hex routing key"""
+    return int(key[:15], 16) % shard_count
+
+
+def pair_key(address1: str, address2: str) -> str:
+    """Routing key of a match (order-independent)"""
+    addr1, addr2 = sorted([address1.lower(), address2.lower()])
+    return hashlib.blake2b(f"{addr1}:{addr2}".encode(), digest_size=8).hexdigest()
+
+
+class ShardSet:
+    """Connection pools for every shard, plus the cached layout"""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.home = ConnectionPool(base_path)
+        self._pools: Dict[int, ConnectionPool] = {HOME_SHARD: self.home}
+        self._migrated = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self._count = 1
+        self._previous: Optional[int] = None
+        self._format = "text"
+        self._loaded_at = float("-inf")
+
+    def path(self, shard: int) -> str:
+        if shard == HOME_SHARD:
+            return self.base_path
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}.shard{shard}{ext}"
+
+    def pool(self, shard: int) -> ConnectionPool:
+        """Pool of a shard, creating its file and schema on first use (once per worker)"""
+        pool = self._pools.get(shard)
+        if pool is not None and shard in self._migrated:
+            return pool
+
+        with self._lock:
+            pool = self._pools.get(shard)
+            if pool is None:
+                pool = self._pools[shard] = ConnectionPool(self.path(shard))
+            if shard not in self._migrated:
+                from app.migrations import migrate
+                with pool.connection() as conn:
+                    migrate(conn)
+                    if shard == HOME_SHARD:
+                        self._initial_layout(conn)
+                self._migrated.add(shard)
+        return pool
+
+    def _initial_layout(self, conn: sqlite3.Connection) -> None:
+        """Record CRUSH_DB_SHARDS for a new, empty database"""
+        if INITIAL_SHARDS <= 1 or conn.execute("SELECT 1 FROM shard_layout").fetchone():
+            return
+        empty = conn.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM crushes) AND NOT EXISTS (SELECT 1 FROM matches)"
+        ).fetchone()[0]
+        # CRUSH_DB_SHARDS only applies to a new database; use the rebalance
+        # tool (python -m app.sharding) to reshard an existing one
+        if not empty:
+            print(f"Ignoring CRUSH_DB_SHARDS={INITIAL_SHARDS}: database already has data; "
+                  f"use `python -m app.sharding rebalance` instead")
+            return
+        if not 1 <= INITIAL_SHARDS <= MAX_SHARDS:
+            raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}")
+        conn.execute("""
+            INSERT OR IGNORE INTO shard_layout (id, shard_count, previous_count, updated_at)
+            VALUES (1, ?, NULL, CURRENT_TIMESTAMP)
+        """, (INITIAL_SHARDS,))
+        conn.commit()
+        self._loaded_at = float("-inf")
+
+    def connection(self, shard: int):
+        return self.pool(shard).connection()
+
+    def transaction(self, shard: int):
+        return self.pool(shard).transaction()
+
+    # Layout
+
+    def _refresh(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._loaded_at < LAYOUT_TTL:
+            return
+        try:
+            with self.connection(HOME_SHARD) as conn:
+                row = conn.execute("SELECT shard_count, previous_count FROM shard_layout WHERE id = 1").fetchone()
+                format_row = conn.execute("SELECT format FROM storage_format WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            # Migrations failed: a single shard in the text format
+            row = format_row = None
+        if row:
+            self._count, self._previous = row[0], row[1]
+        if format_row:
+            self._format = format_row[0]
+        self._loaded_at = time.monotonic()
+
+    def layout(self, force: bool = False) -> Tuple[int, Optional[int]]:
+        """(shard_count, previous_count); previous_count is set during a rebalance"""
+        self._refresh(force)
+        return self._count, self._previous
+
+    @property
+    def sharded(self) -> bool:
+        count, previous = self.layout()
+        return count > 1 or previous is not None
+
+    def set_layout(self, shard_count: int, previous_count: Optional[int] = None) -> None:
+        """Record a new layout in shard 0 (picked up by other workers within the TTL)"""
+        if not 1 <= shard_count <= MAX_SHARDS:
+            raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}")
+        with self.transaction(HOME_SHARD) as conn:
+            conn.execute("""
+                INSERT INTO shard_layout (id, shard_count, previous_count, updated_at)
+                VALUES (1, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(id) DO UPDATE SET
+                    shard_count = excluded.shard_count,
+                    previous_count = excluded.previous_count,
+                    updated_at = excluded.updated_at
+            """, (shard_count, previous_count))
+        self._refresh(force=True)
+
+    @property
+    def binary(self) -> bool:
+        """Whether crushes and matches store packed addresses and hashes"""
+        self._refresh()
+        return self._format == "binary"
+
+    def set_format(self, storage_format: str) -> None:
+        """Record the storage format in shard 0 (picked up by other workers within the TTL)"""
+        with self.transaction(HOME_SHARD) as conn:
+            conn.execute("""
+                UPDATE storage_format SET format = ?, updated_at = CURRENT_TIMESTAMP WHERE id = 1
+            """, (storage_format,))
+        self._refresh(force=True)
+
+    def all(self) -> List[int]:
+        """Every shard that may hold rows"""
+        count, previous = self.layout()
+        return list(range(max(count, previous or 0)))
+
+    def owners(self, key: str) -> List[int]:
+        """Shards that may hold the row with this routing key, write owner first"""
+        count, previous = self.layout()
+        owner = route(key, count)
+        if previous is None or route(key, previous) == owner:
+            return [owner]
+        return [owner, route(key, previous)]
+
+    def owner(self, key: str) -> int:
+        """Shard that new rows with this routing key are written to"""
+        return route(key, self.layout()[0])
+
+    # Parallel access
+
+    def fanout(self, fn: Callable[[I], T], items: Iterable[I]) -> List[T]:
+        """Run fn(item) for each item (usually a shard), in parallel when there are several"""
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=FANOUT_THREADS, thread_name_prefix="crush-shard"
+                    )
+        return list(self._executor.map(fn, items))
+
+    def stats(self) -> dict:
+        """Layout and per-shard pool occupancy"""
+        count, previous = self.layout()
+        return {
+            "shard_count": count,
+            "previous_count": previous,
+            "format": self._format,
+            "pools": {shard: pool.stats() for shard, pool in sorted(self._pools.items())},
+        }
+
+    def close(self) -> None:
+        """Close every shard's pooled connections and the fan-out threads"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for pool in list(self._pools.values()):
+            pool.close()
@@ -0,0 +1,552 @@
+"""
+Sharded versions of the crush and match data functions.
+
+database.py dispatches here when the layout in app.shard_layout has more than
+one shard, or a rebalance is running. A crush lives on the shard that
+owns its crusher address hash, and a match on the shard that owns its
+pair key. Counters, versions and users stay on shard 0.
+
+A write that touches a data shard and shard 0 runs as two transactions,
+data shard first. If the second one fails, the failure is logged and
+counted (crush_counter_repairs_total) and the counters are recomputed
+from the data rows right away. If the process dies between them, the
+counters lag the data rows until `python -m app.counters` repairs them.
+
+Ids are made global across shards as local_id * MAX_SHARDS + shard. The
+id of a row changes when a rebalance moves it.
+
+Usage (from the backend directory):
+    python -m app.sharding status
+    python -m app.sharding rebalance [--to N] [--chunk-size N] [--settle SECONDS]
+"""
+
+import argparse
+import heapq
+import sqlite3
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+import app.database as db
+import app.metrics as metrics
+from app.encoding import unpack_address, unpack_hash
+from app.shard_layout import LAYOUT_TTL, MAX_SHARDS, pair_key, route
+
+T = TypeVar("T")
+
+# Rows copied per transaction while rebalancing
+DEFAULT_CHUNK_SIZE = 5_000
+
+Pair = Tuple[str, str]
+# (address1, address2, matched_at) of a newly recorded match
+NewMatch = Tuple[str, str, str]
+
+
+def global_id(local_id: int, shard: int) -> int:
+    """Id of a shard-local row that is unique across shards"""
+    return local_id * MAX_SHARDS + shard
+
+
+def _group(items: Iterable[T], shard_of: Callable[[T], int]) -> Dict[int, List[T]]:
+    groups: Dict[int, List[T]] = defaultdict(list)
+    for item in items:
+        groups[shard_of(item)].append(item)
+    return groups
+
+
+def _normalize(address1: str, address2: str) -> Pair:
+    addr1, addr2 = sorted([address1.lower(), address2.lower()])
+    return addr1, addr2
+
+
+def _previous_owner(key: str) -> Optional[int]:
+    """Old owner of a routing key while a rebalance is moving it, else None"""
+    owners = db.shards.owners(key)
+    return owners[1] if len(owners) > 1 else None
+
+
+def _update_home(update: Callable[[sqlite3.Connection], None]) -> None:
+    """
+    Apply the counter and version changes of a committed data-shard write
+    on shard 0, repairing the counters if that fails.
+    """
+    try:
+        with db.transaction() as conn:
+            update(conn)
+        return
+    except Exception as e:
+        print(f"Error updating counters after a sharded write: {e}; repairing counters")
+    metrics.COUNTER_REPAIRS.inc()
+    try:
+        from app.counters import repair_counters
+        repair_counters()
+    except Exception as e:
+        print(f"Error repairing counters: {e}")
+
+
+# Crushes
+
+def add_crush(
+    crusher_address: str,
+    crush_address_encrypted: bytes,
+    crush_address_hash: str,
+    crusher_address_hash: str
+) -> bool:
+    """Add a new crush submission"""
+    return add_crushes([(crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash)]) is not None
+
+
+def _claim_crushes(rows: List[Tuple[str, bytes, str, str]]) -> Set[Tuple[str, str]]:
+    """
+    Delete rows that a rebalance has not yet moved to their new owner,
+    where a write has just inserted them again.
+
+    Returns the (crusher_address, crush_address_hash) keys that already
+    existed and are therefore not new crushes.
+    """
+    moving = [row for row in rows if _previous_owner(row[3]) is not None]
+    if not moving:
+        return set()
+
+    def delete(item: Tuple[int, List[Tuple[str, bytes, str, str]]]) -> Set[Tuple[str, str]]:
+        shard, batch = item
+        existed = set()
+        with db.shards.transaction(shard) as conn:
+            for crusher, _, crush_hash, _ in batch:
+                cursor = conn.execute("""
+                    DELETE FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
+                """, (db.pack_address(crusher), db.pack_hash(crush_hash)))
+                if cursor.rowcount > 0:
+                    existed.add((crusher, crush_hash))
+        return existed
+
+    groups = _group(moving, lambda row: _previous_owner(row[3]))
+    return set().union(*db.shards.fanout(delete, groups.items()))
+
+
+def add_crushes(crushes: List[Tuple[str, bytes, str, str]]) -> Optional[int]:
+    """
+    Add many crush submissions, returning how many were new (None on failure).
+
+    Each shard's rows are written in one transaction, and shards are written
+    in parallel. A failure can leave some shards written and others not.
+    """
+    rows = [
+        (crusher.lower(), encrypted, crush_hash.lower(), crusher_hash.lower())
+        for crusher, encrypted, crush_hash, crusher_hash in crushes
+    ]
+    groups = _group(rows, lambda row: db.shards.owner(row[3]))
+
+    def write(item: Tuple[int, List[Tuple[str, bytes, str, str]]]) -> List[Tuple[str, bytes, str, str]]:
+        shard, batch = item
+        with db.shards.transaction(shard) as conn:
+            return [row for row in batch if db.upsert_crush(conn, row)]
+
+    try:
+        new_rows = [row for written in db.shards.fanout(write, groups.items()) for row in written]
+        existed = _claim_crushes(new_rows)
+        new_crushes = Counter(row[0] for row in new_rows if (row[0], row[2]) not in existed)
+    except Exception as e:
+        print(f"Error adding crushes: {e}")
+        return None
+
+    def update(conn: sqlite3.Connection) -> None:
+        db.count_crushes(conn, new_crushes)
+        db.bump_user_versions(conn, [row[0] for row in rows])
+
+    _update_home(update)
+    return sum(new_crushes.values())
+
+
+def remove_crush(wallet_address: str, crush_address_hash: str) -> bool:
+    """Delete a crush submission; False if there was none"""
+    from app.fhe_matcher import address_hash
+
+    wallet = wallet_address.lower()
+    crush_hash = crush_address_hash.lower()
+
+    def delete(shard: int) -> int:
+        with db.shards.transaction(shard) as conn:
+            return conn.execute("""
+                DELETE FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
+            """, (db.pack_address(wallet), db.pack_hash(crush_hash))).rowcount
+
+    try:
+        removed = sum(db.shards.fanout(delete, db.shards.owners(address_hash(wallet))))
+    except Exception as e:
+        print(f"Error removing crush: {e}")
+        return False
+
+    def update(conn: sqlite3.Connection) -> None:
+        db.count_crushes(conn, {wallet: -1})
+        db.bump_user_versions(conn, [wallet])
+
+    if removed:
+        _update_home(update)
+    return removed > 0
+
+
+def get_crushes_by_user(wallet_address: str) -> List[dict]:
+    """Get all crushes submitted by a user, with global ids"""
+    from app.fhe_matcher import address_hash
+
+    wallet = wallet_address.lower()
+
+    def read(shard: int) -> List[dict]:
+        with db.shards.connection(shard) as conn:
+            cursor = conn.execute("SELECT * FROM crushes WHERE crusher_address = ?", (db.pack_address(wallet),))
+            rows = [db.crush_row(row) for row in cursor.fetchall()]
+        for row in rows:
+            row["id"] = global_id(row["id"], shard)
+        return rows
+
+    # The write owner comes first, so its copy wins during a rebalance
+    crushes = {}
+    for rows in db.shards.fanout(read, db.shards.owners(address_hash(wallet))):
+        for row in rows:
+            crushes.setdefault(row["crush_address_hash"], row)
+    return list(crushes.values())
+
+
+def check_mutual_crush(address1: str, address2: str, address2_hash: str) -> bool:
+    """Check if two addresses have mutual crushes, probing both owners in parallel"""
+    from app.fhe_matcher import address_hash
+
+    address1_hash = address_hash(address1)
+    forward = [(shard, address1.lower(), address2_hash) for shard in db.shards.owners(address1_hash)]
+    reverse = [(shard, address2.lower(), address1_hash) for shard in db.shards.owners(address2_hash)]
+
+    def probe(item: Tuple[int, str, str]) -> bool:
+        shard, crusher, crush_hash = item
+        with db.shards.connection(shard) as conn:
+            cursor = conn.execute("""
+                SELECT 1 FROM crushes WHERE crusher_address = ? AND crush_address_hash = ?
+            """, (db.pack_address(crusher), db.pack_hash(crush_hash)))
+            return cursor.fetchone() is not None
+
+    found = db.shards.fanout(probe, forward + reverse)
+    return any(found[:len(forward)]) and any(found[len(forward):])
+
+
+def find_mutual_crushes(edges: List[Tuple[str, str, str]]) -> List[Pair]:
+    """find_mutual_crushes, probing the reverse edges on their owning shards in parallel"""
+    from app.fhe_matcher import address_hash
+
+    rows = list({
+        (crusher.lower(), crush.lower(), crusher_hash.lower())
+        for crusher, crush, crusher_hash in edges
+    })
+
+    # The reverse edge is the crush's own row, owned by the crush's address hash
+    groups: Dict[int, List[Tuple[str, str, str]]] = defaultdict(list)
+    for row in rows:
+        for shard in db.shards.owners(address_hash(row[1])):
+            groups[shard].append(row)
+
+    def probe(item: Tuple[int, List[Tuple[str, str, str]]]) -> List[Pair]:
+        shard, batch = item
+        with db.shards.connection(shard) as conn:
+            return db.mutual_crushes(conn, batch)
+
+    found = db.shards.fanout(probe, groups.items())
+    return list(dict.fromkeys(pair for pairs in found for pair in pairs))
+
+
+# Matches
+
+def _existing_on_previous_owner(pairs: List[Pair]) -> Set[Pair]:
+    """Pairs a rebalance has not moved yet, which already exist on their old owner"""
+    moving = [pair for pair in pairs if _previous_owner(pair_key(*pair)) is not None]
+    if not moving:
+        return set()
+
+    def probe(item: Tuple[int, List[Pair]]) -> Set[Pair]:
+        shard, batch = item
+        with db.shards.connection(shard) as conn:
+            return {
+                pair for pair in batch
+                if conn.execute("""
+                    SELECT 1 FROM matches WHERE user1_address = ? AND user2_address = ?
+                """, (db.pack_address(pair[0]), db.pack_address(pair[1]))).fetchone() is not None
+            }
+
+    groups = _group(moving, lambda pair: _previous_owner(pair_key(*pair)))
+    return set().union(*db.shards.fanout(probe, groups.items()))
+
+
+def add_match(address1: str, address2: str) -> Optional[str]:
+    """Record a match between two users, returning its stored matched_at (None if it already existed)"""
+    inserted = add_matches([(address1, address2)])
+    return inserted[0][2] if inserted else None
+
+
+def add_matches(pairs: List[Pair]) -> List[NewMatch]:
+    """Record many matches, one transaction per shard, returning the new ones"""
+    try:
+        return insert_matches(pairs)
+    except Exception as e:
+        print(f"Error adding matches: {e}")
+        return []
+
+
+def insert_matches(pairs: List[Pair]) -> List[NewMatch]:
+    """add_matches that raises on failure instead of returning no pairs"""
+    normalized = sorted({_normalize(a, b) for a, b in pairs})
+
+    def insert(item: Tuple[int, List[Pair]]) -> List[NewMatch]:
+        shard, batch = item
+        inserted = []
+        with db.shards.transaction(shard) as conn:
+            for pair in batch:
+                for row in conn.execute("""
+                    INSERT OR IGNORE INTO matches (user1_address, user2_address)
+                    VALUES (?, ?)
+                    RETURNING matched_at
+                """, (db.pack_address(pair[0]), db.pack_address(pair[1]))).fetchall():
+                    inserted.append((*pair, row[0]))
+        return inserted
+
+    existing = _existing_on_previous_owner(normalized)
+    pending = [pair for pair in normalized if pair not in existing]
+    groups = _group(pending, lambda pair: db.shards.owner(pair_key(*pair)))
+    inserted = sorted(pair for batch in db.shards.fanout(insert, groups.items()) for pair in batch)
+
+    pairs_created = [(address1, address2) for address1, address2, _ in inserted]
+    _update_home(lambda conn: db.record_new_matches(conn, pairs_created))
+    return inserted
+
+
+def get_match_proof(address1: str, address2: str) -> Optional[str]:
+    """Proof already issued for a match, if any"""
+    pair = _normalize(address1, address2)
+
+    def read(shard: int) -> Optional[str]:
+        with db.shards.connection(shard) as conn:
+            row = conn.execute("""
+                SELECT proof FROM matches WHERE user1_address = ? AND user2_address = ?
+            """, (db.pack_address(pair[0]), db.pack_address(pair[1]))).fetchone()
+            return row['proof'] if row else None
+
+    proofs = db.shards.fanout(read, db.shards.owners(pair_key(*pair)))
+    return next((proof for proof in proofs if proof), None)
+
+
+def set_match_proof(address1: str, address2: str, proof: str) -> bool:
+    """Remember the proof issued for a match; False if there is no match row"""
+    pair = _normalize(address1, address2)
+
+    def write(shard: int) -> int:
+        with db.shards.transaction(shard) as conn:
+            return conn.execute("""
+                UPDATE matches SET proof = ? WHERE user1_address = ? AND user2_address = ?
+            """, (proof, db.pack_address(pair[0]), db.pack_address(pair[1]))).rowcount
+
+    try:
+        return sum(db.shards.fanout(write, db.shards.owners(pair_key(*pair)))) > 0
+    except Exception as e:
+        print(f"Error saving match proof: {e}")
+        return False
+
+
+def get_matches_for_user(wallet_address: str) -> List[str]:
+    """Get all matches for a user (matches are spread over every shard)"""
+    def read(shard: int) -> List[str]:
+        with db.shards.connection(shard) as conn:
+            return db.matches_for_user(conn, wallet_address)
+
+    found = db.shards.fanout(read, db.shards.all())
+    return list(dict.fromkeys(address for addresses in found for address in addresses))
+
+
+def get_matches_page(
+    wallet_address: str,
+    limit: int,
+    after: Optional[Tuple[str, int]] = None
+) -> List[Tuple[str, int, str]]:
+    """
+    One page of a wallet's matches in (matched_at, global id) order.
+
+    Every shard returns up to `limit` rows after the cursor and the sorted
+    streams are merged.
+    """
+    matched_at, after_id = after or ("", 0)
+
+    def read(shard: int) -> List[Tuple[str, int, str]]:
+        # Largest local id whose global id is <= after_id
+        local_after = (matched_at, (after_id - shard) // MAX_SHARDS)
+        with db.shards.connection(shard) as conn:
+            rows = db.matches_page(conn, wallet_address, limit, local_after)
+        return [(at, global_id(local_id, shard), other) for at, local_id, other in rows]
+
+    page = []
+    seen = set()
+    for row in heapq.merge(*db.shards.fanout(read, db.shards.all())):
+        # A pair can briefly exist on two shards while a rebalance moves it
+        if row[2] in seen:
+            continue
+        seen.add(row[2])
+        page.append(row)
+        if len(page) == limit:
+            break
+    return page
+
+
+# Rebalancing
+
+# Columns copied when a row moves, and the routing key of a row (rows are
+# copied as stored, in either storage format)
+MOVABLE_TABLES = {
+    "crushes": (
+        ("crusher_address", "crush_address_encrypted", "crush_address_hash", "crusher_address_hash", "created_at"),
+        lambda row: unpack_hash(row["crusher_address_hash"]),
+    ),
+    "matches": (
+        ("user1_address", "user2_address", "matched_at", "proof"),
+        lambda row: pair_key(unpack_address(row["user1_address"]), unpack_address(row["user2_address"])),
+    ),
+}
+
+
+def _move_rows(table: str, shard: int, shard_count: int, chunk_size: int) -> int:
+    """Move the rows of one table that `shard` no longer owns to their owners"""
+    columns, key_of = MOVABLE_TABLES[table]
+    column_list = ", ".join(columns)
+    placeholders = ", ".join("?" * len(columns))
+
+    moved = 0
+    last_id = 0
+    while True:
+        with db.shards.connection(shard) as conn:
+            rows = conn.execute(f"""
+                SELECT id, {column_list} FROM {table} WHERE id > ? ORDER BY id LIMIT ?
+            """, (last_id, chunk_size)).fetchall()
+        if not rows:
+            return moved
+        last_id = rows[-1]["id"]
+
+        leaving = [row for row in rows if route(key_of(row), shard_count) != shard]
+        for destination, batch in _group(leaving, lambda row: route(key_of(row), shard_count)).items():
+            # Copy first: a row written to its new owner since then wins
+            with db.shards.transaction(destination) as conn:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({column_list}) VALUES ({placeholders})",
+                    [tuple(row[column] for column in columns) for row in batch]
+                )
+            with db.shards.transaction(shard) as conn:
+                conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(row["id"],) for row in batch])
+            moved += len(batch)
+
+
+def rebalance(
+    target: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    settle: Optional[float] = None,
+    progress: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    Change the shard count (default: double it) while the app keeps serving.
+
+    The new layout is published first, so writes go to the new owners and
+    reads check both owners. After `settle` seconds (default two layout
+    TTLs), when every worker has the new layout, rows are moved off
+    shards that no longer own them, and then the rebalance is marked done.
+    Re-running after an interruption resumes the pending rebalance.
+    """
+    shards = db.shards
+    count, previous = shards.layout(force=True)
+
+    if previous is None:
+        target = target or count * 2
+        if target == count:
+            return {"shard_count": count, "previous_count": count, "moved_crushes": 0, "moved_matches": 0}
+        shards.set_layout(target, previous_count=count)
+        previous = count
+        time.sleep(2 * LAYOUT_TTL if settle is None else settle)
+    elif target not in (None, count):
+        raise ValueError(f"A rebalance from {previous} to {count} shards is already in progress")
+    else:
+        target = count
+
+    for shard in range(max(target, previous)):
+        shards.pool(shard)
+
+    moved = {"crushes": 0, "matches": 0}
+    # The second pass picks up rows written by workers that were slow to
+    # see the new layout
+    for sweep in (1, 2):
+        for shard in range(max(target, previous)):
+            for table in MOVABLE_TABLES:
+                count_moved = _move_rows(table, shard, target, chunk_size)
+                moved[table] += count_moved
+                if progress and count_moved:
+                    progress(f"pass {sweep}: moved {count_moved} {table} off shard {shard}")
+
+    shards.set_layout(target)
+
+    # Writes racing with the move may have counted a row twice
+    from app.counters import repair_counters
+    repaired = repair_counters()
+
+    return {
+        "shard_count": target,
+        "previous_count": previous,
+        "moved_crushes": moved["crushes"],
+        "moved_matches": moved["matches"],
+        "counters_repaired": repaired["repaired"],
+    }
+
+
+def status() -> dict:
+    """Layout and row counts of every shard"""
+    shards = db.shards
+    count, previous = shards.layout(force=True)
+
+    def counts(shard: int) -> dict:
+        with shards.connection(shard) as conn:
+            return {
+                "shard": shard,
+                "path": shards.path(shard),
+                "crushes": conn.execute("SELECT COUNT(*) FROM crushes").fetchone()[0],
+                "matches": conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0],
+            }
+
+    return {
+        "shard_count": count,
+        "previous_count": previous,
+        "shards": shards.fanout(counts, shards.all()),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect or rebalance the sharded crush database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show the layout and rows per shard")
+    rebalance_parser = commands.add_parser("rebalance", help="change the shard count online")
+    rebalance_parser.add_argument("--to", type=int, default=None,
+                                  help="new shard count (default: double the current one)")
+    rebalance_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                                  help="rows copied per transaction")
+    rebalance_parser.add_argument("--settle", type=float, default=None,
+                                  help="seconds to wait for workers to pick up the new layout")
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        result = status()
+        in_progress = f" (rebalancing from {result['previous_count']})" if result["previous_count"] else ""
+        print(f"{result['shard_count']} shards{in_progress}")
+        for shard in result["shards"]:
+            print(f"  shard {shard['shard']}: {shard['crushes']} crushes, {shard['matches']} matches ({shard['path']})")
+        return
+
+    started = time.perf_counter()
+    result = rebalance(args.to, chunk_size=args.chunk_size, settle=args.settle, progress=print)
+    print(
+        f"Rebalanced {result['previous_count']} -> {result['shard_count']} shards: "
+        f"moved {result['moved_crushes']} crushes and {result['moved_matches']} matches, "
+        f"repaired {result.get('counters_repaired', 0)} counters "
+        f"({time.perf_counter() - started:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Storage engines for crushes, matches and users.
+
+The API layer (app.async_database, the compatibility index) talks to the
+engine selected by CRUSH_STORAGE_BACKEND rather than to app.database
+directly:
+
+- `sqlite` (default): app.database, with its connection pools, shards,
+  migrations and maintenance jobs. app.database is only imported when
+  this engine is created, so the other engines never open a SQLite file.
+- `memory`: app.memory_storage. The graph is kept in memory as adjacency
+  sets and persisted with a periodic snapshot plus an append-only log.
+  It is meant for high-throughput deployments that fit in RAM, and for
+  tests and benchmarks.
+
+A new backend subclasses StorageEngine and is added to create_storage.
+"""
+
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+# Which storage engine to use (see create_storage)
+STORAGE_BACKEND = os.environ.get("CRUSH_STORAGE_BACKEND", "sqlite")
+
+# Crushes scanned per chunk by the mutual-match reconciliation job
+RECONCILE_CHUNK_SIZE = 50_000
+
+Pair = Tuple[str, str]
+# (address1, address2, matched_at) of a newly recorded match
+NewMatch = Tuple[str, str, str]
+
+
+class StorageEngine(ABC):
+    """
+    Interface of a storage backend.
+
+    Methods block and are thread-safe; async handlers reach them through
+    app.async_database. Addresses are accepted in any case and returned
+    lowercased, and matched pairs are returned with the smaller address
+    first.
+    """
+
+    name: str = ""
+
+    # Users
+
+    @abstractmethod
+    def register_user(self, wallet_address: str, nickname: Optional[str] = None) -> bool:
+        """Register or update a user"""
+
+    @abstractmethod
+    def get_users_after(self, rowid: int, limit: int) -> List[Tuple[int, str]]:
+        """Registered wallets in insertion order, as (rowid, wallet_address) pairs after `rowid`"""
+
+    @abstractmethod
+    def get_user_version(self, wallet_address: str) -> int:
+        """Current data version of a wallet (0 if its data never changed)"""
+
+    @abstractmethod
+    def get_user_stats(self, wallet_address: str, include_matches: bool = False) -> dict:
+        """Crushes sent, matches count, last match time and the matched addresses (None unless include_matches)"""
+
+    # Crushes
+
+    @abstractmethod
+    def add_crush(
+        self,
+        crusher_address: str,
+        crush_address_encrypted: bytes,
+        crush_address_hash: str,
+        crusher_address_hash: Optional[str] = None
+    ) -> bool:
+        """Add a new crush submission"""
+
+    @abstractmethod
+    def add_crushes(self, crushes: List[Tuple[str, bytes, str, str]]) -> Optional[int]:
+        """Add many (crusher, encrypted, crush_hash, crusher_hash) submissions, returning how many were new (None on failure)"""
+
+    @abstractmethod
+    def remove_crush(self, wallet_address: str, crush_address_hash: str) -> bool:
+        """Delete a crush submission; False if there was none"""
+
+    @abstractmethod
+    def get_crushes_by_user(self, wallet_address: str) -> List[dict]:
+        """Get all crushes submitted by a user"""
+
+    @abstractmethod
+    def check_mutual_crush(self, address1: str, address2: str) -> bool:
+        """Check if two addresses have mutual crushes"""
+
+    @abstractmethod
+    def find_mutual_crushes(self, edges: List[Tuple[str, str, str]]) -> List[Pair]:
+        """The (crusher, crush) pairs among stored (crusher, crush, crusher_hash) edges that are returned"""
+
+    # Matches
+
+    @abstractmethod
+    def add_match(self, address1: str, address2: str) -> Optional[str]:
+        """Record a match, returning its stored matched_at (None if it already existed)"""
+
+    @abstractmethod
+    def add_matches(self, pairs: List[Pair]) -> List[NewMatch]:
+        """Record many matches, returning the new ones as (address1, address2, matched_at)"""
+
+    @abstractmethod
+    def get_match_proof(self, address1: str, address2: str) -> Optional[str]:
+        """Proof already issued for a match, if any"""
+
+    @abstractmethod
+    def set_match_proof(self, address1: str, address2: str, proof: str) -> bool:
+        """Remember the proof issued for a match; False if there is no match"""
+
+    @abstractmethod
+    def get_matches_for_user(self, wallet_address: str) -> List[str]:
+        """Get all matches for a user"""
+
+    @abstractmethod
+    def get_matches_page(
+        self,
+        wallet_address: str,
+        limit: int,
+        after: Optional[Tuple[str, int]] = None
+    ) -> List[Tuple[str, int, str]]:
+        """(matched_at, id, matched_address) rows after the `after` key, in key order"""
+
+    # Maintenance
+
+    @abstractmethod
+    def start_reconciliation(self, chunk_size: int, restart: bool = False) -> bool:
+        """Start recording missed mutual matches; False if a run is already in progress"""
+
+    @abstractmethod
+    def get_reconciliation_status(self) -> dict:
+        """State of the last (or current) reconciliation run"""
+
+    @abstractmethod
+    def repair_counters(self) -> dict:
+        """Recompute per-wallet counters, returning {"wallets", "repaired"}"""
+
+    def metrics(self) -> dict:
+        """Backend-specific sizes and timings"""
+        return {"backend": self.name}
+
+    def close(self) -> None:
+        """Flush and release resources on shutdown"""
+
+
+class SQLiteStorage(StorageEngine):
+    """The app.database functions behind the StorageEngine interface"""
+
+    name = "sqlite"
+
+    def __init__(self):
+        import app.database as db
+        self.db = db
+
+    def register_user(self, wallet_address, nickname=None):
+        return self.db.register_user(wallet_address, nickname)
+
+    def get_users_after(self, rowid, limit):
+        return self.db.get_users_after(rowid, limit)
+
+    def get_user_version(self, wallet_address):
+        return self.db.get_user_version(wallet_address)
+
+    def get_user_stats(self, wallet_address, include_matches=False):
+        return self.db.get_user_stats(wallet_address, include_matches)
+
+    def add_crush(self, crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash=None):
+        return self.db.add_crush(crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash)
+
+    def add_crushes(self, crushes):
+        return self.db.add_crushes(crushes)
+
+    def remove_crush(self, wallet_address, crush_address_hash):
+        return self.db.remove_crush(wallet_address, crush_address_hash)
+
+    def get_crushes_by_user(self, wallet_address):
+        return self.db.get_crushes_by_user(wallet_address)
+
+    def check_mutual_crush(self, address1, address2):
+        return self.db.check_mutual_crush(address1, address2)
+
+    def find_mutual_crushes(self, edges):
+        return self.db.find_mutual_crushes(edges)
+
+    def add_match(self, address1, address2):
+        return self.db.add_match(address1, address2)
+
+    def add_matches(self, pairs):
+        return self.db.add_matches(pairs)
+
+    def get_match_proof(self, address1, address2):
+        return self.db.get_match_proof(address1, address2)
+
+    def set_match_proof(self, address1, address2, proof):
+        return self.db.set_match_proof(address1, address2, proof)
+
+    def get_matches_for_user(self, wallet_address):
+        return self.db.get_matches_for_user(wallet_address)
+
+    def get_matches_page(self, wallet_address, limit, after=None):
+        return self.db.get_matches_page(wallet_address, limit, after)
+
+    def start_reconciliation(self, chunk_size, restart=False):
+        from app.reconcile import start_background
+        return start_background(chunk_size=chunk_size, restart=restart)
+
+    def get_reconciliation_status(self):
+        from app.reconcile import get_status
+        return get_status()
+
+    def repair_counters(self):
+        from app.counters import repair_counters
+        return repair_counters()
+
+    def metrics(self):
+        return {"backend": self.name, "path": self.db.DATABASE_PATH}
+
+    def close(self):
+        self.db.close_db()
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> StorageEngine:
+    """Instantiate a storage engine by name"""
+    if name == SQLiteStorage.name:
+        return SQLiteStorage()
+    if name == "memory":
+        from app.memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {name!r} (available: sqlite, memory)")
+
+
+# Global storage engine
+storage = create_storage()
@@ -0,0 +1,180 @@
+"""
+Group-commit write pipeline.
+
+Every add_crush / add_match / register_user call normally runs in its own
+transaction. SQLite has one writer at a time and syncs on every commit, so
+submit throughput is capped by commit cost, and concurrent writers hit
+busy-lock errors.
+
+With CRUSH_WRITE_PIPELINE=1 those writes are queued to a single writer
+thread instead. It collects operations for up to CRUSH_WRITE_BATCH_WINDOW_MS
+(or CRUSH_WRITE_MAX_BATCH operations) and applies them in one transaction.
+Each operation runs under its own savepoint, so a failing one is rolled
+back and reported as False without affecting the rest of the batch.
+Callers are resolved only after the commit, so anything read after
+awaiting a write (e.g. check_for_matches) sees it.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+# Route writes through the pipeline (off by default)
+ENABLED = os.environ.get("CRUSH_WRITE_PIPELINE", "0").lower() in ("1", "true", "yes")
+
+# Longest time an operation waits for others to join its batch, and the batch size cap
+BATCH_WINDOW = float(os.environ.get("CRUSH_WRITE_BATCH_WINDOW_MS", "2")) / 1000
+MAX_BATCH_SIZE = int(os.environ.get("CRUSH_WRITE_MAX_BATCH", "256"))
+
+WriteOp = Tuple[str, Callable[..., Any], tuple, Future]
+
+
+class WritePipeline:
+    """Single writer thread that commits queued writes in batches"""
+
+    def __init__(
+        self,
+        enabled: bool = ENABLED,
+        batch_window: float = BATCH_WINDOW,
+        max_batch_size: int = MAX_BATCH_SIZE
+    ):
+        self.enabled = enabled
+        self.batch_window = batch_window
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._queue: "queue.Queue[Optional[WriteOp]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._batches = 0
+        self._operations = 0
+        self._failed = 0
+        self._max_batch_seen = 0
+        self._commit_time_total = 0.0
+        self._max_commit_time = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="crush-writer", daemon=True)
+                    self._thread.start()
+
+    async def submit(self, name: str, fn: Callable[..., Any], *args) -> Any:
+        """Queue `fn(conn, *args)` for the next batch and await its result"""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((name, fn, args, future))
+        return await asyncio.wrap_future(future)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                try:
+                    # Take whatever is already queued, then wait out the window
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[WriteOp]) -> None:
+        import app.database as db
+        started = time.perf_counter()
+        results = []
+        failed = 0
+        try:
+            with db.transaction() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for name, fn, args, _ in batch:
+                    conn.execute("SAVEPOINT batched_write")
+                    try:
+                        results.append(fn(conn, *args))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO batched_write")
+                        print(f"Error in batched {name}: {e}")
+                        results.append(False)
+                        failed += 1
+                    conn.execute("RELEASE batched_write")
+        except Exception as e:
+            print(f"Error committing write batch: {e}")
+            results = [False] * len(batch)
+            failed = len(batch)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._batches += 1
+            self._operations += len(batch)
+            self._failed += failed
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._commit_time_total += elapsed
+            self._max_commit_time = max(self._max_commit_time, elapsed)
+
+        for (_, _, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    async def add_crush(
+        self,
+        crusher_address: str,
+        crush_address_encrypted: bytes,
+        crush_address_hash: str,
+        crusher_address_hash: str
+    ) -> bool:
+        import app.database as db
+        return await self.submit(
+            "add_crush", db.insert_crush,
+            crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash
+        )
+
+    async def add_match(self, address1: str, address2: str) -> Optional[str]:
+        import app.database as db
+        return await self.submit("add_match", db.insert_match, address1, address2)
+
+    async def register_user(self, wallet_address: str, nickname: Optional[str] = None) -> bool:
+        import app.database as db
+        return await self.submit("register_user", db.upsert_user, wallet_address, nickname)
+
+    def metrics(self) -> dict:
+        """Batch sizes and commit latency"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "operations": self._operations,
+                "failed": self._failed,
+                "avg_batch_size": (self._operations / self._batches) if self._batches else 0.0,
+                "max_batch_size": self._max_batch_seen,
+                "avg_commit_ms": (self._commit_time_total / self._batches * 1000) if self._batches else 0.0,
+                "max_commit_ms": self._max_commit_time * 1000,
+            }
+
+    def close(self) -> None:
+        """Commit what is queued and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+# Global pipeline instance
+write_pipeline = WritePipeline()
@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for the backend (run from the backend directory).
+"""
@@ -0,0 +1,138 @@
+"""
+Cold-start benchmark: import time and first-request latency.
+
+Each run starts a fresh interpreter against a new, empty database, imports
+app.main and sends its first requests in-process through httpx's ASGI
+transport. Lifespan hooks are not run, as on a serverless platform where
+the first request arrives right after the import. Three timings are
+recorded per run:
+
+- import_ms: `import app.main`
+- first_health_ms: the first GET /api/health (no database access)
+- first_db_ms: the first GET /api/stats/{wallet} (includes migrations
+  with CRUSH_LAZY_INIT=1)
+
+The medians over all runs are printed as JSON. With --baseline, they are
+compared to a previous --output file and the exit status is 1 if any
+median regressed by more than --tolerance.
+
+Usage (from the backend directory):
+    python -m benchmarks.cold_start [--runs N] [--lazy] [--output FILE]
+    python -m benchmarks.cold_start --baseline FILE [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+METRICS = ("import_ms", "first_health_ms", "first_db_ms")
+
+# Runs in each child interpreter; prints one JSON object of timings
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+import httpx
+
+async def first_requests():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        times = []
+        for path in ("/api/health", "/api/stats/0x" + "ab" * 20):
+            t = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            times.append(time.perf_counter() - t)
+        return times
+
+health, stats = asyncio.run(first_requests())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_health_ms": health * 1000,
+    "first_db_ms": stats * 1000,
+}))
+"""
+
+
+def run_once(lazy: bool) -> Dict[str, float]:
+    """Timings of one fresh interpreter against a new database"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, CRUSH_DB_PATH=os.path.join(tmp, "crushes.db"))
+        if lazy:
+            env["CRUSH_LAZY_INIT"] = "1"
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=env,
+            check=True, capture_output=True, text=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(runs: int, lazy: bool) -> dict:
+    """Median, min and max of each timing over `runs` cold starts"""
+    samples: Dict[str, List[float]] = {metric: [] for metric in METRICS}
+    for _ in range(runs):
+        for metric, value in run_once(lazy).items():
+            samples[metric].append(value)
+
+    return {
+        "runs": runs,
+        "lazy_init": lazy,
+        "python": sys.version.split()[0],
+        "metrics": {
+            metric: {
+                "median": round(statistics.median(values), 2),
+                "min": round(min(values), 2),
+                "max": round(max(values), 2),
+            }
+            for metric, values in samples.items()
+        },
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Metrics whose median is more than `tolerance` above the baseline's"""
+    regressions = []
+    for metric in METRICS:
+        before = baseline["metrics"].get(metric, {}).get("median")
+        after = result["metrics"][metric]["median"]
+        if before and after > before * (1 + tolerance):
+            regressions.append(f"{metric}: {before:.1f} ms -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Measure import time and first-request latency")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to measure")
+    parser.add_argument("--lazy", action="store_true", help="set CRUSH_LAZY_INIT=1 in the measured app")
+    parser.add_argument("--output", help="write the result to this JSON file")
+    parser.add_argument("--baseline", help="compare to a result written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown over the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.runs, args.lazy)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Synthetic users, crushes and matches for the benchmarks.
+
+Fills the configured storage engine (CRUSH_STORAGE_BACKEND, CRUSH_DB_PATH
+or CRUSH_MEMORY_PATH) through its bulk write methods, so counters,
+versions, shards and the storage format are kept as in production.
+
+Users live on a ring. Each user sends `crushes_per_user` crushes to
+distinct users less than half the ring ahead of them, so no two of them
+are mutual. Each of those crushes is then returned with a probability
+chosen so that a `reciprocity` fraction of all crushes is mutual; every
+returned pair is recorded as a match. The data only depends on the
+seed.
+
+Sizes count crushes: 10k, 1m, 10m (the sizes of SIZES) or any number.
+
+Usage (from the backend directory):
+    CRUSH_DB_PATH=/tmp/bench.db python -m benchmarks.datagen --size 1m
+        [--crushes-per-user 10] [--reciprocity 0.1] [--seed 1]
+"""
+
+import argparse
+import hashlib
+import math
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+# Rows written per storage call
+BATCH_SIZE = 10_000
+
+
+def parse_size(value: str) -> int:
+    """Crush count of a size such as 10k, 1m or 250000"""
+    value = value.lower().replace("_", "")
+    if value[-1:] in SUFFIXES:
+        return int(float(value[:-1]) * SUFFIXES[value[-1]])
+    return int(value)
+
+
+def wallet(seed: int, user: int) -> str:
+    """Deterministic wallet address of a synthetic user"""
+    return "0x" + hashlib.blake2b(f"{seed}:{user}".encode(), digest_size=20).hexdigest()
+
+
+def plan(crushes: int, crushes_per_user: int, reciprocity: float) -> Tuple[int, float]:
+    """(users, probability that a crush is returned) for a target crush count"""
+    if not 0 <= reciprocity < 1:
+        raise ValueError("Reciprocity must be in [0, 1)")
+    # A returned crush adds one crush and makes two mutual
+    returned = reciprocity / (2 - reciprocity)
+    users = math.ceil(crushes / (crushes_per_user * (1 + returned)))
+    # Targets are drawn from the users less than half the ring ahead
+    return max(users, 2 * crushes_per_user + 2), returned
+
+
+def generate(
+    size: int,
+    crushes_per_user: int = 10,
+    reciprocity: float = 0.1,
+    seed: int = 1,
+    progress: Optional[Callable[[str], None]] = None
+) -> dict:
+    """Write the synthetic dataset, returning the row counts"""
+    from app.fhe_matcher import encrypt_crush
+    from app.storage import storage
+
+    users, returned = plan(size, crushes_per_user, reciprocity)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    wallets: List[str] = []
+    encrypted: List[Tuple[bytes, str]] = []
+    for user in range(users):
+        wallets.append(wallet(seed, user))
+        encrypted.append(encrypt_crush(wallets[-1]))
+    for first in range(0, users, BATCH_SIZE):
+        _register_users(storage, wallets[first:first + BATCH_SIZE])
+    if progress:
+        progress(f"registered {users} users")
+
+    crushes: List[Tuple[str, bytes, str, str]] = []
+    matches: List[Tuple[str, str]] = []
+    written = {"users": users, "crushes": 0, "matches": 0}
+    batches = 0
+
+    def edge(crusher: int, crush: int) -> Tuple[str, bytes, str, str]:
+        return (wallets[crusher], encrypted[crush][0], encrypted[crush][1], encrypted[crusher][1])
+
+    def flush() -> None:
+        inserted = storage.add_crushes(crushes)
+        if inserted is None:
+            raise RuntimeError("Writing crushes failed")
+        written["crushes"] += inserted
+        written["matches"] += len(storage.add_matches(matches))
+        crushes.clear()
+        matches.clear()
+
+    half = (users - 1) // 2
+    for user in range(users):
+        for offset in rng.sample(range(1, half + 1), crushes_per_user):
+            crush = (user + offset) % users
+            crushes.append(edge(user, crush))
+            # The reverse is more than half the ring ahead of the crush, so
+            # it never repeats one of the crush's own crushes
+            if rng.random() < returned:
+                crushes.append(edge(crush, user))
+                matches.append((wallets[user], wallets[crush]))
+        if len(crushes) >= BATCH_SIZE:
+            flush()
+            batches += 1
+            if progress and batches % 10 == 0:
+                rate = written["crushes"] / (time.perf_counter() - started)
+                progress(f"wrote {written['crushes']} crushes, {written['matches']} matches ({rate:.0f} crushes/s)")
+    flush()
+
+    written["seconds"] = round(time.perf_counter() - started, 1)
+    return written
+
+
+def _register_users(storage, wallets: List[str]) -> None:
+    if storage.name == "sqlite":
+        # One transaction per batch instead of one per user
+        import app.database as db
+        with db.transaction() as conn:
+            for address in wallets:
+                db.upsert_user(conn, address)
+        return
+    for address in wallets:
+        storage.register_user(address)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Fill the crush database with synthetic data")
+    parser.add_argument("--size", default="10k", help="crushes to write: " + ", ".join(SIZES) + " or any number")
+    parser.add_argument("--crushes-per-user", type=int, default=10, help="crushes each user sends before returns")
+    parser.add_argument("--reciprocity", type=float, default=0.1, help="fraction of crushes that are mutual")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    result = generate(parse_size(args.size), args.crushes_per_user, args.reciprocity, args.seed, progress=print)
+
+    from app.storage import storage
+    storage.close()
+    print(f"Wrote {result['users']} users, {result['crushes']} crushes and {result['matches']} matches "
+          f"({result['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Latency and throughput benchmarks.
+
+Runs against the data already in the configured storage engine (fill it
+with benchmarks.datagen first). Wallets and pairs are sampled from the
+stored users and matches, so about half of the pair lookups hit a match.
+
+- Functions (`encrypt_address`, `calculate_compatibility`,
+  `check_mutual_crush`, `get_user_stats`) are called back to back on one
+  thread.
+- HTTP endpoints (`http_*`) are driven in-process through httpx's ASGI
+  transport, with the app's lifespan running and `--concurrency`
+  requests in flight. `http_submit` writes crushes between sampled users,
+  so regenerate the data between runs that are compared (or leave it
+  out with --only).
+
+Each benchmark reports p50/p99 latency and throughput. The result is
+printed as JSON (and written with --output). With --compare, it is
+checked against a saved result and the exit status is 1 if any p99 grew,
+or any throughput dropped, by more than --tolerance.
+
+Usage (from the backend directory):
+    CRUSH_DB_PATH=/tmp/bench.db python -m benchmarks.suite [--iterations N]
+        [--concurrency C] [--only NAME,...] [--output FILE]
+    CRUSH_DB_PATH=/tmp/bench.db python -m benchmarks.suite --compare FILE [--tolerance 0.2]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Wallets sampled from storage for the benchmarks
+SAMPLE_USERS = 1000
+
+Pair = Tuple[str, str]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """p50/p99/mean latency in ms and throughput in operations per second"""
+    latencies = sorted(latencies)
+    return {
+        "ops": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+    }
+
+
+class Samples:
+    """Wallets and address pairs drawn from the stored data"""
+
+    def __init__(self, storage, seed: int):
+        rng = random.Random(seed)
+        self.wallets = [address for _, address in storage.get_users_after(0, SAMPLE_USERS)]
+        if len(self.wallets) < 2:
+            raise RuntimeError("No data to benchmark: fill the database with `python -m benchmarks.datagen` first")
+
+        matched = [(wallet, other) for wallet in self.wallets for other in storage.get_matches_for_user(wallet)]
+        unmatched = [tuple(rng.sample(self.wallets, 2)) for _ in range(max(len(matched), SAMPLE_USERS))]
+        # Matched and (almost always) unmatched pairs, alternating
+        self.pairs: List[Pair] = [
+            pair for both in zip(matched or unmatched, unmatched) for pair in both
+        ]
+
+    def wallet(self, i: int) -> str:
+        return self.wallets[i % len(self.wallets)]
+
+    def pair(self, i: int) -> Pair:
+        return self.pairs[i % len(self.pairs)]
+
+
+def bench_function(fn: Callable[[int], object], iterations: int, warmup: int) -> dict:
+    """Call fn(i) back to back"""
+    for i in range(warmup):
+        fn(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def bench_requests(
+    send: Callable[[int], Awaitable[object]],
+    iterations: int,
+    warmup: int,
+    concurrency: int
+) -> dict:
+    """Await send(i) for every i with `concurrency` requests in flight"""
+    for i in range(warmup):
+        await send(i)
+
+    latencies: List[float] = []
+    pending = iter(range(iterations))
+
+    async def worker() -> None:
+        for i in pending:
+            t = time.perf_counter()
+            await send(i)
+            latencies.append(time.perf_counter() - t)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def function_benchmarks(samples: Samples) -> Dict[str, Callable[[int], object]]:
+    from app.compatibility import calculate_compatibility
+    from app.fhe_matcher import fhe_matcher
+    from app.storage import storage
+
+    return {
+        "encrypt_address": lambda i: fhe_matcher.encrypt_address(samples.wallet(i)),
+        "calculate_compatibility": lambda i: calculate_compatibility(*samples.pair(i)),
+        "check_mutual_crush": lambda i: storage.check_mutual_crush(*samples.pair(i)),
+        "get_user_stats": lambda i: storage.get_user_stats(samples.wallet(i)),
+    }
+
+
+def http_benchmarks(samples: Samples, client) -> Dict[str, Callable[[int], Awaitable[object]]]:
+    async def get(path: str, params: dict = None):
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+
+    async def submit(i: int):
+        crusher, crush = samples.pair(i)
+        response = await client.post("/api/crush/submit", json={"crusher_address": crusher, "crush_address": crush})
+        response.raise_for_status()
+
+    def pair_params(i: int) -> dict:
+        address1, address2 = samples.pair(i)
+        return {"address1": address1, "address2": address2}
+
+    return {
+        "http_health": lambda i: get("/api/health"),
+        "http_stats": lambda i: get(f"/api/stats/{samples.wallet(i)}"),
+        "http_matches": lambda i: get(f"/api/matches/{samples.wallet(i)}"),
+        "http_check_match": lambda i: get("/api/check-match", pair_params(i)),
+        "http_compatibility": lambda i: get("/api/compatibility", pair_params(i)),
+        "http_submit": submit,
+    }
+
+
+async def run(
+    iterations: int = 1000,
+    warmup: int = 50,
+    concurrency: int = 8,
+    only: Optional[List[str]] = None,
+    seed: int = 1
+) -> dict:
+    """Run the selected benchmarks, returning the JSON report"""
+    import httpx
+    from app.main import app
+    from app.storage import storage
+
+    samples = Samples(storage, seed)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    functions = function_benchmarks(samples)
+    requests = http_benchmarks(samples, client)
+    unknown = set(only or []) - set(functions) - set(requests)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {', '.join(sorted(unknown))} "
+                         f"(available: {', '.join([*functions, *requests])})")
+
+    # Counted first: http_submit adds crushes
+    report = {
+        "dataset": dataset(storage),
+        "config": {"iterations": iterations, "warmup": warmup, "concurrency": concurrency, "seed": seed},
+        "python": sys.version.split()[0],
+        "results": {},
+    }
+    results = report["results"]
+
+    for name, fn in functions.items():
+        if only is None or name in only:
+            results[name] = bench_function(fn, iterations, warmup)
+
+    async with app.router.lifespan_context(app), client:
+        for name, send in requests.items():
+            if only is None or name in only:
+                results[name] = await bench_requests(send, iterations, warmup, concurrency)
+
+    return report
+
+
+def dataset(storage) -> dict:
+    """Storage backend and row counts of the benchmarked data"""
+    if storage.name != "sqlite":
+        metrics = storage.metrics()
+        return {key: metrics.get(key) for key in ("backend", "users", "crushes", "matches")}
+
+    import app.database as db
+    import app.sharding as sharding
+    shards = sharding.status()["shards"]
+    with db.get_connection() as conn:
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    return {
+        "backend": storage.name,
+        "users": users,
+        "crushes": sum(shard["crushes"] for shard in shards),
+        "matches": sum(shard["matches"] for shard in shards),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> Tuple[List[str], List[str]]:
+    """(one line per benchmark in both reports, the regressions among them)"""
+    lines, regressions = [], []
+    for name, after in result["results"].items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        p99 = after["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        throughput = after["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        line = (f"{name}: p99 {before['p99_ms']:.3f} -> {after['p99_ms']:.3f} ms ({p99:+.0%}), "
+                f"throughput {before['throughput']:.0f} -> {after['throughput']:.0f}/s ({throughput:+.0%})")
+        lines.append(line)
+        if p99 > tolerance or throughput < -tolerance:
+            regressions.append(line)
+    return lines, regressions
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark matcher functions and HTTP endpoints")
+    parser.add_argument("--iterations", type=int, default=1000, help="measured operations per benchmark")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured operations first")
+    parser.add_argument("--concurrency", type=int, default=8, help="HTTP requests in flight")
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the sampled pairs")
+    parser.add_argument("--output", help="write the result to this JSON file")
+    parser.add_argument("--compare", help="compare to a result written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed p99 growth and throughput drop (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    only = args.only.split(",") if args.only else None
+    try:
+        result = asyncio.run(run(args.iterations, args.warmup, args.concurrency, only, args.seed))
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("dataset") != result["dataset"]:
+            print(f"Warning: baseline dataset {baseline.get('dataset')} differs from {result['dataset']}",
+                  file=sys.stderr)
+        lines, regressions = compare(result, baseline, args.tolerance)
+        for line in lines:
+            print(line, file=sys.stderr)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Shared fixtures. Every test runs against throwaway files: the defaults
+below are set before anything imports the app, so importing it never
+touches the real backend/app/crushes.db.
+"""
+
+import os
+import tempfile
+
+_SCRATCH = tempfile.mkdtemp(prefix="crush-tests-")
+os.environ.setdefault("CRUSH_DB_PATH", os.path.join(_SCRATCH, "crushes.db"))
+os.environ.setdefault("CRUSH_MEMORY_PATH", os.path.join(_SCRATCH, "crushes.mem"))
+os.environ.setdefault("CRUSH_LAZY_INIT", "1")
+
+import pytest
+
+import app.database as db
+from app.shard_layout import ShardSet
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    """Point app.database at fresh shard files in tmp_path; call with the shard count"""
+    opened = []
+
+    def make(shard_count: int = 1) -> ShardSet:
+        path = str(tmp_path / "crushes.db")
+        shard_set = ShardSet(path)
+        opened.append(shard_set)
+        monkeypatch.setattr(db, "DATABASE_PATH", path)
+        monkeypatch.setattr(db, "shards", shard_set)
+        monkeypatch.setattr(db, "pool", shard_set.home)
+        if shard_count > 1:
+            shard_set.set_layout(shard_count)
+        db.init_db()
+        return shard_set
+
+    yield make
+    for shard_set in opened:
+        shard_set.close()
+
+
+def wallet(n: int) -> str:
+    """A distinct, well-formed wallet address"""
+    return "0x" + f"{n:040x}"
@@ -0,0 +1,64 @@
+"""Bounded executor for blocking storage calls (app.async_database)"""
+
+import asyncio
+import threading
+
+import pytest
+
+from app.async_database import DatabaseExecutor
+
+
+async def wait_for(condition, timeout: float = 5.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def test_callers_past_max_pending_wait():
+    executor = DatabaseExecutor(max_workers=1, max_pending=2)
+    release = threading.Event()
+
+    def blocking(n: int) -> int:
+        release.wait(5)
+        return n
+
+    async def run():
+        calls = [asyncio.ensure_future(executor.run(blocking, n)) for n in range(5)]
+        # One call runs, one is queued behind it and the rest wait for a slot
+        await wait_for(lambda: executor.metrics()["running"] == 1)
+        await wait_for(lambda: executor.metrics()["waiting"] == 3)
+        during = executor.metrics()
+        release.set()
+        return during, await asyncio.gather(*calls)
+
+    try:
+        during, results = asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+    assert results == [0, 1, 2, 3, 4]
+    assert during["queue_depth"] == 1
+    metrics = executor.metrics()
+    assert metrics["max_queue_depth"] <= executor.max_pending
+    assert metrics["completed"] == 5
+    assert metrics["waiting"] == metrics["queue_depth"] == metrics["running"] == 0
+
+
+def test_failures_are_raised_and_counted():
+    executor = DatabaseExecutor(max_workers=2, max_pending=2)
+
+    def fails():
+        raise ValueError("boom")
+
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(executor.run(fails))
+        assert asyncio.run(executor.run(sum, [1, 2])) == 3
+    finally:
+        executor.shutdown()
+
+    metrics = executor.metrics()
+    assert metrics["failed"] == 1
+    assert metrics["completed"] == 1
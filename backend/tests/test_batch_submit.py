@@ -0,0 +1,56 @@
+"""Batch crush submission (/api/crush/submit/batch)"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.database as db
+import app.main as main
+from tests.conftest import wallet
+
+
+def submission(crusher: str, crush: str) -> dict:
+    return {"crusher_address": crusher, "crush_address": crush}
+
+
+def test_oversized_batch_is_rejected(make_db, monkeypatch):
+    make_db(1)
+    monkeypatch.setattr(main, "MAX_BATCH_SIZE", 3)
+    client = TestClient(main.app)
+
+    batch = [submission(wallet(1), wallet(n)) for n in range(2, 6)]
+    response = client.post("/api/crush/submit/batch", json=batch)
+    assert response.status_code == 400
+    assert db.get_crushes_by_user(wallet(1)) == []
+
+    response = client.post("/api/crush/submit/batch", json=batch[:3])
+    assert response.status_code == 200
+    assert len(db.get_crushes_by_user(wallet(1))) == 3
+
+
+@pytest.mark.parametrize("shard_count", [1, 4])
+def test_invalid_items_fail_alone_and_mutual_pairs_match(make_db, shard_count):
+    make_db(shard_count)
+    a, b, c = wallet(1), wallet(2), wallet(0xabc)
+    client = TestClient(main.app)
+
+    response = client.post("/api/crush/submit/batch", json=[
+        submission(a, b),
+        # The same address in another case is still a self-crush
+        submission(c, c.upper().replace("0X", "0x")),
+        submission(b, a),
+        submission(a, ""),
+        submission(a, c),
+    ])
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["success"] for result in results] == [True, False, True, False, True]
+    assert "yourself" in results[1]["message"]
+    assert results[1]["submission_id"] is None
+    assert "MATCH" in results[0]["message"] and "MATCH" in results[2]["message"]
+    assert "MATCH" not in results[4]["message"]
+
+    assert db.get_crushes_by_user(c) == []
+    assert len(db.get_crushes_by_user(a)) == 2
+    assert db.get_matches_for_user(a) == [b]
+    assert db.get_matches_for_user(c) == []
@@ -0,0 +1,53 @@
+"""Bulk import counts (app.bulk) and the admin import endpoint"""
+
+import json
+
+from fastapi.testclient import TestClient
+
+import app.bulk as bulk
+import app.database as db
+import app.main as main
+from app.fhe_matcher import address_hash
+from tests.conftest import wallet
+
+
+def ndjson(pairs) -> list:
+    return [json.dumps({"crusher_address": crusher, "crush_address": crush}) + "\n" for crusher, crush in pairs]
+
+
+def test_import_reports_inserted_and_duplicate_crushes(make_db):
+    make_db(1)
+    a, b, c = wallet(1), wallet(2), wallet(3)
+    assert db.add_crushes([(a, b"x", address_hash(c), address_hash(a))]) == 1
+
+    lines = ndjson([(a, b), (b, a), (a, b), (a, c), (c, c)]) + ["not json\n"]
+    result = bulk.import_crushes(lines, "ndjson", batch_size=2, defer=False)
+
+    assert result["crushes_inserted"] == 2
+    # (a, b) repeated in the file and (a, c) stored before the import
+    assert result["duplicates"] == 2
+    assert result["skipped"] == {"self_crush": 1, "invalid": 1}
+    assert result["matches_inserted"] == 1
+    assert len(db.get_crushes_by_user(a)) == 2
+
+
+def test_add_crushes_returns_none_on_failure(make_db):
+    make_db(1)
+    assert db.add_crushes([(wallet(1), b"x", None, "00")]) is None
+
+
+def test_http_import_refuses_deferred_indexes(make_db, monkeypatch):
+    make_db(1)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    client = TestClient(main.app)
+    body = "".join(ndjson([(wallet(1), wallet(2))]))
+
+    response = client.post(
+        "/api/admin/import", params={"defer_indexes": "true"}, content=body, headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 400
+    assert db.get_crushes_by_user(wallet(1)) == []
+
+    response = client.post("/api/admin/import", content=body, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["crushes_inserted"] == 1
@@ -0,0 +1,89 @@
+"""Online conversion from the text to the binary storage format (app.compact)"""
+
+import pytest
+
+import app.database as db
+from app.compact import compact
+from app.fhe_matcher import address_hash, encrypt_crush
+from tests.conftest import wallet
+
+
+def add_crush(crusher: str, crush: str) -> bool:
+    encrypted, crush_hash = encrypt_crush(crush)
+    return db.add_crush(crusher, encrypted, crush_hash, address_hash(crusher))
+
+
+def column_types(shard_set, table: str, column: str) -> set:
+    types = set()
+    for shard in shard_set.all():
+        with shard_set.connection(shard) as conn:
+            types |= {row[0] for row in conn.execute(f"SELECT DISTINCT typeof({column}) FROM {table}")}
+    return types
+
+
+def snapshot(users) -> dict:
+    return {
+        user: (
+            sorted((row["crush_address_hash"], row["crusher_address_hash"]) for row in db.get_crushes_by_user(user)),
+            sorted(db.get_matches_for_user(user)),
+            db.get_user_stats(user)["crushes_sent"],
+            db.get_user_stats(user)["matches_count"],
+        )
+        for user in users
+    }
+
+
+@pytest.mark.parametrize("shard_count", [1, 2])
+def test_text_database_is_packed_without_losing_rows(make_db, shard_count):
+    shard_set = make_db(shard_count)
+    # A database from before the binary format
+    shard_set.set_format("text")
+    users = [wallet(n) for n in range(1, 11)]
+    for crusher, crush in zip(users, users[1:] + users[:1]):
+        assert add_crush(crusher, crush)
+    for a, b in zip(users[::2], users[1::2]):
+        assert add_crush(b, a)
+        assert db.add_match(a, b)
+    db.set_match_proof(users[0], users[1], "proof")
+    before = snapshot(users)
+    assert column_types(shard_set, "crushes", "crusher_address") == {"text"}
+
+    result = compact(chunk_size=3, settle=0)
+
+    assert result["packed_crushes"] == 15
+    assert result["packed_matches"] == 5
+    assert result["stragglers"] == 0
+    assert shard_set.binary
+    for table, column in (("crushes", "crusher_address"), ("crushes", "crush_address_hash"),
+                          ("crushes", "crusher_address_hash"), ("matches", "user1_address")):
+        assert column_types(shard_set, table, column) == {"blob"}
+
+    assert snapshot(users) == before
+    assert db.check_mutual_crush(users[0], users[1])
+    assert db.get_match_proof(users[1], users[0]) == "proof"
+    # The pair stays unique in its packed form
+    assert db.add_match(users[1], users[0]) is None
+
+
+def test_rows_written_in_text_after_the_switch_are_packed(make_db):
+    shard_set = make_db(1)
+    shard_set.set_format("text")
+    a, b = wallet(1), wallet(2)
+    add_crush(a, b)
+    compact(settle=0)
+
+    # A worker that hadn't seen the switch yet writes the text form
+    encrypted, crush_hash = encrypt_crush(a)
+    with db.transaction() as conn:
+        conn.execute("""
+            INSERT INTO crushes (crusher_address, crush_address_encrypted, crush_address_hash, crusher_address_hash)
+            VALUES (?, ?, ?, ?)
+        """, (b, encrypted, crush_hash, address_hash(b)))
+
+    result = compact(settle=0)
+
+    assert result["stragglers"] == 1
+    assert column_types(shard_set, "crushes", "crusher_address") == {"blob"}
+    assert db.check_mutual_crush(a, b)
+    assert db.get_matches_for_user(a) == [b]
+    assert db.get_user_stats(b)["crushes_sent"] == 1
@@ -0,0 +1,91 @@
+"""Vectorized compatibility scoring against the scalar scorer (app.compatibility)"""
+
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.compatibility import (
+    calculate_compatibility, encode_addresses, is_standard_address, score_batch, score_features, score_matrix
+)
+
+
+def random_addresses(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    addresses = ["0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40)) for _ in range(count)]
+    # Edge cases: repeated characters, upper case and the same address twice
+    return addresses + ["0x" + "0" * 40, "0x" + "f" * 40, "0x" + "AbCdEf0123" * 4, addresses[0]]
+
+
+def test_score_features_equals_scalar_scores():
+    sources = random_addresses(40, seed=1)
+    candidates = random_addresses(60, seed=2)
+
+    scores = score_features(encode_addresses(sources), encode_addresses(candidates))
+
+    assert scores.shape == (len(sources), len(candidates))
+    for i, source in enumerate(sources):
+        for j, candidate in enumerate(candidates):
+            assert scores[i, j] == calculate_compatibility(source, candidate), (source, candidate)
+
+
+def test_score_features_blocks_give_the_same_scores(monkeypatch):
+    import app.compatibility as compatibility
+    sources = random_addresses(30, seed=3)
+    candidates = random_addresses(20, seed=4)
+    whole = score_features(encode_addresses(sources), encode_addresses(candidates))
+
+    # One source row per block
+    monkeypatch.setattr(compatibility, "MAX_BLOCK_ELEMENTS", 1)
+    blocked = score_features(encode_addresses(sources), encode_addresses(candidates))
+    assert (blocked == whole).all()
+
+
+def test_non_standard_addresses_fall_back_to_the_scalar_scorer():
+    sources = ["0x" + "a1" * 20, "0xabc", "0x" + "d4" * 21]
+    candidates = ["0x" + "b2" * 20, "0x1234", "0x" + "c3" * 20]
+
+    features = encode_addresses(sources)
+    assert features.valid.tolist() == [True, False, False]
+
+    scores = score_matrix(sources, candidates)
+    for i, source in enumerate(sources):
+        for j, candidate in enumerate(candidates):
+            assert scores[i, j] == calculate_compatibility(source, candidate)
+    assert score_batch(sources[0], candidates) == [calculate_compatibility(sources[0], c) for c in candidates]
+
+
+def test_score_matrix_rejects_what_the_scalar_scorer_rejects():
+    with pytest.raises(ValueError):
+        calculate_compatibility("0x" + "g" * 40, "0x" + "a" * 40)
+    with pytest.raises(ValueError):
+        score_matrix(["0x" + "g" * 40], ["0x" + "a" * 40])
+
+
+def test_is_standard_address():
+    assert is_standard_address("0x" + "aB" * 20)
+    assert is_standard_address("ab" * 20)
+    assert not is_standard_address("0xabc")
+    assert not is_standard_address("0x" + "g" * 40)
+    assert not is_standard_address("0x" + "d4" * 21)
+
+
+def test_batch_endpoint_bounds_scalar_scoring(monkeypatch):
+    import app.main as main
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "MAX_SCALAR_COMPATIBILITY_PAIRS", 5)
+    standard = random_addresses(3, seed=5)[:3]
+
+    response = client.post("/api/compatibility/batch", json={"addresses": standard, "candidates": standard})
+    assert response.status_code == 200
+    assert response.json()["scores"][0][1] == calculate_compatibility(standard[0], standard[1])
+
+    # One short candidate means one scalar call per source: 3 pairs
+    response = client.post("/api/compatibility/batch", json={"addresses": standard, "candidates": standard + ["0xabc"]})
+    assert response.status_code == 200
+
+    # A short source is scored against every candidate: 4 + 3 pairs
+    response = client.post(
+        "/api/compatibility/batch", json={"addresses": standard + ["0xabc"], "candidates": standard + ["0xdef"]}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,42 @@
+"""Repair of the per-wallet counters (app.counters)"""
+
+import pytest
+
+import app.database as db
+from app.counters import repair_counters
+from app.fhe_matcher import address_hash
+from tests.conftest import wallet
+
+
+def counters() -> dict:
+    with db.get_connection() as conn:
+        return {
+            row["wallet_address"]: (row["crushes_sent"], row["matches_count"])
+            for row in conn.execute("SELECT wallet_address, crushes_sent, matches_count FROM user_counters")
+        }
+
+
+@pytest.mark.parametrize("shard_count", [1, 4])
+def test_drifted_counters_are_repaired(make_db, shard_count):
+    make_db(shard_count)
+    a, b, c, ghost = wallet(1), wallet(2), wallet(3), wallet(4)
+    for crusher, crush in ((a, b), (b, a), (a, c)):
+        assert db.add_crush(crusher, b"encrypted", address_hash(crush), address_hash(crusher))
+    assert db.add_match(a, b)
+    assert counters() == {a: (2, 1), b: (1, 1)}
+    versions = {address: db.get_user_version(address) for address in (a, b, c)}
+
+    # A wrong row, a missing row and a stale row for a wallet with no activity
+    with db.transaction() as conn:
+        conn.execute("UPDATE user_counters SET crushes_sent = 7 WHERE wallet_address = ?", (a,))
+        conn.execute("DELETE FROM user_counters WHERE wallet_address = ?", (b,))
+        conn.execute("INSERT INTO user_counters (wallet_address, crushes_sent) VALUES (?, 1)", (ghost,))
+
+    result = repair_counters()
+
+    assert result["repaired"] == 3
+    assert counters() == {a: (2, 1), b: (1, 1)}
+    assert db.get_user_version(a) > versions[a]
+    assert db.get_user_version(b) > versions[b]
+    assert db.get_user_version(c) == versions[c]
+    assert repair_counters()["repaired"] == 0
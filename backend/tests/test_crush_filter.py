@@ -0,0 +1,77 @@
+"""Bloom filter over crush edges (app.crush_filter)"""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.database as db
+import app.main as main
+from app.crush_filter import CrushFilter
+from app.db_pool import TimedConnection, open_connection
+from app.fhe_matcher import address_hash
+from tests.conftest import wallet
+
+
+@pytest.fixture
+def crush_filter(make_db, monkeypatch):
+    """A built filter over a fresh database, used by the app"""
+    make_db(1)
+    a, b = wallet(1), wallet(2)
+    assert db.add_crush(a, b"encrypted", address_hash(b), address_hash(a))
+
+    crush_filter = CrushFilter(enabled=True, capacity=1000, snapshot_path="", database_path=db.DATABASE_PATH)
+    conn = open_connection(db.DATABASE_PATH)
+    try:
+        crush_filter.rebuild(conn)
+    finally:
+        conn.close()
+    monkeypatch.setattr(main, "crush_filter", crush_filter)
+    return crush_filter
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """SQL statements run on any connection from here on"""
+    statements = []
+    record = TimedConnection._record
+
+    def counting(self, sql, *args, **kwargs):
+        statements.append(sql)
+        return record(self, sql, *args, **kwargs)
+
+    monkeypatch.setattr(TimedConnection, "_record", counting)
+    return statements
+
+
+def test_negative_check_match_skips_the_database(crush_filter, queries):
+    response = TestClient(main.app).get(
+        "/api/check-match", params={"address1": wallet(1), "address2": wallet(3)}
+    )
+
+    assert response.json()["is_match"] is False
+    assert queries == []
+    assert crush_filter.metrics()["probes_saved"] == 1
+
+
+def test_negative_match_check_skips_the_database(crush_filter, queries):
+    a, b = wallet(1), wallet(2)
+    # b never submitted a, so the reverse edge is ruled out by the filter
+    found = asyncio.run(main.check_for_matches(a, b, address_hash(a), address_hash(b)))
+
+    assert found is False
+    assert queries == []
+    assert crush_filter.metrics()["probes_saved"] == 1
+
+
+def test_possible_match_is_looked_up(crush_filter, queries):
+    a, b = wallet(1), wallet(2)
+    assert db.add_crush(b, b"encrypted", address_hash(a), address_hash(b))
+    crush_filter.add(address_hash(b), address_hash(a))
+    queries.clear()
+
+    found = asyncio.run(main.check_for_matches(b, a, address_hash(b), address_hash(a)))
+
+    assert found is True
+    assert queries
+    assert crush_filter.metrics()["probes_saved"] == 0
@@ -0,0 +1,82 @@
+"""SQLite connection pool (app.db_pool)"""
+
+import threading
+
+import pytest
+
+from app.db_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, timeout=0.1)
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused(pool):
+    with pool.connection() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with pool.connection() as conn:
+        assert conn is first
+    assert pool.stats() == {"size": 2, "open": 1, "idle": 1, "in_use": 0}
+
+
+def test_exhausted_pool_times_out(pool):
+    held = [pool.acquire(), pool.acquire()]
+    assert pool.stats()["in_use"] == 2
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+    pool.release(held.pop())
+    assert pool.acquire() is not None
+
+
+def test_waiter_gets_a_released_connection(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1, timeout=5)
+    conn = pool.acquire()
+    borrowed = []
+    waiter = threading.Thread(target=lambda: borrowed.append(pool.acquire()))
+    waiter.start()
+
+    pool.release(conn)
+    waiter.join()
+    assert borrowed == [conn]
+    assert pool.stats()["open"] == 1
+    pool.release(conn)
+    pool.close()
+
+
+def test_transaction_commits_or_rolls_back(pool):
+    with pool.transaction() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pytest.raises(RuntimeError):
+        with pool.transaction() as conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+            raise RuntimeError("boom")
+
+    with pool.connection() as conn:
+        assert [row[0] for row in conn.execute("SELECT x FROM t")] == [1]
+
+
+def test_release_discards_an_open_transaction(pool):
+    conn = pool.acquire()
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    conn.execute("INSERT INTO t VALUES (1)")
+    pool.release(conn)
+
+    assert not conn.in_transaction
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+
+def test_close_keeps_the_pool_usable(pool):
+    with pool.connection():
+        pass
+    pool.close()
+    assert pool.stats()["open"] == 0
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone()[0] == 1
@@ -0,0 +1,60 @@
+"""Keyset pagination of /api/matches and its cursors (app.main)"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.database as db
+import app.main as main
+from app.main import decode_match_cursor, encode_match_cursor
+from tests.conftest import wallet
+
+
+@pytest.mark.parametrize("key", [
+    ("2026-01-02 03:04:05", 1),
+    ("2026-01-02 03:04:05.123456", 123456789),
+    ("", 0),
+    ("odd|value", 7),
+])
+def test_cursor_round_trip(key):
+    cursor = encode_match_cursor(*key)
+    assert "=" not in cursor
+    assert decode_match_cursor(cursor) == key
+
+
+@pytest.mark.parametrize("cursor", ["", "!!!", encode_match_cursor("x", 1)[:-3], "bm8tc2VwYXJhdG9y"])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_match_cursor(cursor)
+
+
+@pytest.mark.parametrize("shard_count", [1, 4])
+def test_pages_follow_next_cursor_to_the_full_list(make_db, shard_count):
+    make_db(shard_count)
+    me = wallet(1)
+    partners = [wallet(n) for n in range(2, 12)]
+    for partner in partners:
+        assert db.add_match(partner, me)
+    client = TestClient(main.app)
+
+    everything = client.get(f"/api/matches/{me}").json()
+    assert sorted(match["matched_address"] for match in everything) == partners
+
+    pages = []
+    params = {"limit": 3}
+    while True:
+        response = client.get(f"/api/matches/{me}", params=params)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params = {"limit": 3, "after": cursor}
+
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert [match for page in pages for match in page] == everything
+
+
+def test_bad_cursor_is_rejected(make_db):
+    make_db(1)
+    response = TestClient(main.app).get(f"/api/matches/{wallet(1)}", params={"limit": 3, "after": "!!!"})
+    assert response.status_code == 400
@@ -0,0 +1,127 @@
+"""Snapshot and log replay of the in-memory engine (app.memory_storage)"""
+
+import os
+import subprocess
+import sys
+
+from app.fhe_matcher import address_hash, encrypt_crush
+from app.memory_storage import MemoryStorage
+from tests.conftest import wallet
+
+A, B, C = wallet(1), wallet(2), wallet(3)
+
+
+def open_storage(tmp_path) -> MemoryStorage:
+    return MemoryStorage(str(tmp_path / "crushes.mem"), snapshot_interval=0)
+
+
+def crash(storage: MemoryStorage) -> None:
+    """Drop the engine without the final snapshot close() writes"""
+    storage._log.close()
+    storage._log = None
+
+
+def add_crush(storage: MemoryStorage, crusher: str, crush: str) -> bool:
+    encrypted, crush_hash = encrypt_crush(crush)
+    return storage.add_crush(crusher, encrypted, crush_hash, address_hash(crusher))
+
+
+def state(storage: MemoryStorage) -> dict:
+    return {
+        "users": storage.get_users_after(0, 100),
+        "crushes": {w: storage.get_crushes_by_user(w) for w in (A, B, C)},
+        "matches": {w: storage.get_matches_page(w, 100) for w in (A, B, C)},
+        "stats": {w: storage.get_user_stats(w) for w in (A, B, C)},
+        "versions": {w: storage.get_user_version(w) for w in (A, B, C)},
+        "proof": storage.get_match_proof(A, B),
+    }
+
+
+def populate(storage: MemoryStorage) -> None:
+    storage.register_user(A, "alice")
+    storage.register_user(B)
+    add_crush(storage, A, B)
+    add_crush(storage, B, A)
+    add_crush(storage, A, C)
+    assert storage.add_match(A, B)
+    storage.set_match_proof(A, B, "proof")
+
+
+def test_log_replay_without_snapshot(tmp_path):
+    storage = open_storage(tmp_path)
+    populate(storage)
+    assert storage.remove_crush(A, address_hash(C))
+    expected = state(storage)
+    crash(storage)
+
+    assert not os.path.exists(tmp_path / "crushes.mem.snapshot")
+    reopened = open_storage(tmp_path)
+    assert state(reopened) == expected
+    assert reopened.check_mutual_crush(A, B)
+    reopened.close()
+
+
+def test_snapshot_plus_newer_log_records(tmp_path):
+    storage = open_storage(tmp_path)
+    populate(storage)
+    assert storage.snapshot()
+    # Written after the snapshot: only in the cut-down log
+    add_crush(storage, C, A)
+    storage.register_user(C, "carol")
+    expected = state(storage)
+    crash(storage)
+
+    reopened = open_storage(tmp_path)
+    assert state(reopened) == expected
+    assert reopened.metrics()["ops_since_snapshot"] == 2
+
+    # New ids continue after the restored ones
+    add_crush(reopened, B, C)
+    ids = [row["id"] for w in (A, B, C) for row in reopened.get_crushes_by_user(w)]
+    assert len(ids) == len(set(ids))
+    reopened.close()
+
+
+def test_torn_log_tail_is_dropped(tmp_path):
+    storage = open_storage(tmp_path)
+    populate(storage)
+    expected = state(storage)
+    crash(storage)
+
+    log_path = tmp_path / "crushes.mem.log"
+    with open(log_path, "ab") as f:
+        f.write(b'["c","' + C.encode() + b'","')
+    torn_size = os.path.getsize(log_path)
+
+    reopened = open_storage(tmp_path)
+    assert state(reopened) == expected
+    assert os.path.getsize(log_path) < torn_size
+
+    # Records appended after recovery start on a clean line
+    add_crush(reopened, C, B)
+    expected = state(reopened)
+    crash(reopened)
+
+    again = open_storage(tmp_path)
+    assert state(again) == expected
+    assert len(again.get_crushes_by_user(C)) == 1
+    again.close()
+
+
+def test_memory_engine_never_opens_sqlite(tmp_path):
+    env = dict(
+        os.environ,
+        CRUSH_STORAGE_BACKEND="memory",
+        CRUSH_DB_PATH=str(tmp_path / "crushes.db"),
+        CRUSH_MEMORY_PATH=str(tmp_path / "crushes.mem"),
+        CRUSH_LAZY_INIT="0",
+    )
+    code = "import sys, app.main; print('app.database' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"
+    assert not os.path.exists(tmp_path / "crushes.db")
@@ -0,0 +1,69 @@
+"""Versioned schema migrations (app.migrations)"""
+
+import pytest
+
+import app.migrations as migrations
+from app.db_pool import open_connection
+from app.fhe_matcher import address_hash
+from app.migrations import MIGRATIONS, Migration, current_version, migrate
+from tests.conftest import wallet
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = open_connection(str(tmp_path / "crushes.db"))
+    yield conn
+    conn.close()
+
+
+def tables(conn) -> set:
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_fresh_database_is_migrated_once(conn):
+    applied = migrate(conn)
+
+    assert [m.version for m in applied] == [m.version for m in MIGRATIONS]
+    assert current_version(conn) == MIGRATIONS[-1].version
+    assert {"crushes", "matches", "users", "user_counters", "storage_format"} <= tables(conn)
+    assert conn.execute("SELECT format FROM storage_format").fetchone()[0] == "binary"
+    assert migrate(conn) == []
+
+
+def test_unversioned_database_is_upgraded_in_place(conn):
+    # A database from before schema_version: the original tables with data
+    MIGRATIONS[0].apply(conn)
+    a, b = wallet(1), wallet(2)
+    conn.execute("""
+        INSERT INTO crushes (crusher_address, crush_address_encrypted, crush_address_hash)
+        VALUES (?, 'encrypted', ?)
+    """, (a, address_hash(b)))
+    conn.execute("INSERT INTO matches (user1_address, user2_address) VALUES (?, ?)", (a, b))
+    conn.commit()
+
+    migrate(conn)
+
+    assert current_version(conn) == MIGRATIONS[-1].version
+    assert conn.execute("SELECT crusher_address_hash FROM crushes").fetchone()[0] == address_hash(a)
+    counters = {row[0]: (row[1], row[2]) for row in conn.execute(
+        "SELECT wallet_address, crushes_sent, matches_count FROM user_counters"
+    )}
+    assert counters == {a: (1, 1), b: (0, 1)}
+    # Existing rows keep the text format until they are compacted
+    assert conn.execute("SELECT format FROM storage_format").fetchone()[0] == "text"
+
+
+def test_failed_migration_is_rolled_back(conn, monkeypatch):
+    migrate(conn)
+    version = current_version(conn)
+
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (x INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS + [Migration(version + 1, "broken", broken)])
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+
+    assert current_version(conn) == version
+    assert "half_done" not in tables(conn)
@@ -0,0 +1,76 @@
+"""Binary (v2) and legacy JSON match proofs (app.fhe_matcher)"""
+
+import base64
+
+from app.fhe_matcher import PROOF_SIZE, PROOF_VERSION, FHECrushMatcher
+
+A = "0x" + "12ab" * 10
+B = "0x" + "cd34" * 10
+C = "0x" + "ef56" * 10
+
+
+def matcher(key: bytes = b"k" * 32) -> FHECrushMatcher:
+    return FHECrushMatcher(secret_key=key)
+
+
+def test_binary_proof_layout():
+    proof = matcher().create_match_proof(A, B)
+    raw = base64.urlsafe_b64decode(proof)
+
+    assert len(raw) == PROOF_SIZE
+    assert raw[0] == PROOF_VERSION
+    assert raw[1:41] == bytes.fromhex(A[2:]) + bytes.fromhex(B[2:])
+
+
+def test_binary_proof_verifies_in_either_order_and_case():
+    m = matcher()
+    proof = m.create_match_proof(B, A)
+
+    assert proof == m.create_match_proof(A, B)
+    assert m.verify_match_proof(proof, A, B)
+    assert m.verify_match_proof(proof, B.upper().replace("0X", "0x"), A)
+
+
+def test_binary_proof_rejects_other_pairs_keys_and_tampering():
+    m = matcher()
+    proof = m.create_match_proof(A, B)
+    raw = bytearray(base64.urlsafe_b64decode(proof))
+    raw[-1] ^= 1
+
+    assert not m.verify_match_proof(proof, A, C)
+    assert not matcher(b"x" * 32).verify_match_proof(proof, A, B)
+    assert not m.verify_match_proof(base64.urlsafe_b64encode(bytes(raw)).decode(), A, B)
+    assert not m.verify_match_proof(base64.urlsafe_b64encode(bytes(raw[:-1])).decode(), A, B)
+    assert not m.verify_match_proof("not a proof", A, B)
+
+
+def test_legacy_base64_proofs_still_verify():
+    m = matcher()
+    # Issued before the binary format existed, for standard addresses too
+    legacy = m._create_legacy_proof(A, B)
+    assert base64.b64decode(legacy).startswith(b"{")
+
+    assert m.verify_match_proof(legacy, B, A)
+    assert not m.verify_match_proof(legacy, A, C)
+    assert not matcher(b"x" * 32).verify_match_proof(legacy, A, B)
+
+
+def test_non_standard_addresses_get_legacy_proofs():
+    m = matcher()
+    proof = m.create_match_proof("alice.eth", A)
+
+    assert base64.b64decode(proof).startswith(b"{")
+    assert m.verify_match_proof(proof, A, "alice.eth")
+
+
+def test_batch_verification_matches_single_verification():
+    m = matcher()
+    items = [
+        (m.create_match_proof(A, B), A, B),
+        (m._create_legacy_proof(A, C), C, A),
+        (m.create_match_proof(A, B), A, C),
+        ("garbage", A, B),
+    ]
+
+    assert m.verify_match_proofs(items) == [True, True, False, False]
+    assert m.verify_match_proofs(items) == [m.verify_match_proof(*item) for item in items]
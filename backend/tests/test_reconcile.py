@@ -0,0 +1,62 @@
+"""Whole-graph match reconciliation (app.reconcile)"""
+
+import pytest
+
+import app.database as db
+from app.fhe_matcher import address_hash
+from app.reconcile import get_status, run_reconciliation
+from tests.conftest import wallet
+
+
+class Interrupted(Exception):
+    pass
+
+
+def add_mutual_pairs(count: int) -> list:
+    """Mutual crush pairs stored without their matches (as after a crash)"""
+    pairs = []
+    for n in range(count):
+        a, b = wallet(2 * n + 1), wallet(2 * n + 2)
+        assert db.add_crush(a, b"encrypted", address_hash(b), address_hash(a))
+        assert db.add_crush(b, b"encrypted", address_hash(a), address_hash(b))
+        pairs.append((a, b))
+    return pairs
+
+
+@pytest.mark.parametrize("shard_count", [1, 4])
+def test_interrupted_run_resumes_from_its_checkpoint(make_db, shard_count):
+    make_db(shard_count)
+    pairs = add_mutual_pairs(10)
+
+    def stop_after_first_chunk(state):
+        raise Interrupted
+
+    with pytest.raises(Interrupted):
+        run_reconciliation(chunk_size=4, progress=stop_after_first_chunk)
+    interrupted = get_status()
+    assert interrupted["finished_at"] is None
+    assert 0 < interrupted["matches_inserted"] < len(pairs)
+
+    state = run_reconciliation(chunk_size=4)
+
+    assert state["finished_at"] is not None
+    # Every crush is scanned once across both runs: no chunk is redone
+    assert state["scanned"] == 2 * len(pairs)
+    assert state["matches_found"] == state["matches_inserted"] == len(pairs)
+    for a, b in pairs:
+        assert db.get_matches_for_user(a) == [b]
+
+
+def test_finished_run_starts_over_and_finds_nothing_new(make_db):
+    make_db(1)
+    pairs = add_mutual_pairs(3)
+
+    first = run_reconciliation(chunk_size=2)
+    again = run_reconciliation(chunk_size=2)
+    restarted = run_reconciliation(chunk_size=2, restart=True)
+
+    assert first["matches_inserted"] == len(pairs)
+    for state in (again, restarted):
+        assert state["scanned"] == 2 * len(pairs)
+        assert state["matches_found"] == len(pairs)
+        assert state["matches_inserted"] == 0
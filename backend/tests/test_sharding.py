@@ -0,0 +1,195 @@
+"""Sharded storage over local shard files (app.shard_layout, app.sharding)"""
+
+import itertools
+
+import app.database as db
+import app.sharding as sharding
+from app.encoding import unpack_address, unpack_hash
+from app.fhe_matcher import address_hash
+from app.shard_layout import MAX_SHARDS, pair_key, route
+from tests.conftest import wallet
+
+
+def add_crush(crusher: str, crush: str) -> bool:
+    return db.add_crush(crusher, b"encrypted", address_hash(crush), address_hash(crusher))
+
+
+def rows_per_shard(shard_set, table: str) -> dict:
+    counts = {}
+    for shard in shard_set.all():
+        with shard_set.connection(shard) as conn:
+            counts[shard] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return counts
+
+
+def counters() -> dict:
+    with db.get_connection() as conn:
+        return {
+            row["wallet_address"]: (row["crushes_sent"], row["matches_count"])
+            for row in conn.execute("SELECT wallet_address, crushes_sent, matches_count FROM user_counters")
+        }
+
+
+def pair_on_shards(shard_count: int, different: bool):
+    """Two wallets whose crush rows route to different (or the same) shards"""
+    for a, b in itertools.combinations(range(1, 200), 2):
+        same = route(address_hash(wallet(a)), shard_count) == route(address_hash(wallet(b)), shard_count)
+        if same != different:
+            return wallet(a), wallet(b)
+    raise AssertionError("no such pair")
+
+
+def test_route_uses_key_prefix():
+    key = "0123456789abcdef" + "f" * 48
+    assert route(key, 1) == 0
+    assert route(key, 7) == int(key[:15], 16) % 7
+    # Only the first 15 hex digits count
+    assert route(key, 7) == route(key[:15] + "0" * 49, 7)
+
+
+def test_pair_key_ignores_order_and_case():
+    a, b = wallet(1), wallet(2)
+    assert pair_key(a, b) == pair_key(b, a) == pair_key(a.upper(), b)
+
+
+def test_crushes_are_stored_on_their_owner_shard(make_db):
+    shard_set = make_db(4)
+    crushers = [wallet(n) for n in range(1, 41)]
+    for crusher in crushers:
+        assert add_crush(crusher, wallet(1000))
+
+    expected = {shard: 0 for shard in range(4)}
+    for crusher in crushers:
+        expected[shard_set.owner(address_hash(crusher))] += 1
+    assert rows_per_shard(shard_set, "crushes") == expected
+    assert sum(1 for count in expected.values() if count) > 1
+    assert db.get_crushes_by_user(crushers[0])[0]["crusher_address"] == crushers[0]
+
+
+def test_mutual_crush_across_shards(make_db):
+    make_db(4)
+    a, b = pair_on_shards(4, different=True)
+
+    assert add_crush(a, b)
+    assert not db.check_mutual_crush(a, b)
+    assert not db.check_mutual_crush(b, a)
+
+    assert add_crush(b, a)
+    assert db.check_mutual_crush(a, b)
+    assert db.check_mutual_crush(b, a)
+    assert sharding.find_mutual_crushes([(a, b, address_hash(a))]) == [(a, b)]
+
+
+def test_add_match_across_shards(make_db):
+    shard_set = make_db(4)
+    a, b = pair_on_shards(4, different=True)
+    add_crush(a, b)
+    add_crush(b, a)
+
+    matched_at = db.add_match(b, a)
+    assert matched_at
+    # Recording the same pair again (in either order) is a no-op
+    assert db.add_match(a, b) is None
+
+    owner = shard_set.owner(pair_key(a, b))
+    assert rows_per_shard(shard_set, "matches") == {shard: int(shard == owner) for shard in range(4)}
+    assert db.get_matches_for_user(a) == [b]
+    assert db.get_matches_for_user(b) == [a]
+    assert counters()[a] == counters()[b] == (1, 1)
+
+
+def test_matches_page_merges_shards_in_keyset_order(make_db):
+    shard_set = make_db(4)
+    me = wallet(1)
+    partners = [wallet(n) for n in range(2, 32)]
+    for partner in partners:
+        assert db.add_match(me, partner)
+    assert sum(1 for count in rows_per_shard(shard_set, "matches").values() if count) > 1
+
+    seen = []
+    after = None
+    while True:
+        page = db.get_matches_page(me, 4, after)
+        if not page:
+            break
+        assert len(page) <= 4
+        seen.extend(page)
+        after = (page[-1][0], page[-1][1])
+
+    keys = [(matched_at, match_id) for matched_at, match_id, _ in seen]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert sorted(other for _, _, other in seen) == sorted(partners)
+    # Global ids encode the shard each row came from
+    for _, match_id, other in seen:
+        assert match_id % MAX_SHARDS == shard_set.owner(pair_key(me, other))
+
+
+def test_rebalance_doubles_shards_and_keeps_counters(make_db):
+    shard_set = make_db(2)
+    users = [wallet(n) for n in range(1, 25)]
+    for crusher, crush in zip(users, users[1:] + users[:1]):
+        assert add_crush(crusher, crush)
+    for a, b in zip(users[::2], users[1::2]):
+        assert db.add_match(a, b)
+    crushes_before = sum(rows_per_shard(shard_set, "crushes").values())
+    matches_before = sum(rows_per_shard(shard_set, "matches").values())
+    counters_before = counters()
+
+    result = sharding.rebalance(settle=0)
+
+    assert result["previous_count"] == 2
+    assert result["shard_count"] == 4
+    assert result["moved_crushes"] + result["moved_matches"] > 0
+    assert result["counters_repaired"] == 0
+    assert shard_set.layout(force=True) == (4, None)
+
+    crushes = rows_per_shard(shard_set, "crushes")
+    matches = rows_per_shard(shard_set, "matches")
+    assert set(crushes) == {0, 1, 2, 3}
+    assert sum(crushes.values()) == crushes_before == len(users)
+    assert sum(matches.values()) == matches_before == len(users) // 2
+
+    # Every row now lives on the shard that owns it under the new layout
+    # (rows are read back in either storage format)
+    for shard in range(4):
+        with shard_set.connection(shard) as conn:
+            for row in conn.execute("SELECT crusher_address_hash FROM crushes"):
+                assert route(unpack_hash(row[0]), 4) == shard
+            for row in conn.execute("SELECT user1_address, user2_address FROM matches"):
+                assert route(pair_key(unpack_address(row[0]), unpack_address(row[1])), 4) == shard
+
+    assert counters() == counters_before
+    for user in users:
+        assert counters()[user] == (1, 1)
+        assert len(db.get_crushes_by_user(user)) == 1
+        assert len(db.get_matches_for_user(user)) == 1
+
+
+def test_failed_counter_update_is_repaired(make_db, monkeypatch):
+    make_db(4)
+    a, b = pair_on_shards(4, different=True)
+    add_crush(a, b)
+    add_crush(b, a)
+
+    import app.counters
+    repairs = []
+    repair_counters = app.counters.repair_counters
+    monkeypatch.setattr(app.counters, "repair_counters", lambda: repairs.append(repair_counters()))
+
+    def fail(*args):
+        raise RuntimeError("disk I/O error")
+
+    # The data rows are committed before the shard-0 update fails, so the
+    # writes still succeed and the counters are recomputed from them
+    monkeypatch.setattr(db, "count_crushes", fail)
+    monkeypatch.setattr(db, "record_new_matches", fail)
+    c = wallet(500)
+    assert add_crush(a, c)
+    assert db.add_match(a, b)
+    assert db.remove_crush(b, address_hash(a))
+
+    assert len(repairs) == 3
+    assert [result["repaired"] for result in repairs] == [1, 2, 1]
+    assert counters()[a] == (2, 1)
+    assert counters()[b] == (0, 1)
@@ -0,0 +1,65 @@
+"""Group commits of the write pipeline (app.write_pipeline)"""
+
+import asyncio
+
+import app.database as db
+from app.fhe_matcher import address_hash
+from app.write_pipeline import WritePipeline
+from tests.conftest import wallet
+
+
+def test_failing_operation_is_rolled_back_alone(make_db):
+    make_db(1)
+    a, b, ghost = wallet(1), wallet(2), wallet(3)
+    pipeline = WritePipeline(enabled=True, batch_window=0.2, max_batch_size=16)
+
+    def fails_after_writing(conn, wallet_address):
+        db.upsert_user(conn, wallet_address)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            pipeline.add_crush(a, b"x", address_hash(b), address_hash(a)),
+            pipeline.submit("fails_after_writing", fails_after_writing, ghost),
+            pipeline.add_match(a, b),
+            pipeline.register_user(b),
+        )
+
+    try:
+        crush_added, failed, matched_at, registered = asyncio.run(run())
+    finally:
+        pipeline.close()
+
+    assert crush_added is True
+    assert failed is False
+    assert matched_at
+    assert registered is True
+
+    metrics = pipeline.metrics()
+    assert metrics["batches"] == 1
+    assert metrics["operations"] == 4
+    assert metrics["failed"] == 1
+
+    # The other operations of the batch were committed, the failing one's
+    # write was not
+    assert len(db.get_crushes_by_user(a)) == 1
+    assert db.get_matches_for_user(a) == [b]
+    with db.get_connection() as conn:
+        users = {row[0] for row in conn.execute("SELECT wallet_address FROM users")}
+    assert b in users
+    assert ghost not in users
+
+
+def test_concurrent_writes_share_commits(make_db):
+    make_db(1)
+    pipeline = WritePipeline(enabled=True, batch_window=0.05)
+
+    async def run():
+        return await asyncio.gather(*(pipeline.register_user(wallet(n)) for n in range(1, 21)))
+
+    try:
+        assert asyncio.run(run()) == [True] * 20
+    finally:
+        pipeline.close()
+    assert pipeline.metrics()["batches"] < 20
+    assert [address for _, address in db.get_users_after(0, 100)] == [wallet(n) for n in range(1, 21)]
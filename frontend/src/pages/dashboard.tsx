@@ -12,7 +12,7 @@ interface UserStats {
   wallet_address: string;
   crushes_sent: number;
   matches_count: number;
-  matches: string[];
+  matches: string[] | null;
 }
 
 interface Match {
@@ -61,6 +61,27 @@ export default function Dashboard() {
     }
   }, [address]);
 
+  // Live match notifications instead of polling
+  useEffect(() => {
+    if (!address) return;
+
+    const source = new EventSource(`${API_URL}/api/matches/${address}/stream`);
+    source.addEventListener('match', (event) => {
+      const match: Match = JSON.parse((event as MessageEvent).data);
+      // Newest last, like /api/matches
+      setMatches((prev) =>
+        prev.some((m) => m.matched_address === match.matched_address) ? prev : [...prev, match]
+      );
+      fetchStats();
+    });
+    source.addEventListener('resync', () => {
+      fetchStats();
+      fetchMatches();
+    });
+
+    return () => source.close();
+  }, [address]);
+
   const fetchStats = async () => {
     try {
       const res = await fetch(`${API_URL}/api/stats/${address}`);
@@ -75,7 +96,7 @@ export default function Dashboard() {
         wallet_address: address || '',
         crushes_sent: 0,
         matches_count: 0,
-        matches: [],
+        matches: null,
       });
     } finally {
       setLoading(false);